@@ -0,0 +1,177 @@
+"""
+Measure how long it takes to build a large schema and how much memory it
+holds.
+
+    PYTHONPATH=. python benchmarks/bench_build.py [--ports N] [--runs N] [--intern]
+
+The schema resembles a scan result record: a certificate SubRecordType
+with nested subrecords is used for the leaf and the chain of every TLS
+protocol on every port, and the protocol records use extends= to build on
+a common banner grab. Memory is measured with tracemalloc and counts everything allocated
+while the schema is built that is still alive afterwards. With --intern,
+the schema's leaves are also interned (Record.intern_leaves) and the
+report of that step is printed.
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from zschema.compounds import ListOf, Record, SubRecord, SubRecordType
+from zschema.keys import Port
+from zschema.leaves import (
+    Binary,
+    Boolean,
+    DateTime,
+    Enum,
+    IPv4Address,
+    String,
+    Unsigned32BitInteger,
+)
+
+
+def distinguished_name():
+    return SubRecord(
+        {
+            name: ListOf(String(doc="The %s of the name." % name))
+            for name in (
+                "common_name",
+                "country",
+                "locality",
+                "organization",
+                "organizational_unit",
+                "province",
+                "street_address",
+                "postal_code",
+                "serial_number",
+                "domain_component",
+            )
+        }
+    )
+
+
+def build(ports):
+    Certificate = SubRecordType(
+        {
+            "raw": Binary(),
+            "fingerprint_sha256": Binary(),
+            "subject": distinguished_name(),
+            "issuer": distinguished_name(),
+            "serial_number": String(),
+            "validity": SubRecord(
+                {
+                    "start": DateTime(),
+                    "end": DateTime(),
+                    "length": Unsigned32BitInteger(),
+                }
+            ),
+            "signature": SubRecord(
+                {
+                    "algorithm": Enum(values=["rsa", "ecdsa", "dsa"]),
+                    "value": Binary(),
+                    "valid": Boolean(),
+                    "self_signed": Boolean(),
+                }
+            ),
+            "extensions": SubRecord(
+                {
+                    "basic_constraints": SubRecord(
+                        {"is_ca": Boolean(), "max_path_len": Unsigned32BitInteger()}
+                    ),
+                    "subject_alt_name": SubRecord(
+                        {"dns_names": ListOf(String()), "ip": ListOf(IPv4Address())}
+                    ),
+                    "key_usage": SubRecord(
+                        {
+                            name: Boolean()
+                            for name in (
+                                "digital_signature",
+                                "key_encipherment",
+                                "data_encipherment",
+                                "key_agreement",
+                                "certificate_sign",
+                                "crl_sign",
+                            )
+                        }
+                    ),
+                }
+            ),
+        },
+        type_name="Certificate",
+    )
+    TLS = SubRecordType(
+        {
+            "version": Enum(values=["SSLv3", "TLSv1.0", "TLSv1.1", "TLSv1.2"]),
+            "cipher_suite": String(),
+            "certificate": Certificate(doc="The leaf certificate."),
+            "chain": ListOf(Certificate(doc="A chain certificate.")),
+        },
+        type_name="TLS",
+    )
+    banner_grab = SubRecord(
+        {"status": String(), "timestamp": DateTime(), "error": String()}
+    )
+    protocols = {}
+    for name in ("https", "smtps", "imaps", "pop3s", "ftps", "ldaps"):
+        protocols[name] = SubRecord(
+            {"tls": TLS(), "banner": String()}, extends=banner_grab
+        )
+    definition = {
+        "ip": IPv4Address(required=True),
+        "updated_at": DateTime(),
+    }
+    for i in range(ports):
+        definition[Port(1000 + i)] = SubRecord(
+            {
+                name: SubRecord({"port": Unsigned32BitInteger()}, extends=protocol)
+                for name, protocol in protocols.items()
+            }
+        )
+    return Record(definition)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ports", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--intern", action="store_true")
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        build(args.ports)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+
+    tracemalloc.start()
+    schema = build(args.ports)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    fields = sum(1 for _ in schema.to_flat())
+
+    print(
+        "build: median %.1f ms, min %.1f ms (%d runs, %d ports, %d fields)"
+        % (statistics.median(times), times[0], args.runs, args.ports, fields)
+    )
+    print("memory: %.1f MiB held, %.1f MiB peak" % (size / 2**20, peak / 2**20))
+    if args.intern:
+        start = time.perf_counter()
+        report = schema.intern_leaves()
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            "intern: %.1f ms, %d leaf fields, %d -> %d leaves, %d -> %d bytes"
+            % (
+                elapsed,
+                report["fields"],
+                report["leaves_before"],
+                report["leaves_after"],
+                report["bytes_before"],
+                report["bytes_after"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
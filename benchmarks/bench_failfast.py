@@ -0,0 +1,79 @@
+"""
+Compare full validation with fail-fast validation (Record.is_valid).
+
+    PYTHONPATH=. python benchmarks/bench_failfast.py [--records N] [--freeze]
+
+Records resembling scan results are validated against the schema of
+bench_build.py, as is and with one error: a field of the wrong type
+(found by the structural pass), an invalid Enum value (a cheap check) and
+an invalid Base64 value (a regular expression). Every record also holds
+DateTime fields, the most expensive checks.
+"""
+
+import argparse
+import copy
+import logging
+import time
+
+from bench_build import build
+from bench_threads import record
+
+
+def timed(check, values):
+    start = time.perf_counter()
+    for value in values:
+        check(value)
+    return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def full(schema):
+    def check(value):
+        try:
+            schema.validate(value)
+        except Exception:
+            pass
+
+    return check
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--ports", type=int, default=3)
+    parser.add_argument("--freeze", action="store_true")
+    args = parser.parse_args()
+    # full validation logs every error
+    logging.disable(logging.ERROR)
+
+    schema = build(max(args.ports, 1))
+    if args.freeze:
+        schema.freeze()
+    valid = [record(i, args.ports) for i in range(args.records)]
+
+    def broken(path, bad):
+        values = copy.deepcopy(valid)
+        for value in values:
+            node = value
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = bad
+        return values
+
+    tls = ["1000", "https", "tls"]
+    cases = [
+        ("valid", valid),
+        ("wrong type", broken(tls + ["cipher_suite"], 1)),
+        ("bad enum", broken(tls + ["version"], "TLSv9")),
+        ("bad base64", broken(tls + ["certificate", "raw"], "not base64!")),
+    ]
+    for name, values in cases:
+        slow = timed(full(schema), values)
+        fast = timed(schema.is_valid, values)
+        print(
+            "%-10s validate %7.1f us, is_valid %7.1f us (%.1fx)"
+            % (name, slow, fast, slow / fast)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Measure how long it takes to import zschema in a fresh interpreter.
+
+    python benchmarks/bench_import.py [--runs N]
+
+Each run starts a new Python process that imports the schema modules and
+the CLI entry point, and reports the wall time of the imports alone. The
+script also fails if the heavy optional modules (dateutil, pytz, six) are
+loaded by a plain import.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import zschema.keys, zschema.leaves, zschema.compounds, zschema.registry
+import zschema.__main__
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in ("dateutil", "pytz", "six", "future") if m in sys.modules)
+print(__import__("json").dumps({"elapsed": elapsed, "heavy": heavy}))
+"""
+
+
+def run_once():
+    out = subprocess.check_output([sys.executable, "-c", SNIPPET])
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    times = sorted(r["elapsed"] * 1000 for r in results)
+    heavy = results[0]["heavy"]
+    print(
+        "import zschema: median %.2f ms, min %.2f ms, max %.2f ms (%d runs)"
+        % (statistics.median(times), times[0], times[-1], args.runs)
+    )
+    if heavy:
+        print("unexpected eager imports: %s" % ", ".join(heavy))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
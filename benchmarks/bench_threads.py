@@ -0,0 +1,97 @@
+"""
+Measure how validation of one shared schema scales with threads.
+
+    PYTHONPATH=. python benchmarks/bench_threads.py [--records N] [--threads 1,2,4,8] [--freeze]
+
+Records resembling scan results are validated against the schema of
+bench_build.py, first in a plain loop and then with Record.validate_many on
+thread pools of each size. On standard builds of CPython the GIL keeps the
+threads from running in parallel, so the pools should match the loop
+rather than beat it; on free-threaded builds (python3.13t and later) they
+should scale with the number of cores.
+"""
+
+import argparse
+import sys
+import time
+
+from bench_build import build
+
+
+def certificate(i):
+    name = {"common_name": ["host%d.example.com" % i], "country": ["US"]}
+    return {
+        "raw": "MIIB",
+        "fingerprint_sha256": "3q2+7w==",
+        "subject": name,
+        "issuer": name,
+        "serial_number": str(i),
+        "validity": {
+            "start": "2020-01-01T00:00:00Z",
+            "end": "2021-01-01T00:00:00Z",
+            "length": 31536000,
+        },
+        "signature": {"algorithm": "rsa", "valid": True, "self_signed": False},
+        "extensions": {
+            "basic_constraints": {"is_ca": False},
+            "subject_alt_name": {"dns_names": ["a.example.com", "b.example.com"]},
+            "key_usage": {"digital_signature": True, "key_encipherment": True},
+        },
+    }
+
+
+def record(i, ports):
+    value = {"ip": "10.0.%d.%d" % (i // 256 % 256, i % 256)}
+    for port in range(1000, 1000 + ports):
+        value[str(port)] = {
+            "https": {
+                "status": "success",
+                "timestamp": "2020-06-01T12:00:00Z",
+                "port": port,
+                "tls": {
+                    "version": "TLSv1.2",
+                    "cipher_suite": "TLS_ECDHE_RSA_WITH_AES_128_GCM_SHA256",
+                    "certificate": certificate(i),
+                    "chain": [certificate(i + 1)],
+                },
+            }
+        }
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--ports", type=int, default=3)
+    parser.add_argument("--threads", default="1,2,4,8")
+    parser.add_argument("--freeze", action="store_true")
+    args = parser.parse_args()
+
+    schema = build(max(args.ports, 1))
+    if args.freeze:
+        schema.freeze()
+    values = [record(i, args.ports) for i in range(args.records)]
+    schema.validate(values[0])
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("python %s, GIL %s" % (sys.version.split()[0], "on" if gil else "off"))
+
+    start = time.perf_counter()
+    for value in values:
+        schema.validate(value)
+    serial = time.perf_counter() - start
+    print("loop: %.0f records/s" % (len(values) / serial))
+
+    for threads in (int(t) for t in args.threads.split(",")):
+        start = time.perf_counter()
+        errors = schema.validate_many(values, workers=threads)
+        elapsed = time.perf_counter() - start
+        assert not any(errors), errors
+        print(
+            "%d threads: %.0f records/s (%.2fx the loop)"
+            % (threads, len(values) / elapsed, serial / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
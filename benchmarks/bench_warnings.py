@@ -0,0 +1,58 @@
+"""
+Measure the cost of validating records full of errors under the warn policy.
+
+    PYTHONPATH=. python benchmarks/bench_warnings.py [--records N] [--fields N] [--exemplars N]
+
+Every record holds a number of String fields that all hold a certificate
+(as in bench_threads.py) instead, so that every field logs a warning with
+a large value in its message. The records are validated once with every
+warning logged, once with a WarningAggregator, and for reference once with
+valid values. Log lines go to /dev/null, as a stand-in for a log file.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from bench_threads import certificate
+
+from zschema.compounds import Record
+from zschema.leaves import String
+from zschema.logs import WarningAggregator
+
+
+def timed(schema, values):
+    start = time.perf_counter()
+    for value in values:
+        schema.validate(value, "warn")
+    return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--fields", type=int, default=20)
+    parser.add_argument("--exemplars", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=open(os.devnull, "w"), format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    names = ["field%d" % i for i in range(args.fields)]
+    schema = Record({name: String() for name in names})
+    valid = [{name: "value" for name in names} for _ in range(args.records)]
+    invalid = [{name: certificate(i) for name in names} for i in range(args.records)]
+
+    reference = timed(schema, valid)
+    every = timed(schema, invalid)
+    with WarningAggregator(exemplars=args.exemplars):
+        aggregated = timed(schema, invalid)
+    print("valid records:        %7.1f us" % reference)
+    print("every warning logged: %7.1f us" % every)
+    print("aggregated:           %7.1f us (%.1fx)" % (aggregated, every / aggregated))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,25 @@ __copyright__ = "Copyright 2020 ZMap Team"
 __version__ = "0.11.0"
 __license__ = "Apache License, Version 2.0"
 
-__all__ = ["keys", "leaves", "compounds", "registry"]
+__all__ = [
+    "keys",
+    "leaves",
+    "compounds",
+    "registry",
+    "binary",
+    "columnar",
+    "export",
+    "artifact",
+    "catalog",
+    "projection",
+    "cache",
+    "aio",
+    "server",
+    "stats",
+    "routing",
+    "sampling",
+    "failfast",
+    "logs",
+    "profiling",
+    "pruning",
+]
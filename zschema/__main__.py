@@ -8,10 +8,6 @@ import argparse
 from importlib import import_module
 from site import addsitedir
 
-from .leaves import *
-from .keys import *
-from .compounds import *
-
 commands = [
     "bigquery",
     "elasticsearch",
@@ -21,63 +17,171 @@ commands = [
     "validate",
     "flat",
     "json",
+    "artifact",
+    "serve",
+    "profile",
 ]
 
 cmdList = ", ".join(commands)
 
-parser = argparse.ArgumentParser(
-    prog="zschema",
-    description="Process a zschema definition. " "VERSION: %s" % zschema.__version__,
-)
-
-parser.add_argument(
-    "command",
-    metavar="command",
-    choices=commands,
-    help="The command to execute; one of [ %s ]" % cmdList,
-)
-
-parser.add_argument(
-    "schema",
-    help="The name of the schema in the zschema.registry. "
-    "For backwards compatibility, a filename can be "
-    "prefixed with a colon, as in 'schema.py:my-type'.",
-)
-
-parser.add_argument(
-    "target",
-    nargs="?",
-    help="Only used for the validate command. "
-    "The input JSON file that will be checked against "
-    "the schema.",
-)
-
-parser.add_argument("--module", help="The name of a module to import.")
-
-parser.add_argument(
-    "--validation-policy",
-    help="What to do when a validation "
-    "error occurs. This only overrides the top-level Record. It does not "
-    "override subrecords. Default: error.",
-    choices=["ignore", "warn", "error"],
-    default=None,
-)
-
-parser.add_argument(
-    "--validation-policy-override",
-    help="Override validation " "policy for all levels of the schema.",
-    choices=["ignore", "warn", "error"],
-    default=None,
-)
-
-parser.add_argument(
-    "--path", nargs="*", help="Additional PYTHONPATH directories to include."
-)
-
-args = parser.parse_args()
-
-
-def main():
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="zschema",
+        description="Process a zschema definition. "
+        "VERSION: %s" % zschema.__version__,
+    )
+
+    parser.add_argument(
+        "command",
+        metavar="command",
+        choices=commands,
+        help="The command to execute; one of [ %s ]" % cmdList,
+    )
+
+    parser.add_argument(
+        "schema",
+        help="The name of the schema in the zschema.registry. "
+        "For backwards compatibility, a filename can be "
+        "prefixed with a colon, as in 'schema.py:my-type'.",
+    )
+
+    parser.add_argument(
+        "target",
+        nargs="?",
+        help="Only used for the validate and artifact commands. "
+        "The input JSON file that will be checked against "
+        "the schema, or the artifact file to write.",
+    )
+
+    parser.add_argument("--module", help="The name of a module to import.")
+
+    parser.add_argument(
+        "--artifact",
+        help="Load the schema from an artifact file written by the "
+        "artifact command instead of the registry.",
+    )
+
+    parser.add_argument(
+        "--validation-policy",
+        help="What to do when a validation "
+        "error occurs. This only overrides the top-level Record. It does not "
+        "override subrecords. Default: error.",
+        choices=["ignore", "warn", "error"],
+        default=None,
+    )
+
+    parser.add_argument(
+        "--validation-policy-override",
+        help="Override validation " "policy for all levels of the schema.",
+        choices=["ignore", "warn", "error"],
+        default=None,
+    )
+
+    parser.add_argument(
+        "--path", nargs="*", help="Additional PYTHONPATH directories to include."
+    )
+
+    parser.add_argument(
+        "--cache",
+        help="Only used for the validate command. A SQLite file remembering "
+        "the records that were valid, which are skipped on later runs with "
+        "the same schema.",
+    )
+
+    parser.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=None,
+        help="Evict cache entries not seen for this many days.",
+    )
+
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=None,
+        help="Evict the least recently seen cache entries beyond this number.",
+    )
+
+    parser.add_argument(
+        "--route-field",
+        help="Only used for the validate command. Validate every record "
+        "against the registered schema named by this field, falling back to "
+        "the given schema, and report the results per schema.",
+    )
+
+    parser.add_argument(
+        "--sample",
+        type=float,
+        default=None,
+        help="Only used for the validate command. Validate each record with "
+        "this probability and report the estimated error rates. The target "
+        "may be a glob matching several files.",
+    )
+
+    parser.add_argument(
+        "--reservoir",
+        type=int,
+        default=None,
+        help="Like --sample, but validate this many records in total, picked "
+        "at random offsets of large files.",
+    )
+
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed for --sample and --reservoir."
+    )
+
+    parser.add_argument(
+        "--usage",
+        help="Only used for the bigquery, elasticsearch, docs-bq and docs-es "
+        "commands. A sample of the data (a glob of files of one JSON record "
+        "per line) or the output of the profile command: fields that do not "
+        "occur in it, and are not required, are left out. What was left out "
+        "is reported on stderr. --sample and --reservoir sample the data.",
+    )
+
+    parser.add_argument(
+        "--warn-limit",
+        type=int,
+        default=None,
+        help="Only used for the validate command. Log at most this many "
+        "warnings per field and kind of error, and periodic counts of the "
+        "others.",
+    )
+
+    parser.add_argument(
+        "--warn-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between the counts logged with --warn-limit. Default: 60.",
+    )
+
+    parser.add_argument(
+        "--listen",
+        default="127.0.0.1:8089",
+        help="Only used for the serve command. The host:port to listen on, "
+        "or unix:PATH for a Unix socket. Default: 127.0.0.1:8089.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Only used for the serve and profile commands. The number of "
+        "validation workers, or of processes profiling chunks of the data.",
+    )
+
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Only used for the serve command. Validate in worker processes "
+        "instead of threads.",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
     if args.path:
         for syspath in args.path:
             addsitedir(syspath)
@@ -86,17 +190,32 @@ def main():
 
     # Backwards compatibility: given "file.py:schema", load file.py.
     if ":" in schema:
-        path, recname = schema.split(":")
+        path, schema = schema.split(":")
         load_source("module", path)
-        schema = recname
+    recname = schema
 
     if args.module:
         import_module(args.module)
 
-    record = zschema.registry.get_schema(schema)
+    if args.artifact:
+        from zschema import artifact
+
+        record = schemas = artifact.load(args.artifact)
+        if isinstance(record, dict):
+            record = record[schema]
+        else:
+            schemas = {schema: record}
+    else:
+        record = zschema.registry.get_schema(schema)
+        schemas = zschema.registry.all_schemas()
     if args.validation_policy:
-        record.set("validation_policy", args.validation_policy)
+        # a copy, so that schemas shared with other code (or frozen) are not
+        # modified
+        record = record.replace(validation_policy=args.validation_policy)
+        schemas[schema] = record
     command = args.command
+    if args.usage and command in _PRUNE_TARGETS:
+        record = prune(record, args)
     if command == "bigquery":
         print(json.dumps(record.to_bigquery()))
     elif command == "elasticsearch":
@@ -112,17 +231,211 @@ def main():
     elif command == "flat":
         for r in record.to_flat():
             print(json.dumps(r))
+    elif command == "artifact":
+        if not args.target:
+            sys.stderr.write("The artifact command requires an output file.\n")
+            sys.exit(1)
+        from zschema import artifact
+
+        artifact.dump(record, args.target)
+    elif command == "serve":
+        serve(schemas, recname, args)
+    elif command == "profile":
+        profile(record, args)
     elif command == "validate":
-        if not os.path.exists(args.target):
+        if args.sample is not None or args.reservoir is not None:
+            validate_sample(record, args)
+            return
+        if not args.target or not os.path.exists(args.target):
             sys.stderr.write("Invalid test file. %s does not exist.\n" % args.target)
             sys.exit(1)
+        aggregator = None
+        if args.warn_limit is not None:
+            from zschema.logs import WarningAggregator
+
+            aggregator = WarningAggregator(
+                exemplars=args.warn_limit, interval=args.warn_interval
+            ).install()
+        try:
+            validate(schemas, record, recname, args)
+        finally:
+            if aggregator is not None:
+                aggregator.uninstall()
+
+
+def validate(schemas, record, recname, args):
+    if args.route_field:
+        validate_routed(schemas, recname, args)
+        return
+    if args.cache:
+        validate_cached(record, args)
+        return
+    validate_with_stats(record, args)
+
+
+def validate_with_stats(record, args):
+    # Stops at the first invalid record, like Record.validate, but first
+    # prints the paths and values that failed (or were warned about).
+    import logging
+    import time
+    from zschema import keys
+    from zschema.stats import ValidationStats
+
+    stats = ValidationStats()
+    previous = keys.set_warning_handler()
+
+    def handler(e, level):
+        if level == logging.WARNING:
+            stats.add_warning(e)
+        previous(e, level)
+
+    keys.set_warning_handler(handler)
+    try:
         with open(args.target) as fd:
             for line in fd:
-                record.validate(
-                    json.loads(line.strip()), args.validation_policy_override
-                )
-    else:
-        usage()
+                value = json.loads(line.strip())
+                start = time.perf_counter()
+                try:
+                    record.validate(value, args.validation_policy_override)
+                except keys.DataValidationException as e:
+                    stats.add(time.perf_counter() - start, e)
+                    raise
+                stats.add(time.perf_counter() - start)
+    finally:
+        keys.set_warning_handler(previous)
+        json.dump(stats.to_dict(), sys.stderr, indent=2, sort_keys=True)
+        sys.stderr.write("\n")
+
+
+def serve(schemas, recname, args):
+    from zschema.server import ValidationServer
+
+    server = ValidationServer(
+        schemas,
+        default=recname,
+        policy=args.validation_policy_override,
+        workers=args.workers,
+        processes=args.processes,
+    )
+    sys.stderr.write("Serving %d schemas on %s\n" % (len(schemas), args.listen))
+    server.serve(args.listen)
+
+
+_PRUNE_TARGETS = {
+    "bigquery": ["bigquery"],
+    "docs-bq": ["bigquery"],
+    "elasticsearch": ["elasticsearch"],
+    "docs-es": ["elasticsearch"],
+}
+
+
+def load_usage(record, args):
+    from glob import glob
+    from zschema import pruning, sampling
+
+    paths = sorted(glob(args.usage))
+    if not paths:
+        sys.stderr.write("Invalid usage file. %s does not exist.\n" % args.usage)
+        sys.exit(1)
+    with open(paths[0]) as fd:
+        first = fd.readline()
+        try:
+            json.loads(first)
+        except ValueError:
+            # not one record per line: the output of the profile command
+            fd.seek(0)
+            return pruning.observed_in_profile(json.load(fd))
+    if args.sample is not None or args.reservoir is not None:
+        strata = sampling.sample(paths, args.sample, args.reservoir, args.seed)
+        lines = (line for _, lines, _ in strata for line, _ in lines)
+        return pruning.observe(record, (json.loads(line) for line in lines))
+    counts = None
+    for path in paths:
+        with open(path) as fd:
+            values = (json.loads(line) for line in fd if line.strip())
+            counts = pruning.observe(record, values, counts)
+    return counts
+
+
+def prune(record, args):
+    from zschema import pruning
+
+    usage = load_usage(record, args)
+    pruned, report = pruning.prune(record, usage, _PRUNE_TARGETS[args.command])
+    json.dump(report.to_dict(), sys.stderr, indent=2, sort_keys=True)
+    sys.stderr.write("\n")
+    return pruned
+
+
+def profile(record, args):
+    from glob import glob
+    from zschema import profiling
+
+    paths = sorted(glob(args.target)) if args.target else []
+    if not paths:
+        sys.stderr.write("Invalid data file. %s does not exist.\n" % args.target)
+        sys.exit(1)
+    result = profiling.profile_files(record, paths, workers=args.workers)
+    print(json.dumps(result.to_dict(), indent=2, sort_keys=True))
+
+
+def validate_sample(record, args):
+    from glob import glob
+    from zschema import sampling
+
+    paths = sorted(glob(args.target)) if args.target != "-" else ["-"]
+    if not paths:
+        sys.stderr.write("Invalid test file. %s does not exist.\n" % args.target)
+        sys.exit(1)
+    report = sampling.estimate(
+        record,
+        paths,
+        rate=args.sample,
+        size=args.reservoir,
+        policy=args.validation_policy_override,
+        seed=args.seed,
+    )
+    print(json.dumps(report.to_dict(), indent=2, sort_keys=True))
+
+
+def validate_routed(schemas, recname, args):
+    from zschema.routing import Router
+
+    router = Router(
+        schemas,
+        field=args.route_field,
+        default=recname,
+        policy=args.validation_policy_override,
+    )
+    with open(args.target) as fd:
+        values = (json.loads(line) for line in fd if line.strip())
+        for _ in router.validate_stream(values):
+            pass
+    summary = router.summary()
+    json.dump(summary, sys.stderr, indent=2, sort_keys=True)
+    sys.stderr.write("\n")
+    invalid = sum(s["invalid"] for s in summary["schemas"].values())
+    if invalid or summary["unrouted"]:
+        sys.exit(1)
+
+
+def validate_cached(record, args):
+    from zschema.cache import ValidationCache
+
+    max_age = args.cache_max_age * 86400 if args.cache_max_age is not None else None
+    with ValidationCache(
+        args.cache,
+        record,
+        args.validation_policy_override,
+        max_age=max_age,
+        max_entries=args.cache_max_entries,
+    ) as cache:
+        with open(args.target, "rb") as fd:
+            for line in fd:
+                cache.validate(line)
+    sys.stderr.write(
+        "%d records validated, %d found in the cache\n" % (cache.misses, cache.hits)
+    )
 
 
 def load_source(name, path):
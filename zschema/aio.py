@@ -0,0 +1,172 @@
+"""
+Validation from asyncio code, without blocking the event loop.
+
+    await host.avalidate(value)
+
+    async with AsyncValidator(host, executor=pool) as validator:
+        await validator.validate(value)
+        async for value, error in validator.validate_stream(records):
+            ...
+
+Values are validated in an executor (the loop's default thread pool unless
+one is given). A ProcessPoolExecutor avoids contention on the GIL for large
+records; the record is then pickled with every batch, so freeze it or load
+it from an artifact to keep that cheap.
+
+AsyncValidator queues values and hands them to the executor in batches of
+up to batch_size, so that small records do not each pay for a handoff. The
+queue holds at most max_pending values: once it is full, validate() and
+validate_stream() wait for room, which slows down the producers.
+"""
+
+import asyncio
+import collections
+import functools
+
+from zschema.compounds import _validate_batch
+from zschema.keys import _NO_ARG
+
+
+async def avalidate(record, value, policy=_NO_ARG, path=_NO_ARG, executor=None):
+    """
+    Validates value against record in executor. Raises like Record.validate.
+    """
+    loop = asyncio.get_running_loop()
+    check = functools.partial(record.validate, value, policy, path)
+    await loop.run_in_executor(executor, check)
+
+
+async def _aiter(values):
+    if hasattr(values, "__aiter__"):
+        async for value in values:
+            yield value
+    else:
+        for value in values:
+            yield value
+
+
+async def _outcome(value, future):
+    try:
+        await future
+    except Exception as e:
+        return value, e
+    return value, None
+
+
+class AsyncValidator(object):
+
+    BATCH_SIZE = 64
+    MAX_PENDING = 1024
+
+    def __init__(
+        self,
+        record,
+        policy=_NO_ARG,
+        executor=None,
+        batch_size=None,
+        max_pending=None,
+        concurrency=1,
+    ):
+        self.record = record
+        self.policy = policy
+        self.executor = executor
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.max_pending = max_pending or self.MAX_PENDING
+        # the number of batches handed to the executor at the same time
+        self.concurrency = concurrency
+        self._queue = None
+        self._workers = []
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_pending)
+            self._workers = [
+                asyncio.ensure_future(self._work()) for _ in range(self.concurrency)
+            ]
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                errors = await loop.run_in_executor(
+                    self.executor,
+                    _validate_batch,
+                    self.record,
+                    [value for value, _ in batch],
+                    self.policy,
+                )
+            except Exception as e:
+                # the executor failed, e.g. a worker process died
+                errors = [e] * len(batch)
+            for (_, future), error in zip(batch, errors):
+                if future.cancelled():
+                    pass
+                elif error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+                queue.task_done()
+
+    async def submit(self, value):
+        """
+        Queues value, waiting for room if the queue is full. Returns a future
+        that is resolved, or fails, once value has been validated.
+        """
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((value, future))
+        return future
+
+    async def validate(self, value):
+        """
+        Validates value. Raises like Record.validate.
+        """
+        await (await self.submit(value))
+
+    async def validate_stream(self, values):
+        """
+        Validates the values of an iterable or async iterable, yielding
+        (value, error) pairs in order; error is None for valid values. At
+        most max_pending values are read ahead of the pair last yielded.
+        """
+        pending = collections.deque()
+        async for value in _aiter(values):
+            if len(pending) >= self.max_pending:
+                yield await _outcome(*pending.popleft())
+            pending.append((value, await self.submit(value)))
+        while pending:
+            yield await _outcome(*pending.popleft())
+
+    async def close(self):
+        """
+        Waits for the queued values to be validated and stops the workers.
+        """
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue = None
+        self._workers = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+async def validate_stream(record, values, policy=_NO_ARG, **kwargs):
+    """
+    Validates the values of an iterable or async iterable against record,
+    yielding (value, error) pairs in order. Keyword arguments are passed to
+    AsyncValidator.
+    """
+    async with AsyncValidator(record, policy, **kwargs) as validator:
+        async for outcome in validator.validate_stream(values):
+            yield outcome
@@ -0,0 +1,81 @@
+"""
+Precompiled schema artifacts.
+
+Building a large schema (thousands of Keyables created by SubRecordType
+factories) is paid again by every process that imports the schema module.
+An artifact is a built Record serialized to a compact file that can be
+loaded back without importing or executing the schema module:
+
+    zschema.artifact.dump(host, "host.zsa")
+    ...
+    host = zschema.artifact.load("host.zsa")
+
+A whole registry can be stored the same way with dump_registry() and
+load_registry().
+
+Artifacts are pickles, so only load artifacts from trusted sources. Leaf or
+SubRecord subclasses defined in a schema module are stored by reference,
+and loading an artifact that uses them imports that module.
+"""
+
+import pickle
+import zlib
+
+from zschema import registry
+
+MAGIC = b"ZSA\x01"
+
+_COMPRESSED = b"z"
+_UNCOMPRESSED = b"-"
+
+
+def dumps(obj, compress=True):
+    """Serialize a Record (or a dict of Records) to artifact bytes."""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    if compress:
+        return MAGIC + _COMPRESSED + zlib.compress(data)
+    return MAGIC + _UNCOMPRESSED + data
+
+
+def loads(data):
+    """Load a Record (or dict of Records) from artifact bytes."""
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("not a zschema artifact")
+    flag = data[len(MAGIC) : len(MAGIC) + 1]
+    data = data[len(MAGIC) + 1 :]
+    if flag == _COMPRESSED:
+        data = zlib.decompress(data)
+    elif flag != _UNCOMPRESSED:
+        raise ValueError("unsupported zschema artifact encoding")
+    return pickle.loads(data)
+
+
+def dump(obj, path, compress=True):
+    with open(path, "wb") as fd:
+        fd.write(dumps(obj, compress=compress))
+
+
+def load(path):
+    with open(path, "rb") as fd:
+        return loads(fd.read())
+
+
+def dump_registry(path, schemas=None, compress=True):
+    """Store the given schemas (default: every registered schema)."""
+    if schemas is None:
+        schemas = registry.all_schemas()
+    dump(dict(schemas), path, compress=compress)
+
+
+def load_registry(path, register=True):
+    """
+    Load schemas stored by dump_registry, registering them unless register
+    is False. Returns the dict of schemas.
+    """
+    schemas = load(path)
+    if not isinstance(schemas, dict):
+        raise ValueError("artifact does not contain a registry")
+    if register:
+        for name, schema in schemas.items():
+            registry.register_schema(name, schema)
+    return schemas
@@ -0,0 +1,457 @@
+"""
+Compact, schema-driven binary encoding for records.
+
+The schema fixes the field order and field types, so an encoded record only
+carries what JSON cannot leave out: every key becomes a small integer ID
+(the position of the field in the sorted definition), integers are zigzag
+varints, Booleans are packed into the field tag (or into a bitmap inside
+lists) and Enum values are stored as ordinals.
+
+Values that do not fit the declared type (e.g. data that would fail
+validation, or unknown keys under allow_unknown) are stored as embedded JSON,
+so decoding always returns exactly what was encoded.
+
+A stream of records is written as a header (magic bytes and a fingerprint of
+the schema layout) followed by length-prefixed records:
+
+    with open("hosts.zsb", "wb") as fd:
+        writer = BinaryWriter(fd, host)
+        for line in lines:
+            writer.write(json.loads(line))
+
+    with open("hosts.zsb", "rb") as fd:
+        for record in BinaryReader(fd, host):
+            ...
+
+The format is specific to zschema. Record.to_avro() describes the JSON shape
+of the records, not this encoding.
+"""
+
+import hashlib
+import json
+import socket
+import struct
+
+from zschema.keys import DataValidationException
+from zschema.leaves import Boolean, Enum, Float, IPv4Address, _Integer
+from zschema.compounds import ListOf, SubRecord
+
+MAGIC = b"ZSB\x01"
+FINGERPRINT_SIZE = 8
+
+# Field tags carry the kind of the value in their low two bits.
+_KIND_VALUE = 0
+_KIND_NULL = 1
+_KIND_JSON = 2
+_KIND_FALSE = 2
+_KIND_TRUE = 3
+
+# List headers carry flags in their low two bits.
+_LIST_HAS_NULLS = 1
+_LIST_JSON = 2
+
+_DOUBLE = struct.Struct("<d")
+
+
+class _Unencodable(Exception):
+    # Raised by typed encoders for values that must fall back to JSON.
+    pass
+
+
+def _write_uvarint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_uvarint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_bytes(out, data):
+    _write_uvarint(out, len(data))
+    out += data
+
+
+def _read_bytes(buf, pos):
+    n, pos = _read_uvarint(buf, pos)
+    return bytes(buf[pos : pos + n]), pos + n
+
+
+def _write_json(out, value):
+    _write_bytes(out, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _read_json(buf, pos):
+    data, pos = _read_bytes(buf, pos)
+    return json.loads(data.decode("utf-8")), pos
+
+
+def _pack_bits(out, bits):
+    byte = 0
+    for i, bit in enumerate(bits):
+        if bit:
+            byte |= 1 << (i & 7)
+        if i & 7 == 7:
+            out.append(byte)
+            byte = 0
+    if len(bits) & 7:
+        out.append(byte)
+
+
+def _unpack_bits(buf, pos, n):
+    end = pos + (n + 7) // 8
+    bits = [bool(buf[pos + (i >> 3)] & (1 << (i & 7))) for i in range(n)]
+    return bits, end
+
+
+def _encode_string(value, out):
+    if type(value) is not str:
+        raise _Unencodable()
+    _write_bytes(out, value.encode("utf-8"))
+
+
+def _decode_string(buf, pos):
+    data, pos = _read_bytes(buf, pos)
+    return data.decode("utf-8"), pos
+
+
+def _encode_int(value, out):
+    if type(value) is not int:
+        raise _Unencodable()
+    _write_uvarint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+
+def _decode_int(buf, pos):
+    n, pos = _read_uvarint(buf, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def _encode_double(value, out):
+    if type(value) is not float:
+        raise _Unencodable()
+    out += _DOUBLE.pack(value)
+
+
+def _decode_double(buf, pos):
+    return _DOUBLE.unpack_from(buf, pos)[0], pos + _DOUBLE.size
+
+
+def _encode_bool(value, out):
+    if type(value) is not bool:
+        raise _Unencodable()
+    out.append(1 if value else 0)
+
+
+def _decode_bool(buf, pos):
+    return bool(buf[pos]), pos + 1
+
+
+def _encode_ipv4(value, out):
+    if type(value) is not str:
+        raise _Unencodable()
+    try:
+        packed = socket.inet_pton(socket.AF_INET, value)
+    except (socket.error, ValueError):
+        raise _Unencodable()
+    # only store the packed form when it reproduces the exact input string
+    if socket.inet_ntop(socket.AF_INET, packed) != value:
+        raise _Unencodable()
+    out += packed
+
+
+def _decode_ipv4(buf, pos):
+    return socket.inet_ntop(socket.AF_INET, bytes(buf[pos : pos + 4])), pos + 4
+
+
+class _Codec(object):
+    """
+    The compiled encoder/decoder for one schema node. layout is a plain
+    description of the wire format, used to fingerprint the schema.
+    """
+
+    def __init__(self, encode, decode, layout, is_bool=False):
+        self.encode = encode
+        self.decode = decode
+        self.layout = layout
+        self.is_bool = is_bool
+
+
+def _enum_codec(node):
+    values = list(node.values)
+    ordinals = {v: i for i, v in enumerate(values)}
+
+    def encode(value, out):
+        # ordinal 0 is reserved for strings that are not enum options
+        i = ordinals.get(value) if type(value) is str else None
+        if i is None:
+            out.append(0)
+            _encode_string(value, out)
+        else:
+            _write_uvarint(out, i + 1)
+
+    def decode(buf, pos):
+        i, pos = _read_uvarint(buf, pos)
+        if i == 0:
+            return _decode_string(buf, pos)
+        return values[i - 1], pos
+
+    return _Codec(encode, decode, ("enum", tuple(values)))
+
+
+def _list_codec(node):
+    item = _compile(node.object_)
+    item_encode = item.encode
+    item_decode = item.decode
+
+    def encode(value, out):
+        if type(value) is not list:
+            raise _Unencodable()
+        n = len(value)
+        present = [v for v in value if v is not None]
+        has_nulls = len(present) != n
+        body = bytearray()
+        try:
+            if item.is_bool:
+                for v in present:
+                    if type(v) is not bool:
+                        raise _Unencodable()
+                _pack_bits(body, present)
+            else:
+                for v in present:
+                    item_encode(v, body)
+        except _Unencodable:
+            _write_uvarint(out, _LIST_JSON)
+            _write_json(out, value)
+            return
+        _write_uvarint(out, (n << 2) | (_LIST_HAS_NULLS if has_nulls else 0))
+        if has_nulls:
+            _pack_bits(out, [v is None for v in value])
+        out += body
+
+    def decode(buf, pos):
+        header, pos = _read_uvarint(buf, pos)
+        if header & _LIST_JSON:
+            return _read_json(buf, pos)
+        n = header >> 2
+        if header & _LIST_HAS_NULLS:
+            nulls, pos = _unpack_bits(buf, pos, n)
+        else:
+            nulls = None
+        n_present = n - sum(nulls) if nulls else n
+        if item.is_bool:
+            present, pos = _unpack_bits(buf, pos, n_present)
+        else:
+            present = []
+            for _ in range(n_present):
+                v, pos = item_decode(buf, pos)
+                present.append(v)
+        if nulls is None:
+            return present, pos
+        it = iter(present)
+        return [None if null else next(it) for null in nulls], pos
+
+    return _Codec(encode, decode, ("list", item.layout))
+
+
+def _subrecord_body_codec(node):
+    fields = []
+    for key, child in sorted(node._fields()):
+        fields.append((SubRecord.key_to_es(key), _compile(child)))
+    ids = {name: i for i, (name, _) in enumerate(fields)}
+    # one past the last field ID marks a key that is not in the schema
+    unknown_tag = len(fields) << 2
+
+    def encode(value, out):
+        _write_uvarint(out, len(value))
+        for key, v in value.items():
+            i = ids.get(key)
+            if i is None:
+                _write_uvarint(out, unknown_tag)
+                _encode_string(key, out)
+                _write_json(out, v)
+                continue
+            codec = fields[i][1]
+            tag = i << 2
+            if v is None:
+                _write_uvarint(out, tag | _KIND_NULL)
+            elif codec.is_bool:
+                if v is True:
+                    _write_uvarint(out, tag | _KIND_TRUE)
+                elif v is False:
+                    _write_uvarint(out, tag | _KIND_FALSE)
+                else:
+                    # for Boolean fields kind 0 is the JSON fallback
+                    _write_uvarint(out, tag | _KIND_VALUE)
+                    _write_json(out, v)
+            else:
+                body = bytearray()
+                try:
+                    codec.encode(v, body)
+                except _Unencodable:
+                    _write_uvarint(out, tag | _KIND_JSON)
+                    _write_json(out, v)
+                else:
+                    _write_uvarint(out, tag | _KIND_VALUE)
+                    out += body
+
+    def decode(buf, pos):
+        n, pos = _read_uvarint(buf, pos)
+        retv = {}
+        for _ in range(n):
+            tag, pos = _read_uvarint(buf, pos)
+            if tag == unknown_tag:
+                key, pos = _decode_string(buf, pos)
+                retv[key], pos = _read_json(buf, pos)
+                continue
+            key, codec = fields[tag >> 2]
+            kind = tag & 3
+            if kind == _KIND_NULL:
+                retv[key] = None
+            elif codec.is_bool:
+                if kind == _KIND_VALUE:
+                    retv[key], pos = _read_json(buf, pos)
+                else:
+                    retv[key] = kind == _KIND_TRUE
+            elif kind == _KIND_JSON:
+                retv[key], pos = _read_json(buf, pos)
+            else:
+                retv[key], pos = codec.decode(buf, pos)
+        return retv, pos
+
+    layout = ("record", tuple((name, codec.layout) for name, codec in fields))
+    return _Codec(encode, decode, layout)
+
+
+def _subrecord_codec(node):
+    body = _subrecord_body_codec(node)
+    body_encode = body.encode
+
+    def encode(value, out):
+        if type(value) is not dict:
+            raise _Unencodable()
+        body_encode(value, out)
+
+    return _Codec(encode, body.decode, body.layout)
+
+
+def _compile(node):
+    if isinstance(node, SubRecord):
+        return _subrecord_codec(node)
+    if isinstance(node, ListOf):
+        return _list_codec(node)
+    if isinstance(node, Boolean):
+        return _Codec(_encode_bool, _decode_bool, "bool", is_bool=True)
+    if isinstance(node, Enum) and node.values:
+        return _enum_codec(node)
+    if isinstance(node, _Integer):
+        return _Codec(_encode_int, _decode_int, "int")
+    if isinstance(node, Float):
+        return _Codec(_encode_double, _decode_double, "double")
+    if isinstance(node, IPv4Address):
+        return _Codec(_encode_ipv4, _decode_ipv4, "ipv4")
+    if str in getattr(node, "EXPECTED_CLASS", ()):
+        return _Codec(_encode_string, _decode_string, "string")
+    # anything else (e.g. custom leaves) is always stored as JSON
+    return _Codec(_raise_unencodable, _read_json, "json")
+
+
+def _raise_unencodable(value, out):
+    raise _Unencodable()
+
+
+class RecordCodec(object):
+    """
+    Encodes and decodes single records of the given Record schema.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        codec = _subrecord_body_codec(record)
+        self._encode = codec.encode
+        self._decode = codec.decode
+        layout = json.dumps(codec.layout, separators=(",", ":"))
+        self.fingerprint = hashlib.blake2b(
+            layout.encode("utf-8"), digest_size=FINGERPRINT_SIZE
+        ).digest()
+
+    def encode(self, value):
+        if not isinstance(value, dict):
+            raise DataValidationException("record is not a dict:\n{}".format(value))
+        out = bytearray()
+        self._encode(value, out)
+        return bytes(out)
+
+    def decode(self, data):
+        value, pos = self._decode(data, 0)
+        if pos != len(data):
+            raise ValueError("trailing data after encoded record")
+        return value
+
+
+class BinaryWriter(object):
+    """
+    Writes length-prefixed encoded records to the binary file object fd.
+    """
+
+    def __init__(self, fd, record):
+        self.fd = fd
+        self.codec = RecordCodec(record)
+        self.fd.write(MAGIC + self.codec.fingerprint)
+
+    def write(self, value):
+        data = self.codec.encode(value)
+        prefix = bytearray()
+        _write_uvarint(prefix, len(data))
+        self.fd.write(prefix)
+        self.fd.write(data)
+
+
+class BinaryReader(object):
+    """
+    Iterates over the records in a file written by BinaryWriter. Raises a
+    ValueError if the file was written with a different schema layout.
+    """
+
+    def __init__(self, fd, record):
+        self.fd = fd
+        self.codec = RecordCodec(record)
+        header = fd.read(len(MAGIC) + FINGERPRINT_SIZE)
+        if header[: len(MAGIC)] != MAGIC:
+            raise ValueError("not a zschema binary record file")
+        if header[len(MAGIC) :] != self.codec.fingerprint:
+            raise ValueError("binary record file was written with a different schema")
+
+    def _read_length(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.fd.read(1)
+            if not b:
+                if shift:
+                    raise ValueError("truncated binary record file")
+                return None
+            result |= (b[0] & 0x7F) << shift
+            if not b[0] & 0x80:
+                return result
+            shift += 7
+
+    def __iter__(self):
+        decode = self.codec.decode
+        while True:
+            n = self._read_length()
+            if n is None:
+                return
+            data = self.fd.read(n)
+            if len(data) != n:
+                raise ValueError("truncated binary record file")
+            yield decode(data)
@@ -0,0 +1,175 @@
+"""
+An on-disk cache of the records already known to be valid.
+
+Records are identified by a hash of their raw JSON line and the cache is
+keyed by a fingerprint of the schema (and of the classes of its fields and
+the version of zschema), so a record is only skipped when the exact same
+bytes passed the exact same schema before:
+
+    with ValidationCache("validated.db", host) as cache:
+        for line in open("hosts.json", "rb"):
+            cache.validate(line)
+
+Only records that validate without raising are stored. With the warn or
+ignore policies this includes records that produced warnings, and those
+warnings are not repeated for records found in the cache.
+
+Entries not seen for max_age seconds, and the least recently seen entries
+beyond max_entries, are evicted when the cache is closed.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+import zschema
+from zschema.compounds import ListOf, SubRecord
+from zschema.keys import _NO_ARG
+
+DIGEST_SIZE = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS validated (
+    fingerprint BLOB NOT NULL,
+    digest BLOB NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (fingerprint, digest)
+) WITHOUT ROWID
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS validated_seen ON validated (seen)"
+
+
+def _node_classes(node):
+    # The classes of node and everything below it, which to_dict() does not
+    # fully describe: a subclass can change validation without changing it.
+    # Frozen nodes count as their unfrozen classes.
+    cls = type(node)
+    cls = getattr(cls, "_UNFROZEN", cls)
+    yield "%s.%s" % (cls.__module__, cls.__qualname__)
+    if isinstance(node, ListOf):
+        yield from _node_classes(node.object_)
+    elif isinstance(node, SubRecord):
+        for _, v in sorted(node._fields()):
+            yield from _node_classes(v)
+
+
+def schema_fingerprint(record, policy=_NO_ARG):
+    """
+    A digest of everything that affects validation with the given policy:
+    the schema, the classes of its nodes and the version of zschema.
+    """
+    description = json.dumps(
+        [
+            record.to_dict(),
+            None if policy is _NO_ARG else policy,
+            list(_node_classes(record)),
+            zschema.__version__,
+        ],
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.blake2b(
+        description.encode("utf-8"), digest_size=DIGEST_SIZE
+    ).digest()
+
+
+class ValidationCache(object):
+
+    # pending writes are committed in batches of this many records
+    BATCH_SIZE = 10000
+
+    def __init__(self, path, record, policy=_NO_ARG, max_age=None, max_entries=None):
+        if policy is None:
+            policy = _NO_ARG
+        self.record = record
+        self.policy = policy
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.fingerprint = schema_fingerprint(record, policy)
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+            self._conn.execute(_INDEX)
+        self._seen = set()
+
+    def _digest(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        return hashlib.blake2b(line.strip(), digest_size=DIGEST_SIZE).digest()
+
+    def __contains__(self, line):
+        digest = self._digest(line)
+        return digest in self._seen or self._lookup(digest)
+
+    def _lookup(self, digest):
+        row = self._conn.execute(
+            "SELECT 1 FROM validated WHERE fingerprint = ? AND digest = ?",
+            (self.fingerprint, digest),
+        ).fetchone()
+        return row is not None
+
+    def add(self, line):
+        """Records line as valid."""
+        self._touch(self._digest(line))
+
+    def _touch(self, digest):
+        self._seen.add(digest)
+        if len(self._seen) >= self.BATCH_SIZE:
+            self.flush()
+
+    def validate(self, line):
+        """
+        Validates a raw JSON line, unless the same line is known to be valid.
+        Returns True if the line was found in the cache.
+        """
+        digest = self._digest(line)
+        if digest in self._seen or self._lookup(digest):
+            self.hits += 1
+            self._touch(digest)
+            return True
+        self.misses += 1
+        self.record.validate(json.loads(line), self.policy)
+        self._touch(digest)
+        return False
+
+    def flush(self):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO validated VALUES (?, ?, ?)",
+                ((self.fingerprint, digest, now) for digest in self._seen),
+            )
+        self._seen = set()
+
+    def evict(self):
+        """
+        Removes the entries older than max_age and the least recently seen
+        entries beyond max_entries, for all schemas.
+        """
+        with self._conn:
+            if self.max_age is not None:
+                self._conn.execute(
+                    "DELETE FROM validated WHERE seen < ?",
+                    (time.time() - self.max_age,),
+                )
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM validated WHERE (fingerprint, digest) IN ("
+                    "SELECT fingerprint, digest FROM validated "
+                    "ORDER BY seen DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def close(self):
+        self.flush()
+        self.evict()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,203 @@
+"""
+An index from the flat, dotted paths of a schema's fields to the fields
+themselves.
+
+    index = host.field_index()              # Elasticsearch names: 443.https
+    index = host.field_index(naming="bq")   # BigQuery names: p443.https
+    field = index["p443.https.tls.certificate"]
+    field.node, field.mode, field.type, field.exclude_bigquery
+    index.prefix("p443.https.tls")          # every field below a path
+
+Paths follow Record.to_flat(): the elements of a ListOf share the path of
+the list and have mode "repeated", and leaves with es_include_raw have a
+".raw" sub-field. With BigQuery naming a NestedListOf is a repeated record
+holding the list under its subrecord_name, as in Record.to_bigquery(), and
+there are no ".raw" sub-fields, as they are not columns.
+
+Indexes of many schemas can be exported to one SQLite file with
+export_sqlite(), for services that only need to resolve field names.
+"""
+
+import sqlite3
+from bisect import bisect_left
+
+from zschema.compounds import ListOf, NestedListOf, SubRecord
+from zschema.leaves import Leaf
+
+NAMINGS = ("es", "bq")
+
+
+class Field(object):
+    """
+    A field of a schema: its path, schema node and effective properties.
+    Exclusions include those inherited from the enclosing fields.
+    """
+
+    __slots__ = (
+        "path",
+        "node",
+        "mode",
+        "type",
+        "exclude_bigquery",
+        "exclude_elasticsearch",
+    )
+
+    def __init__(self, path, node, mode, type_, exclude_bigquery, exclude_es):
+        self.path = path
+        self.node = node
+        self.mode = mode
+        self.type = type_
+        self.exclude_bigquery = exclude_bigquery
+        self.exclude_elasticsearch = exclude_es
+
+    def __repr__(self):
+        return "Field(%r, %s, %s)" % (self.path, self.type, self.mode)
+
+
+class FieldIndex(object):
+
+    def __init__(self, fields, naming):
+        self.naming = naming
+        self._fields = {f.path: f for f in fields}
+        self._paths = sorted(self._fields)
+
+    def __getitem__(self, path):
+        return self._fields[path]
+
+    def get(self, path, default=None):
+        return self._fields.get(path, default)
+
+    def __contains__(self, path):
+        return path in self._fields
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        return (self._fields[p] for p in self._paths)
+
+    def prefix(self, path):
+        """
+        Returns the fields at path and below it, in path order.
+        """
+        retv = []
+        if path in self._fields:
+            retv.append(self._fields[path])
+        start = path + "."
+        paths = self._paths
+        i = bisect_left(paths, start)
+        while i < len(paths) and paths[i].startswith(start):
+            retv.append(self._fields[paths[i]])
+            i += 1
+        return retv
+
+    def to_sqlite(self, db, schema):
+        """
+        Stores the fields in the fields table of a SQLite database (a path
+        or a connection) under the name of the schema, replacing the rows
+        previously stored for it. See export_sqlite.
+        """
+        _write_sqlite(db, [(schema, self)])
+
+
+def build_index(record, naming="es"):
+    if naming not in NAMINGS:
+        raise Exception("Invalid naming: %s (expected one of %s)" % (naming, NAMINGS))
+    key = SubRecord.key_to_bq if naming == "bq" else SubRecord.key_to_es
+    fields = []
+    for k, v in sorted(record._fields()):
+        _index(fields, key, naming, key(k), v, False, False, False)
+    return FieldIndex(fields, naming)
+
+
+def _index(fields, key, naming, path, node, repeated, ex_bq, ex_es):
+    ex_bq = ex_bq or node.exclude_bigquery
+    ex_es = ex_es or node.exclude_elasticsearch
+    if isinstance(node, NestedListOf) and naming == "bq":
+        fields.append(Field(path, node, "repeated", "SubRecord", ex_bq, ex_es))
+        path = path + "." + node.subrecord_name
+        repeated = True
+    if isinstance(node, ListOf):
+        # the list and its elements share one path, as in to_flat
+        return _index(fields, key, naming, path, node.object_, True, ex_bq, ex_es)
+    if repeated:
+        mode = "repeated"
+    elif node.required:
+        mode = "required"
+    else:
+        mode = "nullable"
+    type_ = node._base_type().__name__
+    fields.append(Field(path, node, mode, type_, ex_bq, ex_es))
+    if naming == "es" and isinstance(node, Leaf) and node.es_include_raw:
+        # the keyword sub-field of Leaf.to_es, only in Elasticsearch
+        fields.append(Field(path + ".raw", node, mode, type_, True, ex_es))
+    if isinstance(node, SubRecord):
+        for k, v in sorted(node._fields()):
+            _index(fields, key, naming, path + "." + key(k), v, False, ex_bq, ex_es)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fields (
+    schema TEXT NOT NULL,
+    naming TEXT NOT NULL,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    exclude_bigquery INTEGER NOT NULL,
+    exclude_elasticsearch INTEGER NOT NULL,
+    doc TEXT,
+    PRIMARY KEY (schema, naming, path)
+) WITHOUT ROWID
+"""
+
+
+def _write_sqlite(db, indexes):
+    conn = sqlite3.connect(db) if isinstance(db, str) else db
+    try:
+        with conn:
+            conn.execute(_SCHEMA)
+            for schema, index in indexes:
+                conn.execute(
+                    "DELETE FROM fields WHERE schema = ? AND naming = ?",
+                    (schema, index.naming),
+                )
+                conn.executemany(
+                    "INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            schema,
+                            index.naming,
+                            f.path,
+                            f.type,
+                            f.mode,
+                            int(f.exclude_bigquery),
+                            int(f.exclude_elasticsearch),
+                            f.node.doc,
+                        )
+                        for f in index
+                    ),
+                )
+    finally:
+        if conn is not db:
+            conn.close()
+
+
+def export_sqlite(db, schemas=None, namings=NAMINGS):
+    """
+    Writes the field indexes of the given schemas (a dict from name to
+    Record, default: every registered schema) to the fields table of a
+    SQLite database, which is created if needed. The rows previously stored
+    for these schemas are replaced.
+    """
+    if schemas is None:
+        from zschema import registry
+
+        schemas = registry.all_schemas()
+    _write_sqlite(
+        db,
+        [
+            (name, record.field_index(naming))
+            for name, record in sorted(schemas.items())
+            for naming in namings
+        ],
+    )
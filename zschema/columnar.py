@@ -0,0 +1,397 @@
+"""
+Build Arrow-style columnar buffers from a stream of records.
+
+The column layout follows Record.to_arrow_schema(): SubRecords become struct
+columns, ListOfs become list columns with an offsets buffer and a child
+column, Enums are dictionary encoded and every column carries a validity
+bitmap (least significant bit first, as in Arrow) when it contains nulls.
+
+Buffers are plain Python arrays and bytes, so no third party library is
+needed to build them. When pyarrow is installed, Batch.to_pyarrow() hands
+the buffers over without copying the values one by one:
+
+    for batch in iter_batches(host, records, batch_size=65536):
+        table = batch.to_pyarrow()
+
+Values are expected to have passed Record.validate; integers must fit in a
+signed 64-bit column.
+"""
+
+from array import array
+
+from zschema.leaves import Boolean, Enum, Float, _Integer
+from zschema.compounds import ListOf, SubRecord
+
+
+class _Bitmap(object):
+
+    __slots__ = ("bits", "length")
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.length = 0
+
+    def append(self, bit):
+        if not self.length & 7:
+            self.bits.append(0)
+        if bit:
+            self.bits[-1] |= 1 << (self.length & 7)
+        self.length += 1
+
+
+class Column(object):
+    """
+    The finished buffers of one column. Depending on type, values (array),
+    offsets (array of int32), data (bytes), indices and dictionary, or
+    children are set; validity is None when the column has no nulls.
+    """
+
+    def __init__(self, name, type_, length, null_count, validity):
+        self.name = name
+        self.type = type_
+        self.length = length
+        self.null_count = null_count
+        self.validity = validity
+        self.values = None
+        self.offsets = None
+        self.data = None
+        self.indices = None
+        self.dictionary = None
+        self.children = []
+
+    def to_pylist(self):
+        """Decode the buffers back into Python values (mostly for tests)."""
+        return [self._get(i) for i in range(self.length)]
+
+    def _get(self, i):
+        if self.validity is not None and not self.validity[i >> 3] & (1 << (i & 7)):
+            return None
+        return self._value(i)
+
+    def _value(self, i):
+        if self.type == "bool":
+            return bool(self.values[i >> 3] & (1 << (i & 7)))
+        if self.type == "utf8":
+            start, end = self.offsets[i], self.offsets[i + 1]
+            return self.data[start:end].decode("utf-8")
+        if self.type == "dictionary":
+            return self.dictionary[self.indices[i]]
+        if self.type == "list":
+            start, end = self.offsets[i], self.offsets[i + 1]
+            return [self.children[0]._get(j) for j in range(start, end)]
+        if self.type == "struct":
+            return {c.name: c._get(i) for c in self.children}
+        return self.values[i]
+
+
+class _ColumnBuilder(object):
+
+    TYPE = None
+
+    def __init__(self, name):
+        self.name = name
+        self.validity = _Bitmap()
+        self.null_count = 0
+        self.length = 0
+
+    def append(self, value):
+        self.length += 1
+        if value is None:
+            self.null_count += 1
+            self.validity.append(False)
+            self._append_null()
+        else:
+            self.validity.append(True)
+            self._append(value)
+
+    def finish(self):
+        validity = bytes(self.validity.bits) if self.null_count else None
+        column = Column(self.name, self.TYPE, self.length, self.null_count, validity)
+        self._finish(column)
+        return column
+
+
+class _FixedBuilder(_ColumnBuilder):
+
+    def __init__(self, name, type_, typecode, null_value):
+        super(_FixedBuilder, self).__init__(name)
+        self.TYPE = type_
+        self.values = array(typecode)
+        self.null_value = null_value
+
+    def _append(self, value):
+        self.values.append(value)
+
+    def _append_null(self):
+        self.values.append(self.null_value)
+
+    def _finish(self, column):
+        column.values = self.values
+
+
+class _BoolBuilder(_ColumnBuilder):
+
+    TYPE = "bool"
+
+    def __init__(self, name):
+        super(_BoolBuilder, self).__init__(name)
+        self.values = _Bitmap()
+
+    def _append(self, value):
+        self.values.append(value)
+
+    def _append_null(self):
+        self.values.append(False)
+
+    def _finish(self, column):
+        column.values = bytes(self.values.bits)
+
+
+class _StringBuilder(_ColumnBuilder):
+
+    TYPE = "utf8"
+
+    def __init__(self, name):
+        super(_StringBuilder, self).__init__(name)
+        self.offsets = array("i", [0])
+        self.data = bytearray()
+
+    def _append(self, value):
+        if not isinstance(value, str):
+            # e.g. DateTime leaves holding a unix timestamp
+            value = str(value)
+        self.data += value.encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def _append_null(self):
+        self.offsets.append(len(self.data))
+
+    def _finish(self, column):
+        column.offsets = self.offsets
+        column.data = bytes(self.data)
+
+
+class _DictionaryBuilder(_ColumnBuilder):
+
+    TYPE = "dictionary"
+
+    def __init__(self, name, values):
+        super(_DictionaryBuilder, self).__init__(name)
+        self.dictionary = list(values)
+        self.ordinals = {v: i for i, v in enumerate(self.dictionary)}
+        self.indices = array("i")
+
+    def _append(self, value):
+        i = self.ordinals.get(value)
+        if i is None:
+            # Enums without values accept anything; grow the dictionary
+            i = self.ordinals[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self.indices.append(i)
+
+    def _append_null(self):
+        self.indices.append(0)
+
+    def _finish(self, column):
+        column.indices = self.indices
+        column.dictionary = self.dictionary
+
+
+class _ListBuilder(_ColumnBuilder):
+
+    TYPE = "list"
+
+    def __init__(self, name, child):
+        super(_ListBuilder, self).__init__(name)
+        self.offsets = array("i", [0])
+        self.child = child
+        self.child_length = 0
+
+    def _append(self, value):
+        append = self.child.append
+        for item in value:
+            append(item)
+        self.child_length += len(value)
+        self.offsets.append(self.child_length)
+
+    def _append_null(self):
+        self.offsets.append(self.child_length)
+
+    def _finish(self, column):
+        column.offsets = self.offsets
+        column.children = [self.child.finish()]
+
+
+class _StructBuilder(_ColumnBuilder):
+
+    TYPE = "struct"
+
+    def __init__(self, name, fields):
+        super(_StructBuilder, self).__init__(name)
+        # (key in the data, child builder)
+        self.fields = fields
+
+    def _append(self, value):
+        get = value.get
+        for key, child in self.fields:
+            child.append(get(key))
+
+    def _append_null(self):
+        for _, child in self.fields:
+            child.append(None)
+
+    def _finish(self, column):
+        column.children = [child.finish() for _, child in self.fields]
+
+
+def _make_builder(node, name):
+    if isinstance(node, SubRecord):
+        return _StructBuilder(name, _make_fields(node))
+    if isinstance(node, ListOf):
+        return _ListBuilder(name, _make_builder(node.object_, "item"))
+    if isinstance(node, Boolean):
+        return _BoolBuilder(name)
+    if isinstance(node, Enum):
+        return _DictionaryBuilder(name, node.values)
+    if isinstance(node, _Integer):
+        return _FixedBuilder(name, "int64", "q", 0)
+    if isinstance(node, Float):
+        return _FixedBuilder(name, "double", "d", 0.0)
+    return _StringBuilder(name)
+
+
+def _make_fields(node):
+    return [
+        (SubRecord.key_to_es(k), _make_builder(v, SubRecord.key_to_bq(k)))
+        for k, v in sorted(node._fields())
+    ]
+
+
+class Batch(object):
+    """
+    A finished set of columns with the same number of rows.
+    """
+
+    def __init__(self, schema, columns, length):
+        self.schema = schema
+        self.columns = columns
+        self.length = length
+
+    def column(self, name):
+        for c in self.columns:
+            if c.name == name:
+                return c
+        raise KeyError(name)
+
+    def to_pyarrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("pyarrow is required for Batch.to_pyarrow()")
+        arrays = [_to_pyarrow(pyarrow, f, c) for f, c in zip(self.schema, self.columns)]
+        fields = [_pyarrow_field(pyarrow, f) for f in self.schema]
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=pyarrow.schema(fields))
+
+
+def _pyarrow_type(pa, field):
+    t = field["type"]
+    if t == "struct":
+        return pa.struct([_pyarrow_field(pa, f) for f in field["children"]])
+    if t == "list":
+        return pa.list_(_pyarrow_field(pa, field["children"][0]))
+    if field.get("dictionary"):
+        return pa.dictionary(pa.int32(), pa.utf8())
+    return {
+        "utf8": pa.utf8(),
+        "int64": pa.int64(),
+        "double": pa.float64(),
+        "bool": pa.bool_(),
+    }[t]
+
+
+def _pyarrow_field(pa, field):
+    return pa.field(field["name"], _pyarrow_type(pa, field), field["nullable"])
+
+
+def _to_pyarrow(pa, field, column):
+    validity = pa.py_buffer(column.validity) if column.validity is not None else None
+    type_ = _pyarrow_type(pa, field)
+    if column.type == "dictionary":
+        indices = pa.Array.from_buffers(
+            pa.int32(),
+            column.length,
+            [validity, pa.py_buffer(column.indices.tobytes())],
+            column.null_count,
+        )
+        return pa.DictionaryArray.from_arrays(
+            indices, pa.array(column.dictionary, pa.utf8())
+        )
+    if column.type == "struct":
+        children = [
+            _to_pyarrow(pa, f, c) for f, c in zip(field["children"], column.children)
+        ]
+        return pa.Array.from_buffers(
+            type_, column.length, [validity], column.null_count, children=children
+        )
+    if column.type == "list":
+        child = _to_pyarrow(pa, field["children"][0], column.children[0])
+        buffers = [validity, pa.py_buffer(column.offsets.tobytes())]
+        return pa.Array.from_buffers(
+            type_, column.length, buffers, column.null_count, children=[child]
+        )
+    if column.type == "utf8":
+        buffers = [
+            validity,
+            pa.py_buffer(column.offsets.tobytes()),
+            pa.py_buffer(column.data),
+        ]
+    elif column.type == "bool":
+        buffers = [validity, pa.py_buffer(column.values)]
+    else:
+        buffers = [validity, pa.py_buffer(column.values.tobytes())]
+    return pa.Array.from_buffers(type_, column.length, buffers, column.null_count)
+
+
+class BatchBuilder(object):
+    """
+    Accumulates records into columns following the record's nested schema.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.schema = record.to_arrow_schema()
+        self._reset()
+
+    def _reset(self):
+        self._fields = _make_fields(self.record)
+        self.length = 0
+
+    def append(self, value):
+        get = value.get
+        for key, builder in self._fields:
+            builder.append(get(key))
+        self.length += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def finish(self):
+        """Return the accumulated rows as a Batch and start a new one."""
+        columns = [builder.finish() for _, builder in self._fields]
+        batch = Batch(self.schema, columns, self.length)
+        self._reset()
+        return batch
+
+
+def iter_batches(record, values, batch_size=65536):
+    """
+    Yield Batches of at most batch_size rows built from the values iterable.
+    """
+    builder = BatchBuilder(record)
+    for value in values:
+        builder.append(value)
+        if builder.length >= batch_size:
+            yield builder.finish()
+    if builder.length:
+        yield builder.finish()
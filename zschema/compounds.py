@@ -1,13 +1,12 @@
-from __future__ import print_function
-from builtins import int, str, dict
-
-import sys
+import contextvars
 import copy
+import sys
 import json
+import threading
 from collections import OrderedDict
 
 from zschema.keys import Keyable, DataValidationException, MergeConflictException
-from zschema.keys import _NO_ARG
+from zschema.keys import FrozenSchemaException, _NO_ARG, Port, dynamic_type
 
 
 def _is_valid_object(name, object_):
@@ -26,8 +25,141 @@ def _proto_indent(string, n):
     return "\n".join(n * "    " + s for s in string.split("\n"))
 
 
-# Track protobuf message definitions that have been emitted.
-_proto_messages = OrderedDict()
+class _CowDefinition(dict):
+    """
+    The definition of a SubRecord, whose fields may be shared with other
+    definitions (e.g. by every instance of a SubRecordType, or by records
+    built with extends=). A shared field is copied the first time it is
+    accessed through the dict interface, so changes made to it only affect
+    this definition. SubRecord._fields() reads fields without copying them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_CowDefinition, self).__init__(*args, **kwargs)
+        self._shared = set()
+
+    @classmethod
+    def shared(cls, fields):
+        retv = cls(fields)
+        retv._shared.update(retv)
+        return retv
+
+    def share(self, key):
+        self._shared.add(key)
+
+    def is_shared(self, key):
+        return key in self._shared
+
+    def _own(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._shared:
+            self._shared.discard(key)
+            value = value._cow_copy()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def _own_all(self):
+        for key in list(self._shared):
+            self._own(key)
+
+    def __getitem__(self, key):
+        return self._own(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        return default
+
+    def items(self):
+        self._own_all()
+        return dict.items(self)
+
+    def values(self):
+        self._own_all()
+        return dict.values(self)
+
+    def __setitem__(self, key, value):
+        self._shared.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._shared.discard(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self._own(key)
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if key in self._shared:
+            self._shared.discard(key)
+            value = value._cow_copy()
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self._own(key)
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self._shared.difference_update(other)
+        dict.update(self, other)
+
+    def clear(self):
+        self._shared.clear()
+        dict.clear(self)
+
+    def copy(self):
+        # both copies now refer to the same fields
+        self._shared.update(self)
+        return _CowDefinition.shared(self)
+
+    __copy__ = copy
+
+    def __reduce_ex__(self, protocol):
+        # the default reduction iterates over items(), which would copy
+        # every shared field
+        return (_restore_definition, (dict(dict.items(self)), set(self._shared)))
+
+
+def _restore_definition(fields, shared):
+    retv = _CowDefinition(fields)
+    retv._shared.update(shared)
+    return retv
+
+
+class _FrozenDefinition(dict):
+    """
+    The definition of a frozen SubRecord.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise FrozenSchemaException("frozen definitions cannot be modified")
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __ior__ = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+    clear = _immutable
+
+    def __reduce_ex__(self, protocol):
+        return (_FrozenDefinition, (dict(self),))
+
+
+# Track protobuf message definitions that have been emitted. Record.to_proto
+# collects them in a fresh dict for each call, so that concurrent calls (or
+# calls for different records) do not mix their messages. There is no default,
+# which would be one dict shared by every thread.
+_proto_messages = contextvars.ContextVar("zschema_proto_messages", default=None)
 
 
 class ListOf(Keyable):
@@ -35,7 +167,15 @@ class ListOf(Keyable):
     MAX_ITEMS = 0
     MIN_ITEMS = 0
 
-    def __init__(self, object_, max_items=_NO_ARG, min_items=_NO_ARG, *args, **kwargs):
+    def __init__(
+        self, object_=_NO_ARG, max_items=_NO_ARG, min_items=_NO_ARG, *args, **kwargs
+    ):
+        if object_ is _NO_ARG:
+            # the default of a ListOfType, copied so that changing it through
+            # one instance does not affect the others
+            object_ = getattr(self, "OBJECT_", None)
+            if isinstance(object_, Keyable):
+                object_ = object_._cow_copy()
         _is_valid_object("Anonymous ListOf", object_)
         super(ListOf, self).__init__(*args, **kwargs)
         self.set("object_", object_)
@@ -65,6 +205,30 @@ class ListOf(Keyable):
         retv["mode"] = "REPEATED"
         return retv
 
+    def _avro_type(self, name, parent=None):
+        items = self.object_._avro_type(name, parent)
+        if not self.object_.required:
+            # validation accepts null elements
+            items = ["null", items]
+        return {"type": "array", "items": items}
+
+    def to_avro(self, name, parent=None):
+        retv = {"name": self.key_to_bq(name), "type": self._avro_type(name, parent)}
+        if not self.required:
+            retv["type"] = ["null", retv["type"]]
+            retv["default"] = None
+        if self.doc:
+            retv["doc"] = self.doc
+        return retv
+
+    def to_arrow(self, name):
+        return {
+            "name": self.key_to_bq(name),
+            "type": "list",
+            "nullable": not self.required,
+            "children": [self.object_.to_arrow("item")],
+        }
+
     def to_proto(self, name, indent):
         retv = self.object_.to_proto(name, indent)
         retv["field"] = "repeated " + retv["field"]
@@ -100,22 +264,22 @@ class ListOf(Keyable):
             path = []
         try:
             if not isinstance(value, list):
-                m = "%s: %s is not a list" % (name, str(value))
-                raise DataValidationException(m, path=path)
+                m = "%s: %s is not a list"
+                raise DataValidationException(
+                    m, path=path, value=value, format_args=(name, value)
+                )
             if self.max_items > 0 and len(value) > self.max_items:
-                m = "%s: %s has too many values (max: %i)" % (
-                    name,
-                    str(value),
-                    self.max_items,
+                m = "%s: %s has too many values (max: %i)"
+                args = (name, value, self.max_items)
+                raise DataValidationException(
+                    m, path=path, value=value, format_args=args
                 )
-                raise DataValidationException(m, path=path)
             if self.min_items > 0 and len(value) < self.min_items:
-                m = "%s: %s has too few values (min: %i)" % (
-                    name,
-                    str(value),
-                    self.min_items,
+                m = "%s: %s has too few values (min: %i)"
+                args = (name, value, self.min_items)
+                raise DataValidationException(
+                    m, path=path, value=value, format_args=args
                 )
-                raise DataValidationException(m, path=path)
         except DataValidationException as e:
             self._handle_validation_exception(calculated_policy, e)
             # we won't be able to iterate
@@ -129,7 +293,28 @@ class ListOf(Keyable):
                 self._handle_validation_exception(calculated_policy, e)
 
     def to_dict(self):
-        return {"type": "list", "list_of": self.object_.to_json()}
+        retv = {
+            "type": "list",
+            "list_of": self.object_.to_dict(),
+            "doc": self.doc,
+            "required": self.required,
+            "options": self._options(),
+        }
+        base = self._base_type()
+        if base is not ListOf:
+            retv["class"] = base.__name__
+        return retv
+
+    def _freeze_children(self, memo):
+        # object_ may be a class-level default or an interned leaf, which
+        # other schemas also use
+        self.set("object_", self.object_._freeze(memo, True))
+
+    def _cow_copy(self):
+        retv = super(ListOf, self)._cow_copy()
+        if "_value_object_" in retv.__dict__:
+            retv.set("object_", retv.object_._cow_copy())
+        return retv
 
     def to_flat(self, parent, name):
         for rec in self.object_.to_flat(parent, name, repeated=True):
@@ -148,7 +333,7 @@ def ListOfType(
     pr_ignore=_NO_ARG,
 ):
     _is_valid_object("Anonymous ListOf", object_)
-    t = type("ListOf", (ListOf,), {})
+    t = dynamic_type("ListOf", (ListOf,), {})
     t.set_default("object_", object_)
     t.set_default("max_items", max_items)
     t.set_default("required", required)
@@ -158,6 +343,7 @@ def ListOfType(
     t.set_default("examples", examples)
     t.set_default("validation_policy", validation_policy)
     t.set_default("pr_ignore", pr_ignore)
+    return t
 
 
 class SubRecord(Keyable):
@@ -178,21 +364,41 @@ class SubRecord(Keyable):
         **kwargs
     ):
         super(SubRecord, self).__init__(*args, **kwargs)
+        if isinstance(definition, dict) and not isinstance(definition, _CowDefinition):
+            definition = _CowDefinition(definition)
         self.set("definition", definition)
         self.set("allow_unknown", allow_unknown)
         self.set("type_name", type_name)
         if extends is not _NO_ARG:
-            extends = copy.deepcopy(extends)
             self.set("definition", self.merge(extends).definition)
         self.set("es_nested", es_nested)
         # safety check
         if self.definition:
-            for k, v in sorted(self.definition.items()):
+            for k, v in sorted(self._fields()):
                 _is_valid_object(k, v)
 
     def __getitem__(self, key):
         return self.definition[key]
 
+    def _freeze_children(self, memo):
+        definition = self.definition
+        shared = isinstance(definition, _CowDefinition)
+        self.set(
+            "definition",
+            _FrozenDefinition(
+                (k, v._freeze(memo, shared and definition.is_shared(k)))
+                for k, v in dict.items(definition)
+            ),
+        )
+
+    def _fields(self):
+        """
+        The (key, value) pairs of the definition. Unlike definition.items(),
+        this does not copy fields shared with other definitions, so callers
+        must not modify the values.
+        """
+        return dict.items(self.definition)
+
     def __setitem__(self, key, value):
         self.definition[key] = value
 
@@ -224,28 +430,34 @@ class SubRecord(Keyable):
             ".".join([parent, self.key_to_es(name)]) if parent else self.key_to_es(name)
         )
         yield {"type": self.__class__.__name__, "name": this_name, "mode": mode}
-        for subname, doc in sorted(self.definition.items()):
+        for subname, doc in sorted(self._fields()):
             for item in doc.to_flat(this_name, self.key_to_es(subname)):
                 yield item
 
     def merge(self, other):
         assert isinstance(other, SubRecord)
-        newdef = {}
-        l_keys = set(self.definition.keys())
-        r_keys = set(other.definition.keys())
-        for key in l_keys | r_keys:
-            l_value = self.definition.get(key, None)
-            r_value = other.definition.get(key, None)
+        mine = self.definition
+        theirs = other.definition
+        newdef = _CowDefinition()
+        for key in set(mine.keys()) | set(theirs.keys()):
+            l_value = dict.get(mine, key)
+            r_value = dict.get(theirs, key)
             if not l_value:
+                # other keeps using r_value, so both copy it on access
                 newdef[key] = r_value
+                newdef.share(key)
+                if isinstance(theirs, _CowDefinition):
+                    theirs.share(key)
             elif not r_value:
                 newdef[key] = l_value
+                if isinstance(mine, _CowDefinition) and mine.is_shared(key):
+                    newdef.share(key)
             elif type(l_value) != type(r_value):
                 msg = "Unable to merge definitions. Differing types: {} vs {}"
                 msg = msg.format(type(l_value), type(r_value))
                 raise MergeConflictException(msg)
             elif l_value.__class__ == SubRecord:
-                newdef[key] = l_value.merge(r_value)
+                newdef[key] = mine[key].merge(r_value)
             else:
                 raise MergeConflictException("Only subrecords can be merged. (%s)", key)
         self.set("definition", newdef)
@@ -256,7 +468,7 @@ class SubRecord(Keyable):
     def to_bigquery(self, name):
         fields = [
             v.to_bigquery(k)
-            for (k, v) in sorted(self.definition.items())
+            for (k, v) in sorted(self._fields())
             if not v.exclude_bigquery
         ]
         retv = {
@@ -267,24 +479,57 @@ class SubRecord(Keyable):
         }
         return retv
 
+    def _avro_type(self, name, parent=None):
+        this_name = self._avro_name(parent, name)
+        return {
+            "type": "record",
+            "name": this_name,
+            "fields": [v.to_avro(k, this_name) for k, v in sorted(self._fields())],
+        }
+
+    def to_avro(self, name, parent=None):
+        retv = {"name": self.key_to_bq(name), "type": self._avro_type(name, parent)}
+        if not self.required:
+            retv["type"] = ["null", retv["type"]]
+            retv["default"] = None
+        if self.doc:
+            retv["doc"] = self.doc
+        return retv
+
+    def to_arrow(self, name):
+        return {
+            "name": self.key_to_bq(name),
+            "type": "struct",
+            "nullable": not self.required,
+            "children": [v.to_arrow(k) for (k, v) in sorted(self._fields())],
+        }
+
     def to_proto(self, name, indent):
-        if (
-            self.type_name is not None
-        ):  # named message type -- produced at top level, once
-            message_type = _proto_message_name(self.type_name)
+        return self._to_proto(name, indent, self.type_name)
+
+    def _to_proto(self, name, indent, type_name):
+        if _proto_messages.get() is None:
+            # called outside of Record.to_proto
+            token = _proto_messages.set(OrderedDict())
+            try:
+                return self._to_proto(name, indent, type_name)
+            finally:
+                _proto_messages.reset(token)
+        if type_name is not None:  # named message type -- produced at top level, once
+            message_type = _proto_message_name(type_name)
             anon = False
         else:  # anonymous message type -- nests within containing message
             message_type = _proto_message_name(self.key_to_proto(name)) + "Struct"
             anon = True
 
         proto_def = ""
-        global _proto_messages
-        if anon or message_type not in _proto_messages:
+        messages = _proto_messages.get()
+        if anon or message_type not in messages:
             # Explicitly indexed values go first, then implicitly indexed values:
-            expected = sum([1 for k, v in self.definition.items() if not v.pr_ignore])
+            expected = sum([1 for k, v in self._fields() if not v.pr_ignore])
             explicits = [
                 (v.to_proto(k, indent), v.explicit_index)
-                for k, v in self.definition.items()
+                for k, v in self._fields()
                 if v.explicit_index is not None and not v.pr_ignore
             ]
             explicits = list(sorted(explicits, key=lambda t: t[1]))
@@ -307,7 +552,7 @@ class SubRecord(Keyable):
                 _proto_indent("\n".join(proto), indent + 1),
             )
             if not anon:
-                _proto_messages[message_type] = proto_def
+                messages[message_type] = proto_def
                 proto_def = ""
         return {
             "message": proto_def,
@@ -319,7 +564,7 @@ class SubRecord(Keyable):
         retv = self._docs_common(category)
         fields = {
             self.key_to_bq(k): v.docs_bq(parent_category=category)
-            for (k, v) in sorted(self.definition.items())
+            for (k, v) in sorted(self._fields())
             if not v.exclude_bigquery
         }
         retv["fields"] = fields
@@ -328,13 +573,13 @@ class SubRecord(Keyable):
     def print_indent_string(self, name, indent):
         tabs = "\t" * indent if indent else ""
         print("{}{:s}:subrecord:".format(tabs, self.key_to_string(name)))
-        for name, value in sorted(self.definition.items()):
+        for name, value in sorted(self._fields()):
             value.print_indent_string(name, indent + 1)
 
     def to_es(self):
         p = {
             self.key_to_es(k): v.to_es()
-            for k, v in sorted(self.definition.items())
+            for k, v in sorted(self._fields())
             if not v.exclude_elasticsearch
         }
         retv = {"properties": p}
@@ -356,20 +601,32 @@ class SubRecord(Keyable):
         retv = self._docs_common(category)
         retv["fields"] = {
             self.key_to_es(k): v.docs_es(parent_category=category)
-            for k, v in sorted(self.definition.items())
+            for k, v in sorted(self._fields())
             if not v.exclude_elasticsearch
         }
         return retv
 
     def to_dict(self):
-        source = sorted(self.definition.items())
+        source = sorted(self._fields())
         p = {self.key_to_es(k): v.to_dict() for k, v in source}
-        return {
+        retv = {
             "type": "subrecord",
             "subfields": p,
             "doc": self.doc,
             "required": self.required,
+            "options": self._options(),
         }
+        ports = [self.key_to_es(k) for k, _ in source if isinstance(k, Port)]
+        if ports:
+            retv["ports"] = ports
+        base = self._base_type()
+        if base is not SubRecord:
+            retv["class"] = base.__name__
+        cls = getattr(type(self), "_UNFROZEN", type(self))
+        if "_TYPE_SPEC" in cls.__dict__:
+            # the name of a SubRecordType, which docs and to_flat report
+            retv["type_class"] = cls.__name__
+        return retv
 
     def validate(
         self, name, value, policy=_NO_ARG, parent_policy=_NO_ARG, path=_NO_ARG
@@ -380,8 +637,10 @@ class SubRecord(Keyable):
 
         try:
             if not isinstance(value, dict):
-                m = "%s: %s is not a dict" % (name, str(value))
-                raise DataValidationException(m, path=path)
+                m = "%s: %s is not a dict"
+                raise DataValidationException(
+                    m, path=path, value=value, format_args=(name, value)
+                )
         except DataValidationException as e:
             self._handle_validation_exception(calculated_policy, e)
             # cannot iterate over members if this isn't a dictionary
@@ -390,10 +649,13 @@ class SubRecord(Keyable):
             try:
                 if not self.allow_unknown and subkey not in self.definition:
                     raise DataValidationException(
-                        "%s: %s is not a valid subkey" % (name, subkey), path=path
+                        "%s: %s is not a valid subkey",
+                        path=path,
+                        format_args=(name, subkey),
+                        value=subkey,
                     )
                 if subkey in self.definition:
-                    self.definition[subkey].validate(
+                    dict.__getitem__(self.definition, subkey).validate(
                         subkey,
                         subvalue,
                         policy,
@@ -403,16 +665,153 @@ class SubRecord(Keyable):
             except DataValidationException as e:
                 self._handle_validation_exception(calculated_policy, e)
 
+    def validate_patch(
+        self, name, patch, policy=_NO_ARG, parent_policy=_NO_ARG, path=_NO_ARG
+    ):
+        """
+        Validates a JSON merge patch (RFC 7396) of a value of this subrecord
+        without the value itself: only the fields present in the patch are
+        checked. See Record.validate_patch.
+        """
+        if not isinstance(patch, dict):
+            # anything but an object replaces the value
+            return self.validate(name, patch, policy, parent_policy, path)
+        calculated_policy = self._calculate_policy(name, policy, parent_policy)
+        if not path:
+            path = []
+        for subkey, subvalue in sorted(patch.items()):
+            try:
+                if subkey not in self.definition:
+                    if self.allow_unknown:
+                        continue
+                    raise DataValidationException(
+                        "%s: %s is not a valid subkey",
+                        path=path,
+                        format_args=(name, subkey),
+                        value=subkey,
+                    )
+                _validate_patch_field(
+                    dict.__getitem__(self.definition, subkey),
+                    subkey,
+                    subvalue,
+                    policy,
+                    calculated_policy,
+                    path + [subkey],
+                )
+            except DataValidationException as e:
+                self._handle_validation_exception(calculated_policy, e)
+
+    def intern_leaves(self):
+        """
+        Replaces leaves that have the same type and options with a single
+        shared instance. Leaves that differ in anything but the order in
+        which they were created (e.g. doc or pr_index) are kept apart.
+
+        Interned leaves are shared copy-on-write, like the fields of a
+        SubRecordType: reaching one through a definition gives a private
+        copy. A ListOf's object_ is shared as is, so do not modify it after
+        interning.
+
+        Returns a report of the number of leaf fields and of the distinct
+        leaf instances and their approximate size in bytes, before and after.
+        """
+        if self.frozen:
+            raise FrozenSchemaException("cannot intern the leaves of a frozen schema")
+        before = {}
+        after = {}
+        _intern_leaves(self, {}, set(), before, after)
+        return {
+            "fields": sum(n for _, n in before.values()),
+            "leaves_before": len(before),
+            "leaves_after": len(after),
+            "bytes_before": sum(_leaf_size(leaf) for leaf, _ in before.values()),
+            "bytes_after": sum(_leaf_size(leaf) for leaf, _ in after.values()),
+        }
+
+
+def _validate_patch_field(node, name, value, policy, parent_policy, path):
+    if value is None:
+        # null removes the field
+        if node.required:
+            m = "%s is a required field and cannot be removed"
+            node._handle_validation_exception(
+                node._calculate_policy(name, policy, parent_policy),
+                DataValidationException(m, path=path, value=value, format_args=(name,)),
+            )
+    elif isinstance(node, SubRecord):
+        node.validate_patch(name, value, policy, parent_policy, path)
+    else:
+        # lists and leaves are replaced as a whole
+        node.validate(name, value, policy, parent_policy, path=path)
+
+
+def _freeze(value):
+    # A hashable equivalent of an option value, keeping e.g. 1 and True apart
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(v) for v in value))
+    if isinstance(value, (set, frozenset)):
+        return (type(value), frozenset(_freeze(v) for v in value))
+    if isinstance(value, dict):
+        return (type(value), frozenset((k, _freeze(v)) for k, v in value.items()))
+    hash(value)
+    return (type(value), value)
+
+
+def _leaf_key(leaf):
+    try:
+        return (
+            type(leaf),
+            frozenset(
+                (k, _freeze(v))
+                for k, v in leaf.__dict__.items()
+                if k != "_value_implicit_index" and v is not _NO_ARG
+            ),
+        )
+    except TypeError:
+        # options that cannot be compared; leave the leaf alone
+        return None
+
+
+def _leaf_size(leaf):
+    return sys.getsizeof(leaf) + sys.getsizeof(leaf.__dict__)
+
+
+def _intern_leaf(leaf, pool, before, after):
+    key = _leaf_key(leaf)
+    retv = leaf if key is None else pool.setdefault(key, leaf)
+    count = before.get(id(leaf), (leaf, 0))[1]
+    before[id(leaf)] = (leaf, count + 1)
+    after[id(retv)] = (retv, 0)
+    return retv
+
+
+def _intern_leaves(node, pool, seen, before, after):
+    # Shared subtrees are visited once; their leaves are replaced in place,
+    # which is invisible to the other definitions holding them.
+    if id(node) in seen:
+        return
+    seen.add(id(node))
+    if isinstance(node, SubRecord):
+        definition = node.definition
+        for key, value in list(dict.items(definition)):
+            if isinstance(value, (SubRecord, ListOf)):
+                _intern_leaves(value, pool, seen, before, after)
+                continue
+            dict.__setitem__(definition, key, _intern_leaf(value, pool, before, after))
+            if isinstance(definition, _CowDefinition):
+                definition.share(key)
+    elif "_value_object_" in node.__dict__:
+        value = node.object_
+        if isinstance(value, (SubRecord, ListOf)):
+            _intern_leaves(value, pool, seen, before, after)
+        else:
+            node.set("object_", _intern_leaf(value, pool, before, after))
+
 
 class _SubRecordDefaulted(SubRecord):
 
     _INIT_DEFAULTS = None
 
-    @classmethod
-    def _get_copy_default(cls, k):
-        v = cls._INIT_DEFAULTS.get(k, _NO_ARG)
-        return copy.deepcopy(v)
-
     def __init__(
         self,
         definition=_NO_ARG,
@@ -422,14 +821,17 @@ class _SubRecordDefaulted(SubRecord):
         *args,
         **kwargs
     ):
-        definition = definition or self._get_copy_default("definition")
-        allow_unknown = allow_unknown or self._get_copy_default("allow_unknown")
-        type_name = type_name or self._get_copy_default("type_name")
-        for k, v in self._INIT_DEFAULTS.items():
-            if k in {"definition", "allow_unknown", "type_name"}:
-                # These keys are managed by the constructor
-                continue
-            self.set(k, copy.deepcopy(v))
+        # The other defaults are class attributes (see _set_default_at_init).
+        # Every instance shares the fields of the type's definition until
+        # one of them is accessed.
+        if not definition:
+            definition = self._INIT_DEFAULTS.get("definition", _NO_ARG)
+            if isinstance(definition, dict):
+                definition = _CowDefinition.shared(definition)
+        allow_unknown = allow_unknown or self._INIT_DEFAULTS.get(
+            "allow_unknown", _NO_ARG
+        )
+        type_name = type_name or self._INIT_DEFAULTS.get("type_name", _NO_ARG)
         super(_SubRecordDefaulted, self).__init__(
             definition=definition,
             extends=extends,
@@ -459,7 +861,11 @@ def SubRecordType(
 ):
     # import pdb; pdb.set_trace()
     name = type_name if type_name else "SubRecordType"
-    t = type(
+    if isinstance(definition, dict):
+        # instances share the fields of the definition, so the caller's
+        # dict and fields must not change them afterwards
+        definition = copy.deepcopy(definition)
+    t = dynamic_type(
         name,
         (_SubRecordDefaulted,),
         {
@@ -514,6 +920,23 @@ class NestedListOf(ListOf):
         return retv
 
 
+# guards the caches of Record.projection, which may be shared by threads
+_cache_lock = threading.Lock()
+
+
+def _validate_batch(record, values, policy):
+    # the exception raised by each value, or None
+    errors = []
+    for value in values:
+        try:
+            record.validate(value, policy)
+        except Exception as e:
+            errors.append(e)
+        else:
+            errors.append(None)
+    return errors
+
+
 class Record(SubRecord):
 
     VALIDATION_POLICY = "error"
@@ -530,32 +953,65 @@ class Record(SubRecord):
         return {name: SubRecord.docs_es(self, parent_category=category)}
 
     def to_bigquery(self):
-        source = sorted(self.definition.items())
+        source = sorted(self._fields())
         return [s.to_bigquery(name) for (name, s) in source if not s.exclude_bigquery]
 
+    def to_avro(self, name):
+        """
+        Returns an Avro schema for the records as JSON values, with the key
+        names of to_bigquery() (e.g. 443 -> p443), for tools that convert
+        JSON records to Avro. It does not describe the encoding of
+        zschema.binary, and zschema does not write Avro data itself.
+        """
+        retv = self._avro_type(name)
+        if self.doc:
+            retv["doc"] = self.doc
+        return retv
+
+    def to_arrow_schema(self):
+        source = sorted(self._fields())
+        return [s.to_arrow(name) for (name, s) in source]
+
     def to_proto(self, name):
-        self.type_name = name
-        SubRecord.to_proto(self, name, 0)
+        messages = OrderedDict()
+        token = _proto_messages.set(messages)
+        try:
+            self._to_proto(name, 0, name)
+        finally:
+            _proto_messages.reset(token)
         return """syntax = "proto3";
 package schema;
 
 import "google/protobuf/timestamp.proto";
 
-""" + "\n".join(
-            _proto_messages.values()
-        )
+""" + "\n".join(messages.values())
 
     def docs_bq(self, name, parent_category=None):
         category = self.category or parent_category
         return {name: SubRecord.docs_bq(self, parent_category=category)}
 
     def print_indent_string(self):
-        for name, field in sorted(self.definition.items()):
+        for name, field in sorted(self._fields()):
             field.print_indent_string(name, 0)
 
-    def validate(self, value, policy=_NO_ARG, path=_NO_ARG):
+    def validate(
+        self, value, policy=_NO_ARG, path=_NO_ARG, fields=None, fail_fast=False
+    ):
+        """
+        Validates value against the record. If fields is given, only the
+        fields at those dotted paths and below them are validated in full
+        (see zschema.projection). With fail_fast, the first error found is
+        raised without logging and cheap checks run first (see
+        zschema.failfast).
+        """
+        if fields is not None:
+            return self.projection(fields).validate(
+                value, policy, path, fail_fast=fail_fast
+            )
         if policy is None:
             policy = _NO_ARG
+        if fail_fast:
+            return self.checker(policy)(value, path)
         if not path:
             path = []
         calculated_policy = self._calculate_policy(
@@ -564,14 +1020,19 @@ import "google/protobuf/timestamp.proto";
         # ^ note: record explicitly does not take a parent_policy
         if not isinstance(value, dict):
             raise DataValidationException(
-                "record is not a dict:\n{}".format(value), path=path
+                "record is not a dict:\n%s",
+                path=path,
+                format_args=(value,),
+                value=value,
             )
         for subkey, subvalue in sorted(value.items()):
             try:
                 if subkey not in self.definition:
-                    msg = "{} is not a valid subkey of root".format(subkey)
-                    raise DataValidationException(msg, path=path)
-                self.definition[subkey].validate(
+                    msg = "%s is not a valid subkey of root"
+                    raise DataValidationException(
+                        msg, path=path, format_args=(subkey,), value=subkey
+                    )
+                dict.__getitem__(self.definition, subkey).validate(
                     subkey,
                     subvalue,
                     policy,
@@ -581,18 +1042,209 @@ import "google/protobuf/timestamp.proto";
             except DataValidationException as e:
                 self._handle_validation_exception(calculated_policy, e)
 
-    def to_dict(self):
-        source = sorted(self.definition.items())
-        return {self.key_to_es(k): v.to_es() for k, v in source}
+    def is_valid(self, value, policy=_NO_ARG):
+        """
+        Returns whether value is valid, i.e. whether validate() would not
+        raise, using fail-fast validation.
+        """
+        try:
+            self.checker(policy)(value)
+        except DataValidationException:
+            return False
+        return True
+
+    def checker(self, policy=_NO_ARG):
+        """
+        Returns the fail-fast checker of the record for policy (see
+        zschema.failfast.compile_checker). Checkers are compiled on first
+        use and cached; like projections, they do not reflect later changes
+        to the schema.
+        """
+        if policy is None:
+            policy = _NO_ARG
+        checkers = self.__dict__.setdefault("_checkers", {})
+        retv = checkers.get(policy)
+        if retv is None:
+            from zschema.failfast import compile_checker
+
+            retv = checkers[policy] = compile_checker(self, policy)
+        return retv
+
+    def avalidate(self, value, policy=_NO_ARG, path=_NO_ARG, executor=None):
+        """
+        Coroutine validating value in executor (default: the event loop's
+        thread pool), for use from asyncio code. See zschema.aio.
+        """
+        from zschema.aio import avalidate
+
+        return avalidate(self, value, policy, path, executor)
+
+    VALIDATE_MANY_BATCH_SIZE = 256
+
+    def validate_many(self, values, policy=_NO_ARG, workers=None, executor=None):
+        """
+        Validates values in batches in a pool of threads (or in executor)
+        and returns, in order, the exception raised by each value or None.
+        Validation does not modify the schema, so a record can be shared by
+        any number of threads; on free-threaded builds of Python, they
+        validate in parallel.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        values = list(values)
+        n = self.VALIDATE_MANY_BATCH_SIZE
+        pool = executor or ThreadPoolExecutor(workers)
+        try:
+            futures = [
+                pool.submit(_validate_batch, self, values[i : i + n], policy)
+                for i in range(0, len(values), n)
+            ]
+            return [e for future in futures for e in future.result()]
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+    def validate_patch(self, patch, policy=_NO_ARG, path=_NO_ARG):
+        """
+        Validates a JSON merge patch (RFC 7396) that will be applied to a
+        valid record, without the record itself. Objects in the patch are
+        merged into the matching subrecords and checked key by key, other
+        values replace the field and are validated in full, and null removes
+        the field, which is an error for required fields. The cost depends
+        on the size of the patch, not of the record.
+        """
+        if policy is None:
+            policy = _NO_ARG
+        if not path:
+            path = []
+        calculated_policy = self._calculate_policy(
+            "root", policy, self.validation_policy
+        )
+        if not isinstance(patch, dict):
+            raise DataValidationException(
+                "patch is not a dict:\n%s", path=path, format_args=(patch,), value=patch
+            )
+        for subkey, subvalue in sorted(patch.items()):
+            try:
+                if subkey not in self.definition:
+                    msg = "%s is not a valid subkey of root"
+                    raise DataValidationException(
+                        msg, path=path, format_args=(subkey,), value=subkey
+                    )
+                _validate_patch_field(
+                    dict.__getitem__(self.definition, subkey),
+                    subkey,
+                    subvalue,
+                    policy,
+                    self.validation_policy,
+                    path + [subkey],
+                )
+            except DataValidationException as e:
+                self._handle_validation_exception(calculated_policy, e)
 
     def to_json(self):
         return json.dumps(self.to_dict(), indent=4)
 
     def to_flat(self):
-        for subname, doc in sorted(self.definition.items()):
+        for subname, doc in sorted(self._fields()):
             for item in doc.to_flat(None, self.key_to_es(subname)):
                 yield item
 
+    # number of projections kept by Record.projection
+    PROJECTION_CACHE_SIZE = 64
+
+    def projection(self, fields):
+        """
+        Returns a copy of the record that validates only the given dotted
+        paths in full (see zschema.projection). Projections are cached; like
+        field_index, they do not reflect later changes to the schema.
+        """
+        fields = frozenset(fields)
+        projections = self.__dict__.setdefault("_projections", OrderedDict())
+        with _cache_lock:
+            retv = projections.get(fields)
+            if retv is not None:
+                projections.move_to_end(fields)
+                return retv
+        from zschema.projection import project
+
+        retv = project(self, fields)
+        with _cache_lock:
+            if fields in projections:
+                # built by another thread in the meantime
+                return projections[fields]
+            if len(projections) >= self.PROJECTION_CACHE_SIZE:
+                projections.popitem(last=False)
+            projections[fields] = retv
+        return retv
+
+    def field_index(self, naming="es"):
+        """
+        Returns a zschema.catalog.FieldIndex mapping the dotted paths of the
+        fields, with Elasticsearch ("es") or BigQuery ("bq") names, to the
+        fields. The index is built on first use and cached; changes made to
+        the schema afterwards are not reflected (freeze it to be sure).
+        """
+        indexes = self.__dict__.setdefault("_field_indexes", {})
+        index = indexes.get(naming)
+        if index is None:
+            from zschema.catalog import build_index
+
+            index = indexes[naming] = build_index(self, naming)
+        return index
+
+    @classmethod
+    def from_dict(cls, d):
+        retv = from_dict(d)
+        if not isinstance(retv, cls):
+            raise Exception("Schema is not a %s: %s" % (cls.__name__, d.get("type")))
+        return retv
+
     @classmethod
     def from_json(cls, j):
-        return cls({(k, __encode(v)) for k, v in sorted(j.items())})
+        if not isinstance(j, dict):
+            j = json.loads(j)
+        return cls.from_dict(j)
+
+
+_COMPOUND_TYPES = {
+    "list": ListOf,
+    "subrecord": SubRecord,
+}
+
+
+# (name, base class) -> class standing in for a SubRecordType in the schemas
+# built by from_dict
+_loaded_types = {}
+
+
+def _loaded_type(name, base):
+    t = _loaded_types.get((name, base))
+    if t is None:
+        t = _loaded_types.setdefault((name, base), dynamic_type(name, (base,), {}))
+    return t
+
+
+def from_dict(d):
+    """
+    Builds a schema object from the output of its to_dict() method.
+    """
+    name = d.get("class") or d["type"]
+    cls = _COMPOUND_TYPES.get(name) or Keyable._types_by_name.get(name)
+    if cls is None:
+        raise Exception("Unknown zschema type: %s" % name)
+    options = dict(d.get("options", {}))
+    if "exclude" in options:
+        options["exclude"] = set(options["exclude"])
+    if issubclass(cls, SubRecord):
+        ports = set(d.get("ports", []))
+        definition = {
+            (Port(k) if k in ports else k): from_dict(v)
+            for k, v in d["subfields"].items()
+        }
+        if "type_class" in d:
+            cls = _loaded_type(d["type_class"], cls)
+        return cls(definition, **options)
+    if issubclass(cls, ListOf):
+        return cls(from_dict(d["list_of"]), **options)
+    return cls(**options)
@@ -0,0 +1,512 @@
+"""
+Turn validated records into load-ready output for the databases a schema
+compiles to.
+
+ElasticsearchBulkEncoder applies the same exclusions as Record.to_es (fields
+with exclude=["elasticsearch"] are dropped) and streams the records as
+`_bulk` NDJSON request bodies:
+
+    encoder = ElasticsearchBulkEncoder(host, index="ipv4", id_field="ip")
+    for body in encoder.iter_batches(open("hosts.json")):
+        requests.post(url + "/_bulk", data=body, headers=NDJSON_HEADERS)
+
+BigQueryTransformer rewrites records into the shape of Record.to_bigquery():
+Port keys are renamed (443 -> p443), fields excluded from BigQuery are
+dropped, NestedListOf values are wrapped in repeated records and DateTime
+values are normalized to the DATETIME or TIMESTAMP formats BigQuery loads.
+
+PartitionedWriter routes records into one file per day or hour of a
+DateTime field, for date-partitioned tables.
+"""
+
+import datetime
+import json
+import os
+from collections import OrderedDict
+
+from zschema.keys import _NO_ARG, DataValidationException
+from zschema.leaves import DateTime
+from zschema.compounds import ListOf, NestedListOf, SubRecord
+
+_SEPARATORS = (",", ":")
+
+
+def _dumps(value):
+    return json.dumps(value, separators=_SEPARATORS)
+
+
+def chunk(entries, max_bytes, max_count, sizeof=len):
+    """
+    Group an iterable of byte strings into lists holding at most max_count
+    entries and at most max_bytes bytes in total. An entry that is larger
+    than max_bytes on its own is emitted as a batch of one. sizeof returns
+    the size in bytes of an entry.
+    """
+    batch = []
+    size = 0
+    for entry in entries:
+        n = sizeof(entry)
+        if batch and (len(batch) >= max_count or size + n > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(entry)
+        size += n
+    if batch:
+        yield batch
+
+
+def _get_path(value, path):
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _compile_es_projector(node):
+    # Returns a function that strips excluded fields from a value of node,
+    # or None when nothing below node is excluded, so that untouched
+    # subtrees are passed through (and shared) as they are.
+    if isinstance(node, SubRecord):
+        drop = set()
+        children = {}
+        for k, child in sorted(node._fields()):
+            key = node.key_to_es(k)
+            if child.exclude_elasticsearch:
+                drop.add(key)
+                continue
+            project = _compile_es_projector(child)
+            if project is not None:
+                children[key] = project
+        if not drop and not children:
+            return None
+
+        def project_subrecord(value):
+            if type(value) is not dict:
+                return value
+            retv = {}
+            for k, v in value.items():
+                if k in drop:
+                    continue
+                project = children.get(k)
+                retv[k] = v if project is None or v is None else project(v)
+            return retv
+
+        return project_subrecord
+    if isinstance(node, ListOf):
+        project = _compile_es_projector(node.object_)
+        if project is None:
+            return None
+
+        def project_list(value):
+            if type(value) is not list:
+                return value
+            return [v if v is None else project(v) for v in value]
+
+        return project_list
+    return None
+
+
+class ElasticsearchBulkEncoder(object):
+    """
+    Encodes records as Elasticsearch `_bulk` request bodies.
+
+    Documents may be given either as dicts or as raw JSON lines. When the
+    schema excludes nothing from Elasticsearch and no id_field is set, raw
+    lines are copied into the request body without being parsed.
+    """
+
+    def __init__(
+        self,
+        record,
+        index=None,
+        id_field=None,
+        action="index",
+        max_bytes=10 * 1024 * 1024,
+        max_docs=1000,
+    ):
+        self.record = record
+        self.index = index
+        self.id_path = id_field.split(".") if id_field else None
+        self.action = action
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self._project = _compile_es_projector(record)
+        if self.id_path is None:
+            self._static_action = self._action_line(None)
+
+    def project(self, doc):
+        """Return doc without the fields excluded from Elasticsearch."""
+        if self._project is None:
+            return doc
+        return self._project(doc)
+
+    def _action_line(self, doc_id):
+        meta = {}
+        if self.index is not None:
+            meta["_index"] = self.index
+        if doc_id is not None:
+            meta["_id"] = doc_id
+        return (_dumps({self.action: meta}) + "\n").encode("utf-8")
+
+    def encode(self, doc):
+        """Return the action and source lines for one document as bytes."""
+        if isinstance(doc, (str, bytes)):
+            if self._project is None and self.id_path is None:
+                if isinstance(doc, str):
+                    doc = doc.encode("utf-8")
+                return self._static_action + doc.rstrip(b"\r\n") + b"\n"
+            doc = json.loads(doc)
+        if self.id_path is None:
+            action = self._static_action
+        else:
+            action = self._action_line(_get_path(doc, self.id_path))
+        source = _dumps(self.project(doc)) + "\n"
+        return action + source.encode("utf-8")
+
+    def iter_batches(self, docs):
+        """
+        Yield bulk request bodies (bytes) capped by max_bytes and max_docs.
+        Blank lines in the input are skipped.
+        """
+        entries = (self.encode(doc) for doc in docs if not _is_blank(doc))
+        for batch in chunk(entries, self.max_bytes, self.max_docs):
+            yield b"".join(batch)
+
+
+def _is_blank(doc):
+    return isinstance(doc, (str, bytes)) and not doc.strip()
+
+
+def _bq_datetime(leaf, name, strict):
+    # Values that do not parse only get this far when validation is off or
+    # does not raise for them. They fail like validation would when strict,
+    # and are loaded as null (or left out of lists) otherwise.
+    utc = datetime.timezone.utc
+    if leaf.BQ_TYPE == "TIMESTAMP":
+
+        def convert(dt):
+            return dt.astimezone(utc).isoformat(sep=" ")
+
+    else:
+        # DATETIME is civil time without a zone, so values are shifted to UTC
+        def convert(dt):
+            return dt.astimezone(utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def normalize(value):
+        try:
+            dt = leaf.parse(value)
+        except (ValueError, TypeError, OverflowError):
+            if strict:
+                raise DataValidationException(
+                    "%s: %s could not be parsed as a DateTime",
+                    format_args=(name, value),
+                    value=value,
+                )
+            return None
+        return convert(dt)
+
+    return normalize
+
+
+def _compile_bq_transformer(node, name, policy, parent_policy):
+    # Returns a function that rewrites a (non-null) value of node into the
+    # BigQuery row shape, or None when the value can be used unchanged.
+    # Policies are resolved as in validate().
+    calculated_policy = node._calculate_policy(name, policy, parent_policy)
+    if isinstance(node, NestedListOf):
+        inner = _compile_bq_transformer(node.object_, name, policy, calculated_policy)
+        name = node.subrecord_name
+        # matches SubRecord({subrecord_name: ListOf(object_)}) in to_bigquery
+        wrap = not isinstance(node.object_, ListOf)
+
+        def transform_nested(value):
+            if type(value) is not list:
+                return value
+            retv = []
+            for v in value:
+                if v is not None and inner is not None:
+                    v = inner(v)
+                    if v is None:
+                        # dropped, as BigQuery does not load nulls in arrays
+                        continue
+                retv.append({name: [v] if wrap else v})
+            return retv
+
+        return transform_nested
+    if isinstance(node, SubRecord):
+        fields = {}
+        changed = False
+        for k, child in sorted(node._fields()):
+            if child.exclude_bigquery:
+                changed = True
+                continue
+            key = node.key_to_es(k)
+            out_key = node.key_to_bq(k)
+            transform = _compile_bq_transformer(child, k, policy, calculated_policy)
+            fields[key] = (out_key, transform)
+            changed = changed or transform is not None or out_key != key
+        if not changed and not node.allow_unknown:
+            return None
+
+        def transform_subrecord(value):
+            if type(value) is not dict:
+                return value
+            retv = {}
+            for k, v in value.items():
+                field = fields.get(k)
+                if field is None:
+                    # excluded, or unknown to the table schema
+                    continue
+                out_key, transform = field
+                retv[out_key] = v if transform is None or v is None else transform(v)
+            return retv
+
+        return transform_subrecord
+    if isinstance(node, ListOf):
+        transform = _compile_bq_transformer(
+            node.object_, name, policy, calculated_policy
+        )
+        if transform is None:
+            return None
+
+        def transform_list(value):
+            if type(value) is not list:
+                return value
+            retv = []
+            for v in value:
+                if v is not None:
+                    v = transform(v)
+                    if v is None:
+                        # dropped, as BigQuery does not load nulls in arrays
+                        continue
+                retv.append(v)
+            return retv
+
+        return transform_list
+    if isinstance(node, DateTime):
+        return _bq_datetime(node, name, calculated_policy == "error")
+    return None
+
+
+class BigQueryTransformer(object):
+    """
+    Rewrites records into exactly the shape expected by the table schema
+    generated by Record.to_bigquery(), optionally validating them first.
+
+    iter_batches yields lists of rows for tabledata.insertAll requests and
+    iter_load_chunks yields newline-delimited JSON for load jobs; both are
+    capped by row count and encoded size.
+    """
+
+    # insertAll allows 10MB per request and recommends 500 rows
+    INSERT_MAX_BYTES = 9 * 1024 * 1024
+    INSERT_MAX_ROWS = 500
+
+    def __init__(self, record, validate=False, policy=None):
+        self.record = record
+        self.validate = validate
+        self.policy = policy
+        self._transform = _compile_bq_transformer(
+            record,
+            "root",
+            _NO_ARG if policy is None else policy,
+            record.validation_policy,
+        )
+
+    def transform(self, value):
+        if isinstance(value, (str, bytes)):
+            value = json.loads(value)
+        if self.validate:
+            self.record.validate(value, self.policy)
+        if self._transform is None:
+            return value
+        return self._transform(value)
+
+    def _encoded(self, values):
+        for value in values:
+            if isinstance(value, (str, bytes)) and not value.strip():
+                continue
+            row = self.transform(value)
+            yield row, (_dumps(row) + "\n").encode("utf-8")
+
+    def iter_batches(
+        self, values, max_bytes=INSERT_MAX_BYTES, max_rows=INSERT_MAX_ROWS
+    ):
+        """Yield lists of transformed rows."""
+        entries = self._encoded(values)
+        for batch in chunk(entries, max_bytes, max_rows, sizeof=_encoded_size):
+            yield [row for row, _ in batch]
+
+    def iter_load_chunks(self, values, max_bytes=1024**3, max_rows=10**7):
+        """Yield newline-delimited JSON (bytes) for load job files."""
+        entries = self._encoded(values)
+        for batch in chunk(entries, max_bytes, max_rows, sizeof=_encoded_size):
+            yield b"".join(line for _, line in batch)
+
+
+def _encoded_size(entry):
+    return len(entry[1])
+
+
+def _resolve_path(record, path):
+    # Find the schema node for a dotted path of data keys. A path through a
+    # list has no single value per record, so it cannot be resolved.
+    node = record
+    for part in path.split("."):
+        if not isinstance(node, SubRecord):
+            raise KeyError(path)
+        children = {node.key_to_es(k): v for k, v in node._fields()}
+        node = children[part]
+        if isinstance(node, ListOf):
+            raise ValueError("%s is a list, or inside one" % path)
+    return node
+
+
+def _resolve_policy(record, path, policy):
+    # The validation policy that validate() applies to the field at a path
+    # found by _resolve_path.
+    if policy is None:
+        policy = _NO_ARG
+    calculated_policy = record._calculate_policy(
+        "root", policy, record.validation_policy
+    )
+    node = record
+    for part in path.split("."):
+        children = {node.key_to_es(k): (k, v) for k, v in node._fields()}
+        k, node = children[part]
+        calculated_policy = node._calculate_policy(k, policy, calculated_policy)
+    return calculated_policy
+
+
+class PartitionedWriter(object):
+    """
+    Writes records as JSON lines into one file per partition of a DateTime
+    field, e.g. "20170616.json" for granularity="day" and "2017061620.json"
+    for granularity="hour" (the UTC date or hour, as BigQuery partitions
+    are named). Records without a value go to "__NULL__.json", and records
+    whose value is not a valid DateTime, which only get this far if the
+    validation policy of the field is not "error", to "__INVALID__.json".
+
+    At most max_open_files partition files are open at a time; the least
+    recently used one is closed when another is needed. close() writes
+    manifest.json listing each partition with its row count.
+
+    Records can be validated (validate=True) and rewritten by transform
+    (e.g. BigQueryTransformer(record).transform) on the way through.
+    """
+
+    GRANULARITIES = {"day": "%Y%m%d", "hour": "%Y%m%d%H"}
+    NULL_PARTITION = "__NULL__"
+    INVALID_PARTITION = "__INVALID__"
+    MANIFEST = "manifest.json"
+
+    def __init__(
+        self,
+        directory,
+        record,
+        field,
+        granularity="day",
+        max_open_files=64,
+        buffer_size=1024 * 1024,
+        validate=False,
+        policy=None,
+        transform=None,
+    ):
+        if granularity not in self.GRANULARITIES:
+            raise ValueError("granularity must be one of: day, hour")
+        leaf = _resolve_path(record, field)
+        if not isinstance(leaf, DateTime):
+            raise ValueError("%s is not a DateTime field" % field)
+        self.directory = directory
+        self.record = record
+        self.field = field
+        self.granularity = granularity
+        self.max_open_files = max_open_files
+        self.buffer_size = buffer_size
+        self.validate = validate
+        self.policy = policy
+        self.transform = transform
+        self._leaf = leaf
+        self._strict = _resolve_policy(record, field, policy) == "error"
+        self._path = field.split(".")
+        self._format = self.GRANULARITIES[granularity]
+        self._files = OrderedDict()
+        self._rows = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def partition(self, value):
+        """Return the partition name for a record."""
+        v = _get_path(value, self._path)
+        if v is None:
+            return self.NULL_PARTITION
+        try:
+            dt = self._leaf.parse(v)
+        except (ValueError, TypeError, OverflowError):
+            if self._strict:
+                raise DataValidationException(
+                    "%s: %s could not be parsed as a DateTime",
+                    path=list(self._path),
+                    format_args=(self.field, v),
+                    value=v,
+                )
+            return self.INVALID_PARTITION
+        return dt.astimezone(datetime.timezone.utc).strftime(self._format)
+
+    def _file(self, partition):
+        fd = self._files.get(partition)
+        if fd is not None:
+            self._files.move_to_end(partition)
+            return fd
+        if len(self._files) >= self.max_open_files:
+            _, oldest = self._files.popitem(last=False)
+            oldest.close()
+        # truncate files left over from earlier runs on first use
+        mode = "a" if partition in self._rows else "w"
+        fd = open(
+            os.path.join(self.directory, partition + ".json"),
+            mode,
+            buffering=self.buffer_size,
+        )
+        self._files[partition] = fd
+        self._rows.setdefault(partition, 0)
+        return fd
+
+    def write(self, value):
+        if isinstance(value, (str, bytes)):
+            value = json.loads(value)
+        if self.validate:
+            self.record.validate(value, self.policy)
+        partition = self.partition(value)
+        if self.transform is not None:
+            value = self.transform(value)
+        self._file(partition).write(_dumps(value) + "\n")
+        self._rows[partition] += 1
+        return partition
+
+    def manifest(self):
+        return {
+            "field": self.field,
+            "granularity": self.granularity,
+            "partitions": [
+                {"partition": p, "path": p + ".json", "rows": n}
+                for p, n in sorted(self._rows.items())
+            ],
+        }
+
+    def close(self):
+        """Close all partition files and write the manifest, returning it."""
+        while self._files:
+            _, fd = self._files.popitem()
+            fd.close()
+        manifest = self.manifest()
+        with open(os.path.join(self.directory, self.MANIFEST), "w") as fd:
+            json.dump(manifest, fd, indent=4)
+        return manifest
@@ -0,0 +1,229 @@
+"""
+Fail-fast validation, for callers that only need to know whether a record
+is valid.
+
+    host.is_valid(value)                    # True or False
+    host.validate(value, fail_fast=True)    # raises at the first error
+
+compile_checker() turns a record into a checker that raises a
+DataValidationException at the first error it finds, without logging. It
+visits keys in the order of the data, and checks the structure and types
+of the whole value first: dicts and lists, unknown keys, list sizes,
+required fields and the classes of the leaves. The checks of the leaves
+themselves (Leaf._validate) then run from the cheapest to the most
+expensive, by VALIDATION_COST: bounds and Enum values, then IP addresses,
+then regular expressions, then DateTime parsing. Invalid records are thus
+usually rejected without running the expensive checks.
+
+A record is valid under fail-fast validation exactly when Record.validate
+would not raise with the same policy. The policies are resolved when the
+checker is compiled, and subtrees in which nothing can raise (because of a
+warn or ignore policy) are not visited at all. Nodes of types that
+override validate() are validated with it, after all other checks.
+"""
+
+from operator import itemgetter
+
+from zschema.compounds import ListOf, SubRecord
+from zschema.keys import DataValidationException, _NO_ARG
+from zschema.leaves import Leaf
+
+# leaf checks up to this cost run while the structure is checked
+INLINE_COST = 1
+
+# the cost of nodes validated with their own validate()
+FALLBACK_COST = 10
+
+
+def _path(path, base):
+    # paths are built as (parent, key) pairs and only made lists on errors
+    keys = []
+    while path is not None:
+        path, key = path
+        keys.append(key)
+    keys.reverse()
+    return base + keys
+
+
+def _error(message, path, base, args, value):
+    path = _path(path, base)
+    return DataValidationException(message, path=path, format_args=args, value=value)
+
+
+def _cost(node, costs):
+    cls = type(node)
+    for base in cls.__mro__:
+        if base in costs:
+            return costs[base]
+    return getattr(node, "VALIDATION_COST", FALLBACK_COST)
+
+
+def _overrides(node, cls, method):
+    return getattr(type(node), method) is not getattr(cls, method)
+
+
+def _compile(node, policy, parent_policy, costs):
+    if isinstance(node, Leaf) and not (
+        _overrides(node, Leaf, "validate")
+        or _overrides(node, Leaf, "_raising_validate")
+    ):
+        return _compile_leaf(node, policy, parent_policy, costs)
+    if isinstance(node, ListOf) and not _overrides(node, ListOf, "validate"):
+        return _compile_list(node, policy, parent_policy, costs)
+    if isinstance(node, SubRecord) and not _overrides(node, SubRecord, "validate"):
+        return _compile_subrecord(node, policy, parent_policy, costs)
+    return _compile_fallback(node, policy, parent_policy, costs)
+
+
+def _compile_leaf(leaf, policy, parent_policy, costs):
+    if leaf._calculate_policy("leaf", policy, parent_policy) != "error":
+        # nothing below a warn or ignore policy raises
+        return None
+    required = leaf.required
+    expected = leaf.EXPECTED_CLASS
+    validate = getattr(leaf, "_validate", None)
+    cost = _cost(leaf, costs)
+
+    def run(name, value, path, base):
+        try:
+            validate(str(name), value)
+        except DataValidationException as e:
+            raise _error(e.template, path, base, e.format_args, e.value)
+
+    def check(name, value, path, base, deferred):
+        if value is None:
+            if required:
+                m = "%s is a required field, but received None"
+                raise _error(m, path, base, (name,), value)
+            return
+        if not isinstance(value, expected):
+            m = "class mismatch for %s: expected %s, %s has class %s"
+            args = (leaf.key_to_string(name), expected, value, type(value).__name__)
+            raise _error(m, path, base, args, value)
+        if validate is None:
+            return
+        if cost <= INLINE_COST:
+            run(name, value, path, base)
+        else:
+            deferred.append((cost, run, name, value, path))
+
+    return check
+
+
+def _compile_list(node, policy, parent_policy, costs):
+    calculated = node._calculate_policy("list", policy, parent_policy)
+    fatal = calculated == "error"
+    item = _compile(node.object_, policy, calculated, costs)
+    if not fatal and item is None:
+        return None
+    max_items = node.max_items
+    min_items = node.min_items
+
+    def check(name, value, path, base, deferred):
+        if not isinstance(value, list):
+            if fatal:
+                m = "%s: %s is not a list"
+                raise _error(m, path, base, (name, value), value)
+            return
+        if max_items > 0 and len(value) > max_items:
+            if fatal:
+                m = "%s: %s has too many values (max: %i)"
+                raise _error(m, path, base, (name, value, max_items), value)
+            return
+        if min_items > 0 and len(value) < min_items:
+            if fatal:
+                m = "%s: %s has too few values (min: %i)"
+                raise _error(m, path, base, (name, value, min_items), value)
+            return
+        if item is not None:
+            for i, v in enumerate(value):
+                item(name, v, (path, i), base, deferred)
+
+    return check
+
+
+def _compile_fields(node, policy, parent_policy, costs):
+    fields = {}
+    for k, v in node._fields():
+        check = _compile(v, policy, parent_policy, costs)
+        if check is not None:
+            fields[k] = check
+    return fields
+
+
+def _compile_subrecord(node, policy, parent_policy, costs):
+    calculated = node._calculate_policy("subrecord", policy, parent_policy)
+    fatal = calculated == "error"
+    fields = _compile_fields(node, policy, calculated, costs)
+    if not fatal and not fields:
+        return None
+    definition = node.definition
+    check_unknown = fatal and not node.allow_unknown
+
+    def check(name, value, path, base, deferred):
+        if not isinstance(value, dict):
+            if fatal:
+                m = "%s: %s is not a dict"
+                raise _error(m, path, base, (name, value), value)
+            return
+        for k, v in value.items():
+            field = fields.get(k)
+            if field is not None:
+                field(k, v, (path, k), base, deferred)
+            elif check_unknown and k not in definition:
+                m = "%s: %s is not a valid subkey"
+                raise _error(m, path, base, (name, k), k)
+
+    return check
+
+
+def _compile_fallback(node, policy, parent_policy, costs):
+    cost = _cost(node, costs)
+
+    def run(name, value, path, base):
+        node.validate(name, value, policy, parent_policy, path=_path(path, base))
+
+    def check(name, value, path, base, deferred):
+        deferred.append((cost, run, name, value, path))
+
+    return check
+
+
+def compile_checker(record, policy=_NO_ARG, costs=None):
+    """
+    Returns a function checker(value, path=None) that raises a
+    DataValidationException at the first error in value, or returns None.
+    costs can map leaf classes to costs, overriding their VALIDATION_COST
+    (for instance with costs measured on real data).
+    """
+    if policy is None:
+        policy = _NO_ARG
+    costs = costs or {}
+    calculated = record._calculate_policy("root", policy, record.validation_policy)
+    fatal = calculated == "error"
+    # like Record.validate, which passes its own policy to its fields
+    fields = _compile_fields(record, policy, record.validation_policy, costs)
+    definition = record.definition
+    by_cost = itemgetter(0)
+
+    def checker(value, path=None):
+        base = list(path or [])
+        if not isinstance(value, dict):
+            m = "record is not a dict:\n%s"
+            raise DataValidationException(
+                m, path=base, format_args=(value,), value=value
+            )
+        deferred = []
+        for k, v in value.items():
+            field = fields.get(k)
+            if field is not None:
+                field(k, v, (None, k), base, deferred)
+            elif fatal and k not in definition:
+                m = "%s is not a valid subkey of root"
+                raise DataValidationException(m, path=base, format_args=(k,), value=k)
+        if deferred:
+            deferred.sort(key=by_cost)
+            for _, run, name, v, p in deferred:
+                run(name, v, p, base)
+
+    return checker
@@ -1,11 +1,10 @@
-from __future__ import print_function
-from builtins import int, str, dict
-from six import string_types
-
+import copy
+import itertools
 import logging
 import sys
 
-_keyable_counter = 0
+# next() on a count is atomic, so schemas can be built in several threads
+_keyable_counter = itertools.count()
 
 
 class _NO_ARG(object):
@@ -19,10 +18,134 @@ class _NO_ARG(object):
         cls._instance = retv
         return retv
 
+    def __reduce__(self):
+        # pickle the singleton by reference to the module-level name
+        return "_NO_ARG"
+
 
 _NO_ARG = _NO_ARG()
 
 
+class _TypeSpec(object):
+    """
+    Picklable recipe for a class built at runtime by one of the *Type()
+    factories (e.g. SubRecordType). Such classes cannot be pickled by
+    reference, so the class is rebuilt from its attributes when unpickled,
+    once per pickle, and shared by all instances that refer to it.
+    """
+
+    def __init__(self, cls):
+        self.cls = cls
+
+    def __reduce__(self):
+        cls = self.cls
+        attrs = {
+            k: v
+            for k, v in cls.__dict__.items()
+            if k not in ("__dict__", "__weakref__", "_TYPE_SPEC")
+        }
+        return (_rebuild_type_spec, (cls.__name__, cls.__bases__, attrs))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _rebuild_type_spec(name, bases, attrs):
+    return dynamic_type(name, bases, attrs)._TYPE_SPEC
+
+
+def dynamic_type(name, bases, attrs):
+    """
+    Create a Keyable subclass at runtime that can still be pickled and
+    copied along with its instances.
+    """
+    # _TYPE_SPEC is set before the class is created so that it is not
+    # added to Keyable._types_by_name
+    cls = type(name, bases, dict(attrs, _TYPE_SPEC=None))
+    cls._TYPE_SPEC = _TypeSpec(cls)
+    return cls
+
+
+def _restore_keyable(spec):
+    return object.__new__(spec.cls)
+
+
+class FrozenSchemaException(Exception):
+    pass
+
+
+class _Frozen(object):
+    """
+    Mixin for the classes of frozen schema objects (see Keyable.freeze).
+    Private attributes that do not hold options (e.g. caches) can still be
+    set.
+    """
+
+    frozen = True
+
+    def _immutable(self, *args, **kwargs):
+        raise FrozenSchemaException(
+            "%s is frozen and cannot be modified" % type(self).__name__
+        )
+
+    set = _immutable
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __delattr__ = _immutable
+
+    def __setattr__(self, k, v):
+        if not k.startswith("_") or k.startswith("_value_"):
+            self._immutable()
+        object.__setattr__(self, k, v)
+
+    def freeze(self):
+        return self
+
+    def _freeze(self, memo, shared):
+        return self
+
+    def __reduce_ex__(self, protocol):
+        cls = self._UNFROZEN
+        spec = cls.__dict__.get("_TYPE_SPEC")
+        return (_restore_frozen, (spec or cls,), self.__getstate__())
+
+
+# unfrozen class -> frozen class
+_frozen_classes = {}
+
+
+def _frozen_class(cls):
+    retv = _frozen_classes.get(cls)
+    if retv is None:
+        # dynamic_type keeps the frozen classes out of Keyable._types_by_name
+        retv = dynamic_type(cls.__name__, (_Frozen, cls), {"_UNFROZEN": cls})
+        retv.__module__ = cls.__module__
+        _frozen_classes[cls] = retv
+    return retv
+
+
+def _restore_frozen(cls):
+    if isinstance(cls, _TypeSpec):
+        cls = cls.cls
+    return object.__new__(_frozen_class(cls))
+
+
+# class -> names of the options with class-level defaults
+_default_names = {}
+
+
+def _option_names(cls):
+    retv = _default_names.get(cls)
+    if retv is None:
+        retv = _default_names[cls] = [
+            k.lower() for k in dir(cls) if k.isupper() and not k.startswith("_")
+        ]
+    return retv
+
+
 class Port(object):
 
     def __init__(self, port):
@@ -42,7 +165,7 @@ class Port(object):
     def __eq__(self, other):
         if isinstance(other, int):
             return int(self.port) == other
-        elif isinstance(other, string_types):
+        elif isinstance(other, str):
             return self.port == other
         else:
             return self.port == other.port
@@ -53,7 +176,7 @@ class Port(object):
     def __lt__(self, other):
         if isinstance(other, int):
             return self.port < str(other)
-        elif isinstance(other, string_types):
+        elif isinstance(other, str):
             return self.port < other
         else:
             self.port < other.port
@@ -61,7 +184,7 @@ class Port(object):
     def __gt__(self, other):
         if isinstance(other, int):
             return self.port > str(other)
-        elif isinstance(other, string_types):
+        elif isinstance(other, str):
             return self.port > other
         else:
             self.port > other.port
@@ -162,9 +285,24 @@ class Keyable(object):
 
     # create a map from name of type to class. We can use this
     # in order to create the Python definition from JSON. We need
-    # this in the web interface. We define this in keyable because
+    # this in the web interface. Classes add themselves when they are
+    # defined (see __init_subclass__), except for the classes built at
+    # runtime by the *Type() factories, which cannot be looked up by name.
     _types_by_name = {}
 
+    # options that to_dict() serializes as part of the structure of the
+    # schema rather than as constructor arguments
+    _STRUCTURAL_OPTIONS = {"implicit_index", "definition", "object_"}
+    # stored option name -> constructor argument
+    _OPTION_ARGS = {"explicit_index": "pr_index"}
+    # private attributes holding derived data, which are not copied
+    _CACHES = frozenset(["_field_indexes", "_projections", "_checkers"])
+
+    def __init_subclass__(cls, **kwargs):
+        super(Keyable, cls).__init_subclass__(**kwargs)
+        if "_TYPE_SPEC" not in cls.__dict__:
+            Keyable._types_by_name[cls.__name__] = cls
+
     def __or__(self, f):
         return f(self)
 
@@ -176,21 +314,30 @@ class Keyable(object):
 
     @staticmethod
     def key_to_bq(o):
-        if isinstance(o, string_types):
+        if isinstance(o, str):
             return o
         else:
             return o.to_bigquery()
 
+    @staticmethod
+    def _avro_name(parent, name):
+        # Avro named types share a single namespace, so nested records and
+        # enums get the full name of their path ("host.p443.tls"), in which
+        # the namespace is the full name of the enclosing record. Names
+        # cannot contain dots, so these are unique.
+        name = Keyable.key_to_bq(name)
+        return ".".join([parent, name]) if parent else name
+
     @staticmethod
     def key_to_proto(o):
-        if isinstance(o, string_types):
+        if isinstance(o, str):
             return o
         else:
             return o.to_proto()
 
     @staticmethod
     def key_to_es(o):
-        if isinstance(o, string_types):
+        if isinstance(o, str):
             if not Keyable._check_valid_name(o):
                 raise Exception("invalid key name: %s" % o)
             return o
@@ -199,7 +346,7 @@ class Keyable(object):
 
     @staticmethod
     def key_to_string(o):
-        if isinstance(o, string_types):
+        if isinstance(o, str):
             if not Keyable._check_valid_name(o):
                 raise Exception("invalid key name: %s" % o)
             return o
@@ -213,10 +360,10 @@ class Keyable(object):
             raise e
         if policy == "error":
             e.force = True
-            logging.error(e.message)
+            _warning_handler(e, logging.ERROR)
             raise e
         elif policy == "warn":
-            logging.warning(e.message)
+            _warning_handler(e, logging.WARNING)
         elif policy == "ignore":
             pass
         else:
@@ -285,26 +432,44 @@ class Keyable(object):
         return TypeFactoryFactory(cls=cls, args=args, kwargs=kwargs)
 
     @classmethod
-    def _populate_types_by_name(cls):
-        if cls._types_by_name:
-            return
-
-        def __iter_classes(kls):
-            try:
-                for klass in kls.__subclasses__():
-                    for klass2 in __iter_classes(klass):
-                        yield klass2
-            except TypeError:
-                try:
-                    for klass in kls.__subclasses__(kls):
-                        for klass2 in __iter_classes(klass):
-                            yield klass2
-                except:
-                    pass
-            yield kls
-
-        for klass in __iter_classes(Keyable):
-            Keyable._types_by_name[klass.__name__] = klass
+    def _base_type(cls):
+        """
+        The closest class of cls that can be looked up in _types_by_name.
+        """
+        for klass in cls.__mro__:
+            if (
+                not klass.__name__.startswith("_")
+                and Keyable._types_by_name.get(klass.__name__) is klass
+            ):
+                return klass
+        return cls
+
+    def _options(self):
+        """
+        Returns the options set on this object that differ from the defaults
+        of its base type, as constructor keyword arguments.
+        """
+        options = {}
+        cls = getattr(type(self), "_UNFROZEN", type(self))
+        if "_TYPE_SPEC" in cls.__dict__:
+            # defaults set on a class built by ListOfType/SubRecordType
+            for k, v in cls.__dict__.items():
+                if k.isupper() and not k.startswith("_"):
+                    options[k.lower()] = v
+        for k, v in self.__dict__.items():
+            if k.startswith("_value_") and v is not _NO_ARG:
+                options[k[len("_value_") :]] = v
+        base = self._base_type()
+        retv = {}
+        for k, v in sorted(options.items()):
+            if v is _NO_ARG or k in self._STRUCTURAL_OPTIONS:
+                continue
+            if v == getattr(base, k.upper(), None):
+                continue
+            if isinstance(v, (set, frozenset)):
+                v = sorted(v)
+            retv[self._OPTION_ARGS.get(k, k)] = v
+        return retv
 
     def __init__(
         self,
@@ -322,7 +487,6 @@ class Keyable(object):
         pr_ignore=_NO_ARG,
         es_dynamic_policy=_NO_ARG,
     ):
-        global _keyable_counter
         self.set("required", required)
         self.set("desc", desc)
         self.set("doc", doc)
@@ -334,8 +498,7 @@ class Keyable(object):
         self.set("ignore", ignore)
         self.set("validation_policy", validation_policy)
         self.set("explicit_index", pr_index)
-        self.set("implicit_index", _keyable_counter)
-        _keyable_counter += 1
+        self.set("implicit_index", next(_keyable_counter))
         self.set("pr_ignore", pr_ignore)
         self.set("es_dynamic_policy", es_dynamic_policy)
 
@@ -350,9 +513,10 @@ class Keyable(object):
         retv = {
             "required": self.required,
             "doc": self.doc,
-            "type": self.__class__.__name__,
+            "type": self._base_type().__name__,
             "metadata": self.metadata,
             "examples": self.examples,
+            "options": self._options(),
         }
         return retv
 
@@ -360,6 +524,93 @@ class Keyable(object):
         new_k = "_value_" + k
         setattr(self, new_k, v)
 
+    def __getstate__(self):
+        # Unset options make up most of a Keyable's __dict__ and read the
+        # same whether they are stored as _NO_ARG or missing, so leave them
+        # out of pickles and copies.
+        # Caches are rebuilt on demand.
+        return {
+            k: v
+            for k, v in self.__dict__.items()
+            if (v is not _NO_ARG or not k.startswith("_value_"))
+            and k not in self._CACHES
+        }
+
+    def __reduce_ex__(self, protocol):
+        spec = type(self).__dict__.get("_TYPE_SPEC")
+        if spec is None:
+            return super(Keyable, self).__reduce_ex__(protocol)
+        return (_restore_keyable, (spec,), self.__getstate__())
+
+    def _cow_copy(self):
+        """
+        Returns a copy of this object for a definition that was sharing it
+        with other definitions. Options holding lists, sets or dicts are
+        copied too, so that changing them in place does not leak back.
+        """
+        retv = copy.copy(self)
+        for k, v in retv.__dict__.items():
+            if k.startswith("_value_") and isinstance(v, (list, set, dict)):
+                retv.__dict__[k] = copy.copy(v)
+        return retv
+
+    def replace(self, **options):
+        """
+        Returns a copy of this object with the given options changed, e.g.
+        record.replace(validation_policy="warn"). Unlike set(), this leaves
+        the object alone, so it is safe on schemas shared between threads,
+        and it also works for frozen objects.
+        """
+        retv = copy.copy(self) if self.frozen else self._cow_copy()
+        for k, v in options.items():
+            retv.__dict__["_value_" + k] = v
+            # frozen objects hold the resolved value of each option too
+            if k in retv.__dict__:
+                retv.__dict__[k] = v
+        return retv
+
+    frozen = False
+
+    def freeze(self):
+        """
+        Makes this object and everything below it immutable: set() and
+        attribute or item assignment raise FrozenSchemaException. Option
+        values are resolved once and stored as plain attributes, so reading
+        them no longer goes through __getattr__. Returns self.
+
+        Nodes that are shared with other schemas (e.g. the fields of a
+        SubRecordType) are copied once and the copy is frozen instead.
+        """
+        return self._freeze({}, False)
+
+    def _freeze(self, memo, shared):
+        # memo maps the ids of the nodes seen so far to their frozen version,
+        # so that a node used in several places of the tree is frozen once
+        retv = memo.get(id(self))
+        if retv is not None:
+            return retv
+        retv = self._cow_copy() if shared else self
+        memo[id(self)] = retv
+        retv._freeze_children(memo)
+        cls = type(retv)
+        names = set(_option_names(cls))
+        names.update(
+            k[len("_value_") :] for k in retv.__dict__ if k.startswith("_value_")
+        )
+        for k in names:
+            if hasattr(cls, k):
+                # methods and properties take precedence anyway
+                continue
+            try:
+                retv.__dict__[k] = Keyable.__getattr__(retv, k)
+            except AttributeError:
+                pass
+        retv.__class__ = _frozen_class(cls)
+        return retv
+
+    def _freeze_children(self, memo):
+        pass
+
     @classmethod
     def set_default(cls, k, v):
         if v is not _NO_ARG:
@@ -395,18 +646,77 @@ def get_key_path(path=_NO_ARG):
     return ".".join(s(v) for v in path)
 
 
+def get_field_path(path=_NO_ARG):
+    # the path of the field in the schema: list indexes become []
+    keys = []
+    for key in path or []:
+        if isinstance(key, int):
+            keys.append("[]")
+        elif keys:
+            keys.append("." + str(key))
+        else:
+            keys.append(str(key))
+    return "".join(keys)
+
+
 class DataValidationException(TypeError):
+    """
+    A value that does not match its schema. The message may be a template
+    for format_args, in which case it is only formatted (with the path
+    prefixed) when message is first read: warnings that are filtered or
+    aggregated (see zschema.logs) never pay for formatting large values.
+    value is the offending value, if known (see zschema.stats).
+    """
 
-    def __init__(self, message, force=False, path=_NO_ARG):
-        if path:
-            message = get_key_path(path) + ": " + message
-        self.message = message
+    def __init__(
+        self, message, force=False, path=_NO_ARG, format_args=None, value=_NO_ARG
+    ):
+        self.template = message
+        self.format_args = format_args
         self.force = force
         self.path = path or []
+        self.value = value
+        self._message = None
 
+    @property
+    def message(self):
+        if self._message is None:
+            message = self.template
+            if self.format_args is not None:
+                message = message % self.format_args
+            if self.path:
+                message = get_key_path(self.path) + ": " + message
+            self._message = message
+        return self._message
 
-class MergeConflictException(Exception):
-    pass
+    @message.setter
+    def message(self, message):
+        self._message = message
 
+    def __str__(self):
+        return self.message
 
-_zschema_types_by_name = {}
+
+def _log_validation_exception(e, level):
+    # the message is formatted by logging, only if the record is emitted
+    logging.log(level, "%s", e)
+
+
+_warning_handler = _log_validation_exception
+
+
+def set_warning_handler(handler=None):
+    """
+    Sets the function called with (exception, level) for every validation
+    error that is logged, under the error and warn policies, and returns the
+    previous one. None restores the default, which logs the message with
+    the logging module.
+    """
+    global _warning_handler
+    previous = _warning_handler
+    _warning_handler = handler or _log_validation_exception
+    return previous
+
+
+class MergeConflictException(Exception):
+    pass
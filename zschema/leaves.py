@@ -1,14 +1,6 @@
-from __future__ import print_function
-from builtins import int, str, dict
-from six import string_types
-
-import sys
-import unittest
 import re
-import dateutil.parser
 import datetime
 import socket
-import pytz
 
 from zschema.keys import Keyable, DataValidationException
 from zschema.keys import _NO_ARG
@@ -21,6 +13,12 @@ class Leaf(Keyable):
     ES_INCLUDE_RAW = False
     ES_INDEX = None
     ES_ANALYZER = None
+    AVRO_TYPE = "string"
+    ARROW_TYPE = "utf8"
+    # the relative cost of _validate, which orders the checks of fail-fast
+    # validation: bounds and set lookups (1), other checks (2), regular
+    # expressions (3) and parsing (4)
+    VALIDATION_COST = 2
 
     def __init__(
         self,
@@ -115,6 +113,29 @@ class Leaf(Keyable):
             retv["doc"] = self.doc
         return retv
 
+    def _avro_type(self, name, parent=None):
+        return self.AVRO_TYPE
+
+    def to_avro(self, name, parent=None):
+        if not self._check_valid_name(name):
+            raise Exception("Invalid field name: %s" % name)
+        retv = {"name": self.key_to_bq(name), "type": self._avro_type(name, parent)}
+        if not self.required:
+            retv["type"] = ["null", retv["type"]]
+            retv["default"] = None
+        if self.doc:
+            retv["doc"] = self.doc
+        return retv
+
+    def to_arrow(self, name):
+        if not self._check_valid_name(name):
+            raise Exception("Invalid field name: %s" % name)
+        return {
+            "name": self.key_to_bq(name),
+            "type": self.ARROW_TYPE,
+            "nullable": not self.required,
+        }
+
     def to_proto(self, name, indent):
         if not self._check_valid_name(name):
             raise Exception("Invalid field name: %s" % name)
@@ -175,18 +196,21 @@ class Leaf(Keyable):
             raise Exception("Invalid field name: %s" % name)
         if value is None:
             if self.required:
-                msg = "{:s} is a required field, but received None".format(name)
-                raise DataValidationException(msg, path=path)
+                msg = "%s is a required field, but received None"
+                raise DataValidationException(
+                    msg, path=path, value=value, format_args=(name,)
+                )
             else:
                 return
         if not isinstance(value, self.EXPECTED_CLASS):
-            m = "class mismatch for {:s}: expected {}, {:s} has class {:s}".format(
+            m = "class mismatch for %s: expected %s, %s has class %s"
+            args = (
                 self.key_to_string(name),
                 self.EXPECTED_CLASS,
-                str(value),
+                value,
                 value.__class__.__name__,
             )
-            raise DataValidationException(m, path=path)
+            raise DataValidationException(m, path=path, value=value, format_args=args)
         if hasattr(self, "_validate"):
             self._validate(str(name), value, path=path)
 
@@ -197,7 +221,7 @@ class String(Leaf):
     BQ_TYPE = "STRING"
     PR_TYPE = "string"
 
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = 23
     VALID = "asdf"
@@ -210,7 +234,7 @@ class EnglishString(Leaf):
     PR_TYPE = "string"
 
     ES_ANALYZER = "standard"
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = 23
     VALID = "asdf"
@@ -223,7 +247,7 @@ class AnalyzedString(Leaf):
     PR_TYPE = "string"
 
     ES_ANALYZER = "simple"
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = 23
     VALID = "asdf"
@@ -254,10 +278,11 @@ class HexString(Leaf):
     BQ_TYPE = "STRING"
     PR_TYPE = "string"
 
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = "asdfasdfa"
     VALID = "003a929e3e0bd48a1e7567714a1e0e9d4597fe9087b4ad39deb83ab10c5a0278"
+    VALIDATION_COST = 3
 
     # ES_SEARCH_ANALYZER = "lower_whitespace"
     HEX_REGEX = re.compile("(?:[A-Fa-f0-9][A-Fa-f0-9])+")
@@ -267,8 +292,10 @@ class HexString(Leaf):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_hex(value):
-            m = "%s: the value %s is not hex" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not hex"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
 
 class Enum(Leaf):
@@ -277,10 +304,11 @@ class Enum(Leaf):
     BQ_TYPE = "STRING"
     PR_TYPE = "string"
 
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = 23
     VALID = None
+    VALIDATION_COST = 1
 
     def __init__(self, values=None, *args, **kwargs):
         Leaf.__init__(self, *args, **kwargs)
@@ -291,13 +319,42 @@ class Enum(Leaf):
 
     def _validate(self, name, value, path=_NO_ARG):
         if len(self.values_s) and value not in self.values_s:
-            m = "%s: the value %s is not a valid enum option" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not a valid enum option"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
+
+    AVRO_SYMBOL_REGEX = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+    def _avro_type(self, name, parent=None):
+        # Avro enum symbols are restricted to identifiers; anything else is
+        # exported as a plain string.
+        if not self.values or not all(
+            isinstance(v, str) and self.AVRO_SYMBOL_REGEX.match(v) for v in self.values
+        ):
+            return self.AVRO_TYPE
+        return {
+            "type": "enum",
+            "name": self._avro_name(parent, name),
+            "symbols": list(self.values),
+        }
+
+    def to_dict(self):
+        retv = super(Enum, self).to_dict()
+        if self.values:
+            retv["options"]["values"] = list(self.values)
+        return retv
+
+    def to_arrow(self, name):
+        retv = super(Enum, self).to_arrow(name)
+        retv["dictionary"] = True
+        return retv
 
     def _docs_common(self, parent_category):
         retv = super(Enum, self)._docs_common(parent_category)
         if len(self.values_s):
-            retv["values"] = list(self.values_s)
+            # the declared order; the order of the set changes with pickling
+            retv["values"] = list(dict.fromkeys(self.values))
             del retv["examples"]
         return retv
 
@@ -326,7 +383,7 @@ class IPAddress(Leaf):
     BQ_TYPE = "STRING"
     PR_TYPE = "string"
 
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
 
     INVALID = "my string"
     VALID = "141.212.120.0"
@@ -347,8 +404,10 @@ class IPAddress(Leaf):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_ipv4_addr(value) and not self._is_ipv6_addr(value):
-            m = "%s: the value %s is not a valid IP address" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not a valid IP address"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
 
 class IPv4Address(IPAddress):
@@ -358,8 +417,10 @@ class IPv4Address(IPAddress):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_ipv4_addr(value):
-            m = "%s: the value %s is not a valid IPv4 address" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not a valid IPv4 address"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
 
 class IPv6Address(IPAddress):
@@ -369,8 +430,10 @@ class IPv6Address(IPAddress):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_ipv6_addr(value):
-            m = "%s: the value %s is not a valid IPv6 address" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not a valid IPv6 address"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
 
 class _Integer(Leaf):
@@ -378,21 +441,28 @@ class _Integer(Leaf):
     ES_TYPE = "integer"
     BQ_TYPE = "INTEGER"
     PR_TYPE = "sint64"
+    AVRO_TYPE = "long"
+    ARROW_TYPE = "int64"
 
     EXPECTED_CLASS = (int,)
+    VALIDATION_COST = 1
 
     def _validate(self, name, value, path=_NO_ARG):
         max_ = 2**self.BITS - 1
         min_ = -(2**self.BITS) + 1
         if value > max_:
             raise DataValidationException(
-                "%s: %s is larger than max (%s)" % (name, str(value), str(max_)),
+                "%s: %s is larger than max (%s)",
                 path=path,
+                value=value,
+                format_args=(name, value, max_),
             )
         if value < min_:
             raise DataValidationException(
-                "%s: %s is smaller than min (%s)" % (name, str(value), str(min_)),
+                "%s: %s is smaller than min (%s)",
                 path=path,
+                value=value,
+                format_args=(name, value, min_),
             )
 
 
@@ -459,6 +529,8 @@ class Float(Leaf):
     ES_TYPE = "float"
     BQ_TYPE = "FLOAT"
     PR_TYPE = "float"
+    AVRO_TYPE = "double"
+    ARROW_TYPE = "double"
 
     EXPECTED_CLASS = (float,)
     INVALID = "I'm a string!"
@@ -479,6 +551,8 @@ class Boolean(Leaf):
     ES_TYPE = "boolean"
     BQ_TYPE = "BOOLEAN"
     PR_TYPE = "bool"
+    AVRO_TYPE = "boolean"
+    ARROW_TYPE = "bool"
 
     EXPECTED_CLASS = (bool,)
     INVALID = 0
@@ -492,7 +566,8 @@ class Binary(Leaf):
     PR_TYPE = "bytes"
 
     ES_INDEX = "no"
-    EXPECTED_CLASS = string_types
+    EXPECTED_CLASS = (str,)
+    VALIDATION_COST = 3
     B64_REGEX = re.compile(
         "^(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?$"
     )
@@ -502,8 +577,10 @@ class Binary(Leaf):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_base64(value):
-            m = "%s: the value %s is not valid Base64" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not valid Base64"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
     VALID = "03F87824"
     INVALID = "normal"
@@ -524,7 +601,8 @@ class DateTime(Leaf):
     PR_TYPE = "Timestamp"
 
     # dateutil.parser.parse(int) throws...? is this intended to be a unix epoch offset?
-    EXPECTED_CLASS = string_types + (int, datetime.datetime)
+    EXPECTED_CLASS = (str, int, datetime.datetime)
+    VALIDATION_COST = 4
 
     TZINFOS = {
         "EDT": datetime.timezone(datetime.timedelta(hours=-4)),  # Eastern Daylight Time
@@ -542,52 +620,50 @@ class DateTime(Leaf):
     def __init__(self, *args, **kwargs):
         super(DateTime, self).__init__(*args, **kwargs)
 
-        if self.min_value:
-            self._min_value_dt = dateutil.parser.parse(
-                self.min_value, tzinfos=self.TZINFOS
-            )
-        else:
-            self._min_value_dt = dateutil.parser.parse(
-                self.MIN_VALUE, tzinfos=self.TZINFOS
-            )
+        self._min_value_dt = self._parse_string(self.min_value or self.MIN_VALUE)
+        self._max_value_dt = self._parse_string(self.max_value or self.MAX_VALUE)
 
-        if self.max_value:
-            self._max_value_dt = dateutil.parser.parse(
-                self.max_value, tzinfos=self.TZINFOS
-            )
+    def parse(self, value):
+        """Parses a DateTime value (a string, a unix timestamp or a datetime) into a
+        timezone-aware datetime. Raises ValueError or TypeError on invalid input.
+        """
+        if isinstance(value, datetime.datetime):
+            dt = value
+        elif isinstance(value, int):
+            dt = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
         else:
-            self._max_value_dt = dateutil.parser.parse(
-                self.MAX_VALUE, tzinfos=self.TZINFOS
-            )
+            dt = self._parse_string(value)
+        return DateTime._ensure_tz_aware(dt)
+
+    def _parse_string(self, value):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        # dateutil is slow to import, so it is only loaded for the formats
+        # that the standard library cannot parse.
+        import dateutil.parser
+
+        return dateutil.parser.parse(value, tzinfos=self.TZINFOS)
 
     def _validate(self, name, value, path=_NO_ARG):
         try:
-            if isinstance(value, datetime.datetime):
-                dt = value
-            elif isinstance(value, int):
-                dt = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
-            else:
-                dt = dateutil.parser.parse(value, tzinfos=self.TZINFOS)
+            dt = self.parse(value)
         except (ValueError, TypeError):
             # Either `datetime.utcfromtimestamp` or `dateutil.parser.parse` above
             # may raise on invalid input.
-            m = "%s: %s is not valid timestamp" % (name, str(value))
-            raise DataValidationException(m, path=path)
-        dt = DateTime._ensure_tz_aware(dt)
-        if dt > self._max_value_dt:
-            m = "%s: %s is greater than allowed maximum (%s)" % (
-                name,
-                str(value),
-                str(self._max_value_dt),
+            m = "%s: %s is not valid timestamp"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
             )
-            raise DataValidationException(m, path=path)
+        if dt > self._max_value_dt:
+            m = "%s: %s is greater than allowed maximum (%s)"
+            args = (name, value, self._max_value_dt)
+            raise DataValidationException(m, path=path, value=value, format_args=args)
         if dt < self._min_value_dt:
-            m = "%s: %s is less than allowed minimum (%s)" % (
-                name,
-                str(value),
-                str(self._min_value_dt),
-            )
-            raise DataValidationException(m, path=path)
+            m = "%s: %s is less than allowed minimum (%s)"
+            args = (name, value, self._min_value_dt)
+            raise DataValidationException(m, path=path, value=value, format_args=args)
 
     @staticmethod
     def _ensure_tz_aware(dt):
@@ -596,7 +672,7 @@ class DateTime(Leaf):
         """
         if dt.tzinfo:
             return dt
-        return pytz.utc.localize(dt)
+        return dt.replace(tzinfo=datetime.timezone.utc)
 
 
 class Timestamp(DateTime):
@@ -608,6 +684,7 @@ class OID(String):
 
     VALID = "1.3.6.1.4.868.2.4.1"
     INVALID = "hello"
+    VALIDATION_COST = 3
 
     OID_REGEX = re.compile(r"^(\d+\.)+\d+$")
 
@@ -616,8 +693,10 @@ class OID(String):
 
     def _validate(self, name, value, path=_NO_ARG):
         if not self._is_oid(value):
-            m = "%s: the value %s is not a valid oid" % (name, value)
-            raise DataValidationException(m, path=path)
+            m = "%s: the value %s is not a valid oid"
+            raise DataValidationException(
+                m, path=path, value=value, format_args=(name, value)
+            )
 
 
 class EmailAddress(WhitespaceAnalyzedString):
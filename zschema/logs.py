@@ -0,0 +1,128 @@
+"""
+Aggregated logging of validation warnings, for datasets in which the same
+error repeats in millions of records.
+
+    with logs.WarningAggregator(exemplars=5, interval=60):
+        for value in values:
+            host.validate(value, "warn")
+
+While installed, a WarningAggregator receives every validation warning
+instead of the logging module. Warnings are grouped by the path at which
+they happened (with list indexes left out, as in "names[]") and by their
+kind, the message template of the check that failed. The first exemplars
+warnings of every group are logged as usual, the others are only counted,
+and every interval seconds one line per group sums up the warnings not
+logged since the last summary. Messages are formatted only for the lines
+that are logged (see DataValidationException), so suppressed warnings cost
+little more than a dict lookup.
+
+Errors (under the error policy) are always logged.
+"""
+
+import logging
+import threading
+import time
+
+from zschema.keys import get_field_path, set_warning_handler
+
+
+class _Group(object):
+
+    def __init__(self):
+        self.count = 0
+        self.suppressed = 0
+
+
+class WarningAggregator(object):
+    """
+    A warning handler (see keys.set_warning_handler) that logs the first
+    exemplars warnings of every (path, kind) group to logger and summaries
+    of the others every interval seconds. Without a logger, lines are logged
+    with logging.log, like the warnings that are not aggregated (which sets
+    up the root logger with basicConfig if it has no handlers).
+    """
+
+    def __init__(self, logger=None, exemplars=5, interval=60.0, clock=time.monotonic):
+        self.logger = logger
+        self.exemplars = exemplars
+        self.interval = interval
+        self.clock = clock
+        self.groups = {}
+        self._lock = threading.Lock()
+        self._last_summary = clock()
+        self._previous = None
+
+    def __call__(self, e, level):
+        if level != logging.WARNING:
+            self._log(level, "%s", e)
+            return
+        key = (get_field_path(e.path), e.template)
+        with self._lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _Group()
+            group.count += 1
+            emit = group.count <= self.exemplars
+            if not emit:
+                group.suppressed += 1
+            due = self.clock() - self._last_summary >= self.interval
+        if emit:
+            self._log(level, "%s", e)
+        if due:
+            self.flush()
+
+    def _log(self, level, msg, *args):
+        if self.logger is None:
+            logging.log(level, msg, *args)
+        else:
+            self.logger.log(level, msg, *args)
+
+    def counts(self):
+        """
+        Returns the number of warnings of every (path, kind) group.
+        """
+        with self._lock:
+            return {k: g.count for k, g in self.groups.items()}
+
+    def flush(self):
+        """
+        Logs a summary of every group with warnings that were not logged
+        since the last summary.
+        """
+        with self._lock:
+            self._last_summary = self.clock()
+            pending = []
+            for (path, kind), group in sorted(self.groups.items()):
+                if group.suppressed:
+                    pending.append((path, kind, group.suppressed, group.count))
+                    group.suppressed = 0
+        for path, kind, suppressed, count in pending:
+            self._log(
+                logging.WARNING,
+                "%s: %d more warnings like '%s' (%d in total)",
+                path or "<root>",
+                suppressed,
+                kind,
+                count,
+            )
+
+    def install(self):
+        """
+        Makes this the handler of validation warnings, until uninstall().
+        """
+        self._previous = set_warning_handler(self)
+        return self
+
+    def uninstall(self):
+        """
+        Logs the last summary and restores the previous handler.
+        """
+        self.flush()
+        set_warning_handler(self._previous)
+        self._previous = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
@@ -0,0 +1,435 @@
+"""
+Statistics on the fields of a dataset, gathered in one pass and guided by
+the schema, to decide for instance which fields to index in Elasticsearch
+or to cluster on in BigQuery.
+
+    profile = profiling.Profile(host)
+    for value in values:
+        profile.add(value)
+    profile.to_dict()["fields"]["443.https.tls.version"]
+
+Fields are named by their paths in Record.to_flat() (and field_index()):
+the elements of a list share the path of the list. For every field, a
+Profile counts how often it was present, null or missing where it could
+appear, and how many values did not have the type of the schema. For
+the values that did, it estimates the number of distinct values (with a
+HyperLogLog) and keeps the minimum and maximum of numbers and DateTimes,
+and histograms of the lengths of strings and lists, in power-of-two
+buckets.
+
+Profiles take at most a few kilobytes per field and can be merged, so chunks of a
+dataset can be profiled in parallel: profile_files() splits files at line
+boundaries and profiles the chunks in worker processes.
+"""
+
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+
+from zschema.compounds import ListOf, SubRecord
+from zschema.leaves import DateTime, Float, _Integer
+
+# registers of the HyperLogLogs are 2 ** precision bytes
+DEFAULT_PRECISION = 12
+
+
+class HyperLogLog(object):
+    """
+    An estimate of the number of distinct items added, with a relative
+    standard error of about 1.04 / sqrt(2 ** precision) (1.6% by default).
+    Items are hashed with BLAKE2, so estimates made in different processes
+    can be merged. Registers are kept in a dict until an eighth of them are
+    set, so fields with few distinct values take little memory.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.sparse = {}
+        self.registers = None
+
+    def add(self, item):
+        if not isinstance(item, bytes):
+            item = (item if isinstance(item, str) else repr(item)).encode("utf-8")
+        h = int.from_bytes(blake2b(item, digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        registers = self.registers
+        if registers is None:
+            registers = self.sparse
+            if rank > registers.get(index, 0):
+                registers[index] = rank
+                if len(registers) > (1 << self.precision) >> 3:
+                    self._densify()
+        elif rank > registers[index]:
+            registers[index] = rank
+
+    def _densify(self):
+        self.registers = bytearray(1 << self.precision)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = None
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise Exception(
+                "Cannot merge HyperLogLogs of precision %d and %d"
+                % (self.precision, other.precision)
+            )
+        if other.registers is not None:
+            if self.registers is None:
+                self._densify()
+            self.registers = bytearray(map(max, self.registers, other.registers))
+            return
+        for index, rank in other.sparse.items():
+            if self.registers is not None:
+                if rank > self.registers[index]:
+                    self.registers[index] = rank
+            elif rank > self.sparse.get(index, 0):
+                self.sparse[index] = rank
+                if len(self.sparse) > (1 << self.precision) >> 3:
+                    self._densify()
+
+    def __bool__(self):
+        return bool(self.sparse) or self.registers is not None
+
+    def estimate(self):
+        m = 1 << self.precision
+        if self.registers is None:
+            registers = list(self.sparse.values())
+            zeros = m - len(registers)
+        else:
+            registers = self.registers
+            zeros = registers.count(0)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / (zeros + sum(2.0**-r for r in registers if r))
+        if raw <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            return m * math.log(m / zeros)
+        return raw
+
+
+def _bucket(n):
+    # power-of-two buckets: 0, 1, 2-3, 4-7, ...
+    return n.bit_length()
+
+
+def _bucket_label(b):
+    if b <= 1:
+        return str(b)
+    return "%d-%d" % (1 << (b - 1), (1 << b) - 1)
+
+
+def _histogram(buckets):
+    return {_bucket_label(b): buckets[b] for b in sorted(buckets)}
+
+
+def _merge_counts(mine, theirs):
+    for k, n in theirs.items():
+        mine[k] = mine.get(k, 0) + n
+
+
+class FieldProfile(object):
+    """
+    The statistics of one field. present and nulls count how often it held
+    a value or null, and values the number of values seen (the elements,
+    for lists). Values of the wrong type count as mismatched and are
+    otherwise ignored. For subrecords, objects counts the dicts seen, in
+    which their fields could appear. Only leaves estimate their number of
+    distinct values.
+    """
+
+    def __init__(self):
+        self.present = 0
+        self.nulls = 0
+        self.values = 0
+        self.mismatched = 0
+        self.objects = 0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = None
+        self.lengths = {}
+        self.list_lengths = {}
+
+    def add_range(self, value):
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other):
+        self.present += other.present
+        self.nulls += other.nulls
+        self.values += other.values
+        self.mismatched += other.mismatched
+        self.objects += other.objects
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                self.add_range(value)
+        if other.distinct is not None:
+            if self.distinct is None:
+                self.distinct = HyperLogLog(other.distinct.precision)
+            self.distinct.merge(other.distinct)
+        _merge_counts(self.lengths, other.lengths)
+        _merge_counts(self.list_lengths, other.list_lengths)
+
+    def to_dict(self, count):
+        # count is the number of objects in which the field could appear
+        retv = {
+            "count": count,
+            "present": self.present,
+            "nulls": self.nulls,
+            "values": self.values,
+            "mismatched": self.mismatched,
+            "presence": self.present / count if count else 0.0,
+        }
+        if self.distinct:
+            retv["distinct"] = int(round(self.distinct.estimate()))
+        for k, v in (("min", self.minimum), ("max", self.maximum)):
+            if v is not None:
+                retv[k] = v.isoformat() if hasattr(v, "isoformat") else v
+        if self.lengths:
+            retv["lengths"] = _histogram(self.lengths)
+        if self.list_lengths:
+            retv["list_lengths"] = _histogram(self.list_lengths)
+        return retv
+
+
+class Profile(object):
+    """
+    The profile of the records added, against a Record. The compiled
+    observers are not pickled, so profiles can be sent between processes
+    (with the record) and merged.
+    """
+
+    def __init__(self, record, precision=DEFAULT_PRECISION):
+        self.record = record
+        self.precision = precision
+        self.records = 0
+        self.mismatched = 0
+        self.fields = {}
+        self._observe = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_observe"] = None
+        return state
+
+    def add(self, value):
+        if self._observe is None:
+            self._observe = _compile_record(self)
+        self.records += 1
+        self._observe(value)
+
+    def field(self, path):
+        field = self.fields.get(path)
+        if field is None:
+            field = self.fields[path] = FieldProfile()
+        return field
+
+    def merge(self, other):
+        self.records += other.records
+        self.mismatched += other.mismatched
+        for path, field in other.fields.items():
+            self.field(path).merge(field)
+
+    def to_dict(self):
+        """
+        Returns the statistics of every field, with its type and mode in
+        the schema.
+        """
+        index = self.record.field_index("es")
+        fields = {}
+        for path, field in sorted(self.fields.items()):
+            parent = path.rpartition(".")[0]
+            if parent:
+                count = self.fields[parent].objects
+            else:
+                count = self.records - self.mismatched
+            retv = field.to_dict(count)
+            entry = index.get(path)
+            if entry is not None:
+                retv["type"] = entry.type
+                retv["mode"] = entry.mode
+            fields[path] = retv
+        return {
+            "records": self.records,
+            "mismatched": self.mismatched,
+            "fields": fields,
+        }
+
+
+def _compile_record(profile):
+    fields = _compile_fields(profile, profile.record, None)
+
+    def observe(value):
+        if not isinstance(value, dict):
+            profile.mismatched += 1
+            return
+        _observe_fields(fields, value)
+
+    return observe
+
+
+def _compile_fields(profile, node, parent):
+    fields = {}
+    for k, v in node._fields():
+        name = SubRecord.key_to_es(k)
+        path = name if parent is None else parent + "." + name
+        field = profile.field(path)
+        fields[k] = (field, _compile(profile, v, path, field))
+    return fields
+
+
+def _observe_fields(fields, value):
+    for k, v in value.items():
+        entry = fields.get(k)
+        if entry is None:
+            continue
+        field, observe = entry
+        if v is None:
+            field.nulls += 1
+        else:
+            field.present += 1
+            observe(v)
+
+
+def _compile(profile, node, path, field):
+    if isinstance(node, ListOf):
+        item = _compile(profile, node.object_, path, field)
+
+        def observe_list(value):
+            if not isinstance(value, list):
+                field.mismatched += 1
+                return
+            b = _bucket(len(value))
+            field.list_lengths[b] = field.list_lengths.get(b, 0) + 1
+            for v in value:
+                if v is not None:
+                    item(v)
+
+        return observe_list
+    if isinstance(node, SubRecord):
+        fields = _compile_fields(profile, node, path)
+
+        def observe_subrecord(value):
+            field.values += 1
+            if not isinstance(value, dict):
+                field.mismatched += 1
+                return
+            field.objects += 1
+            _observe_fields(fields, value)
+
+        return observe_subrecord
+    return _compile_leaf(node, field, profile.precision)
+
+
+def _compile_leaf(leaf, field, precision):
+    expected = leaf.EXPECTED_CLASS
+    if field.distinct is None:
+        field.distinct = HyperLogLog(precision)
+    distinct = field.distinct
+    lengths = field.lengths
+    numeric = isinstance(leaf, (_Integer, Float))
+    parse = leaf.parse if isinstance(leaf, DateTime) else None
+
+    def observe_leaf(value):
+        field.values += 1
+        if not isinstance(value, expected):
+            field.mismatched += 1
+            return
+        distinct.add(value)
+        if isinstance(value, str):
+            b = _bucket(len(value))
+            lengths[b] = lengths.get(b, 0) + 1
+        if parse is not None:
+            try:
+                field.add_range(parse(value))
+            except (ValueError, TypeError, OverflowError):
+                field.mismatched += 1
+        elif numeric and not isinstance(value, bool):
+            field.add_range(value)
+
+    return observe_leaf
+
+
+def profile_lines(record, lines, precision=DEFAULT_PRECISION):
+    """
+    Profiles the records in an iterable of JSON lines (str or bytes).
+    Blank lines are skipped and lines that are not JSON count as mismatched
+    records.
+    """
+    profile = Profile(record, precision)
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            profile.records += 1
+            profile.mismatched += 1
+            continue
+        profile.add(value)
+    return profile
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as fd:
+        fd.seek(start)
+        position = start
+        while position < end:
+            line = fd.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def _profile_range(record, path, start, end, precision):
+    return profile_lines(record, _read_range(path, start, end), precision)
+
+
+def split(path, chunks):
+    """
+    Returns up to chunks (start, end) byte ranges that cover the file and
+    begin at the start of a line.
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as fd:
+        for i in range(1, chunks):
+            fd.seek(max(size * i // chunks, starts[-1]))
+            fd.readline()
+            position = fd.tell()
+            if position >= size:
+                break
+            if position > starts[-1]:
+                starts.append(position)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def profile_files(record, paths, workers=None, precision=DEFAULT_PRECISION):
+    """
+    Profiles the records in files of one JSON record per line. With
+    workers, every file is split in chunks that are profiled by that many
+    processes, and the profiles are merged.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    profile = Profile(record, precision)
+    if not workers or workers <= 1:
+        for path in paths:
+            with open(path, "rb") as fd:
+                profile.merge(profile_lines(record, fd, precision))
+        return profile
+    ranges = [(p, start, end) for p in paths for start, end in split(p, workers)]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(_profile_range, record, p, start, end, precision)
+            for p, start, end in ranges
+        ]
+        for future in futures:
+            profile.merge(future.result())
+    return profile
@@ -0,0 +1,103 @@
+"""
+Validation restricted to a projection of a schema.
+
+    host.validate(value, fields=["p443.https.tls", "ip"])
+
+project() builds a copy of a record in which only the requested fields,
+everything below them and the records on the way to them are validated in
+full. Elsewhere, nested records and lists are only checked to be a dict or
+a list and other fields are not checked at all. Unknown keys are reported
+as usual at every level that is validated.
+
+Paths are dotted, like the paths of Record.to_flat(); each part can use
+Elasticsearch or BigQuery naming (443 or p443). Lists do not add a part.
+"""
+
+from zschema.keys import Keyable, DataValidationException, _NO_ARG
+from zschema.compounds import ListOf, SubRecord
+
+# marks the end of a requested path in the trie built by project()
+_ALL = object()
+
+
+class _Unchecked(Keyable):
+    """
+    Stands in for a field outside of the projection. Only checks that the
+    value has the expected type (dict or list), if any.
+    """
+
+    # only an isinstance check, for fail-fast validation
+    VALIDATION_COST = 1
+
+    def __init__(self, node, expected):
+        super(_Unchecked, self).__init__(validation_policy=node.validation_policy)
+        self.expected = expected
+
+    def validate(
+        self, name, value, policy=_NO_ARG, parent_policy=_NO_ARG, path=_NO_ARG
+    ):
+        if self.expected is None or isinstance(value, self.expected):
+            return
+        calculated_policy = self._calculate_policy(name, policy, parent_policy)
+        try:
+            m = "%s: %s is not a %s"
+            args = (name, value, self.expected.__name__)
+            raise DataValidationException(
+                m, path=path or [], value=value, format_args=args
+            )
+        except DataValidationException as e:
+            self._handle_validation_exception(calculated_policy, e)
+
+
+def _unchecked(node):
+    if isinstance(node, SubRecord):
+        return _Unchecked(node, dict)
+    if isinstance(node, ListOf):
+        return _Unchecked(node, list)
+    return _Unchecked(node, None)
+
+
+def _prune(node, trie, path):
+    if trie is _ALL:
+        return node
+    if isinstance(node, ListOf):
+        return node.replace(object_=_prune(node.object_, trie, path))
+    if not isinstance(node, SubRecord):
+        raise Exception("Unknown field: %s" % ".".join(path + [sorted(trie)[0]]))
+    definition = {}
+    matched = set()
+    for k, v in node._fields():
+        sub = None
+        names = (k,) if isinstance(k, str) else (k.to_es(), k.to_bigquery())
+        for name in names:
+            if name in trie:
+                sub = trie[name]
+                matched.add(name)
+                child_path = path + [name]
+        if sub is None:
+            definition[k] = _unchecked(v)
+        else:
+            definition[k] = _prune(v, sub, child_path)
+    unknown = sorted(set(trie) - matched)
+    if unknown:
+        raise Exception("Unknown field: %s" % ".".join(path + unknown[:1]))
+    return node.replace(definition=definition)
+
+
+def project(record, fields):
+    """
+    Returns a copy of record that only validates the given dotted paths
+    (and everything below them) in full.
+    """
+    trie = {}
+    for path in fields:
+        node = trie
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is _ALL:
+                break
+            node = child
+        else:
+            node[parts[-1]] = _ALL
+    return _prune(record, trie, [])
@@ -0,0 +1,179 @@
+"""
+Mappings restricted to the fields that occur in real data.
+
+    usage = pruning.observe(host, values)       # or from a profile
+    pruned, report = pruning.prune(host, usage, targets=["elasticsearch"])
+    pruned.to_es("host")
+    report.dropped                              # ["443.https.heartbleed", ...]
+
+observe() streams records through a schema and counts the values found at
+every path of Record.to_flat() (the elements of a list share the path of
+the list). The counts of several samples can be added up, and the fields
+of a profiling.Profile that were present can be used instead.
+
+prune() returns a copy of the record in which the fields that never
+occurred, and are not required, are excluded from the given targets
+("elasticsearch" and "bigquery", with the exclude option), so to_es() and
+to_bigquery() leave them out. A field that is required within an unused
+subrecord is left out with it. Subrecords with nothing left below them
+are excluded too, unless they are required, in which case nothing below
+them is excluded. The original record is not modified, and the pruned one
+validates exactly like it.
+"""
+
+import collections
+
+from zschema.compounds import ListOf, SubRecord
+
+TARGETS = ("elasticsearch", "bigquery")
+
+
+def _compile(node, parent):
+    # maps the keys of the data to (path, children of the innermost
+    # subrecord, or None)
+    children = {}
+    for k, v in node._fields():
+        name = SubRecord.key_to_es(k)
+        path = name if parent is None else parent + "." + name
+        while isinstance(v, ListOf):
+            v = v.object_
+        sub = _compile(v, path) if isinstance(v, SubRecord) else None
+        children[k] = (path, sub)
+    return children
+
+
+def _observe(children, value, counts):
+    for k, v in value.items():
+        entry = children.get(k)
+        if entry is None or v is None:
+            continue
+        path, sub = entry
+        counts[path] += 1
+        if sub is None:
+            continue
+        stack = [v]
+        while stack:
+            v = stack.pop()
+            if isinstance(v, dict):
+                _observe(sub, v, counts)
+            elif isinstance(v, list):
+                stack.extend(v)
+
+
+def observe(record, values, counts=None):
+    """
+    Counts the non-null values found at every path of record in values,
+    adding to counts (a collections.Counter) if given. Returns the counts.
+    """
+    if counts is None:
+        counts = collections.Counter()
+    children = _compile(record, None)
+    for value in values:
+        if isinstance(value, dict):
+            _observe(children, value, counts)
+    return counts
+
+
+def observed_in_profile(profile):
+    """
+    Returns the paths that held values in a profiling.Profile, or in the
+    output of its to_dict() (as printed by zschema profile).
+    """
+    if not isinstance(profile, dict):
+        profile = profile.to_dict()
+    return {p for p, field in profile["fields"].items() if field["present"]}
+
+
+class PruneReport(object):
+    """
+    What prune() left out: the paths of the fields it excluded (the topmost
+    ones; everything below them is left out as well), and the number of
+    paths of the record (fields) and of those left out (dropped_fields).
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.dropped = []
+        self.dropped_fields = 0
+
+    @property
+    def kept_fields(self):
+        return self.fields - self.dropped_fields
+
+    def to_dict(self):
+        return {
+            "fields": self.fields,
+            "kept_fields": self.kept_fields,
+            "dropped_fields": self.dropped_fields,
+            "dropped": self.dropped,
+        }
+
+
+def _excluded(node, targets):
+    return all(t in node.exclude for t in targets)
+
+
+def _exclude(node, targets):
+    return node.replace(exclude=set(node.exclude) | set(targets))
+
+
+def _prune(node, observed, path, targets, report, index):
+    # returns the pruned node and whether anything below it was kept
+    if isinstance(node, ListOf):
+        object_, kept = _prune(node.object_, observed, path, targets, report, index)
+        if object_ is not node.object_:
+            node = node.replace(object_=object_)
+        return node, kept
+    if not isinstance(node, SubRecord):
+        return node, True
+    definition = {}
+    changed = False
+    kept = False
+    for k, v in node._fields():
+        name = SubRecord.key_to_es(k)
+        child_path = name if path is None else path + "." + name
+        if _excluded(v, targets):
+            definition[k] = v
+            continue
+        child = v
+        keep = child_path in observed or v.required
+        if keep:
+            mark = (len(report.dropped), report.dropped_fields)
+            child, keep = _prune(v, observed, child_path, targets, report, index)
+            if not keep:
+                # report the subrecord rather than everything below it
+                del report.dropped[mark[0] :]
+                report.dropped_fields = mark[1]
+                if v.required:
+                    # cannot be left out, so it is kept whole
+                    child, keep = v, True
+        if not keep:
+            child = _exclude(v, targets)
+            report.dropped.append(child_path)
+            report.dropped_fields += len(index.prefix(child_path))
+        definition[k] = child
+        changed = changed or child is not v
+        kept = kept or keep
+    if changed:
+        node = node.replace(definition=definition)
+    return node, kept
+
+
+def prune(record, observed, targets=TARGETS):
+    """
+    Returns a copy of record in which the fields whose paths are not in
+    observed (a set of paths, or counts from observe()), and that are not
+    required, are excluded from targets, and a PruneReport.
+    """
+    if isinstance(observed, dict):
+        observed = {p for p, n in observed.items() if n}
+    for target in targets:
+        if target not in TARGETS:
+            raise Exception(
+                "Invalid target: %s (expected one of %s)" % (target, TARGETS)
+            )
+    index = record.field_index("es")
+    report = PruneReport(len(index))
+    pruned, _ = _prune(record, set(observed), None, targets, report, index)
+    report.dropped.sort()
+    return pruned, report
@@ -1,5 +1,4 @@
-from __future__ import print_function
-from builtins import int, str
+import json
 
 from .compounds import Record
 
@@ -24,6 +23,30 @@ def all_schemas():
     return __zschema_schemas.copy()
 
 
+def dump_json(path, schemas=None):
+    """
+    Write the given schemas (default: every registered schema) to a JSON
+    file that load_json can read without the modules that defined them.
+    """
+    if schemas is None:
+        schemas = all_schemas()
+    with open(path, "w") as fd:
+        json.dump({k: v.to_dict() for k, v in schemas.items()}, fd, sort_keys=True)
+
+
+def load_json(path, register=True):
+    """
+    Load schemas written by dump_json, registering them unless register is
+    False. Returns a dict from name to Record.
+    """
+    with open(path) as fd:
+        schemas = {k: Record.from_dict(v) for k, v in json.load(fd).items()}
+    if register:
+        for name, schema in schemas.items():
+            register_schema(name, schema)
+    return schemas
+
+
 def __register(self, name):
     register_schema(name, self)
     return self
@@ -0,0 +1,138 @@
+"""
+Validation of streams that mix records of several schemas.
+
+    router = Router(field="type")       # every registered schema
+    for value in values:
+        router.validate(value)          # host, certificate, ...
+    router.stats["host"].invalid
+
+A Router picks the schema of each record by name, either from the value
+of a discriminator field or from a function of the record, and keeps a
+zschema.stats.ValidationStats per schema. Records without a name go to the
+default schema, if any. The discriminator field is only validated if the
+schema defines it.
+
+By default the router validates frozen copies of the schemas (see
+Record.freeze), which are faster to validate and are not affected by later
+changes to the originals.
+"""
+
+import copy
+import time
+
+from zschema.keys import DataValidationException, _NO_ARG
+from zschema.stats import ValidationStats
+
+
+class Router(object):
+
+    def __init__(
+        self,
+        schemas=None,
+        field=None,
+        key=None,
+        default=None,
+        policy=_NO_ARG,
+        freeze=True,
+    ):
+        if (field is None) == (key is None):
+            raise Exception("Exactly one of field and key is required")
+        if schemas is None:
+            from zschema import registry
+
+            schemas = registry.all_schemas()
+        if default is not None and default not in schemas:
+            raise Exception("Unknown default schema: %s" % default)
+        if freeze:
+            # deep copies, as freezing changes the nodes it does not share
+            schemas = {
+                k: v if v.frozen else copy.deepcopy(v).freeze()
+                for k, v in schemas.items()
+            }
+        self.schemas = dict(schemas)
+        self.field = field
+        self.key = key
+        self.default = default
+        self.policy = policy
+        self.stats = {name: ValidationStats() for name in self.schemas}
+        # records for which no schema could be found
+        self.unrouted = 0
+
+    def route(self, value):
+        """
+        Returns the name of the schema for value, or None.
+        """
+        if self.key is not None:
+            name = self.key(value)
+        elif isinstance(value, dict):
+            name = value.get(self.field)
+        else:
+            name = None
+        if name is None:
+            name = self.default
+        if not isinstance(name, str) or name not in self.schemas:
+            return None
+        return name
+
+    def validate(self, value, policy=_NO_ARG):
+        """
+        Validates value against the schema it is routed to and returns the
+        name of that schema. Raises like Record.validate, and also if no
+        schema is found.
+        """
+        name = self.route(value)
+        if name is None:
+            raise self._unrouted(value)
+        self._validate(name, value, policy)
+        return name
+
+    def _unrouted(self, value):
+        self.unrouted += 1
+        return DataValidationException("no schema for record: %s", format_args=(value,))
+
+    def _validate(self, name, value, policy):
+        record = self.schemas[name]
+        if self.field is not None and self.field not in record.definition:
+            value = dict(value)
+            value.pop(self.field, None)
+        if policy is _NO_ARG:
+            policy = self.policy
+        start = time.perf_counter()
+        try:
+            record.validate(value, policy)
+        except DataValidationException as e:
+            self.stats[name].add(time.perf_counter() - start, e)
+            raise
+        self.stats[name].add(time.perf_counter() - start)
+
+    def validate_stream(self, values, policy=_NO_ARG):
+        """
+        Validates every value, yielding (schema name, error) pairs in order.
+        The name is None for records that could not be routed, and error is
+        None for valid records.
+        """
+        for value in values:
+            name = self.route(value)
+            if name is None:
+                yield None, self._unrouted(value)
+                continue
+            try:
+                self._validate(name, value, policy)
+            except DataValidationException as e:
+                yield name, e
+            else:
+                yield name, None
+
+    def summary(self):
+        """
+        Returns the stats of every schema that saw records, as dicts, and
+        the number of records that could not be routed.
+        """
+        return {
+            "schemas": {
+                name: stats.to_dict()
+                for name, stats in sorted(self.stats.items())
+                if stats.records
+            },
+            "unrouted": self.unrouted,
+        }
@@ -0,0 +1,265 @@
+"""
+Estimates of the error rate of large datasets from a sample of records.
+
+    report = sampling.estimate(host, ["dump-0.json", "dump-1.json"], size=10000)
+    report.error_rate, report.interval        # 0.012, (0.010, 0.015)
+    report.paths["443.https.tls"]             # (rate, low, high)
+
+Records are sampled from files of one JSON record per line, either each
+with probability rate, or size records in total. With size, large files
+are not read in full: lines are picked at random byte offsets, which favors
+long lines, and every line is weighted by the inverse of its length to
+make up for it. Small files, and files that cannot seek (such as stdin),
+are read in full and sampled with a reservoir.
+
+With several files, the sample is stratified: every file gets a share of
+size proportional to its size in bytes, and the estimates weight each file
+by its (estimated) number of records.
+
+Error rates come with Wilson score intervals, computed from the effective
+sample size of the weighted sample. A record counts towards the path at
+which validation first failed, so path rates add up to the overall rate.
+"""
+
+import json
+import os
+import random
+import sys
+from statistics import NormalDist
+
+from zschema.keys import DataValidationException, _NO_ARG, get_field_path
+from zschema.stats import SpaceSaving, ValidationStats, value_key
+
+# files smaller than this are read in full rather than seeked into
+SEEK_MIN_BYTES = 1 << 20
+
+_CHUNK = 1 << 16
+
+
+def wilson_interval(successes, n, confidence=0.95):
+    """
+    The Wilson score interval of a proportion observed in n trials, which
+    need not be integers (weighted samples use their effective size).
+    """
+    if n <= 0:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / denominator
+    return (max(0.0, center - margin), min(1.0, center + margin))
+
+
+def _line_at(fd, offset):
+    # The line containing offset.
+    start = offset
+    while start > 0:
+        begin = max(0, start - _CHUNK)
+        fd.seek(begin)
+        chunk = fd.read(start - begin)
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            start = begin + newline + 1
+            break
+        start = begin
+    fd.seek(start)
+    return fd.readline()
+
+
+def _seek_sample(path, n, rng):
+    size = os.path.getsize(path)
+    lines = []
+    with open(path, "rb") as fd:
+        for _ in range(n):
+            line = _line_at(fd, rng.randrange(size))
+            if line.strip():
+                lines.append((line, 1.0 / len(line)))
+    if not lines:
+        return lines, 0
+    # the mean of 1 / length over a length-biased sample estimates the
+    # number of lines per byte
+    count = size * sum(u for _, u in lines) / len(lines)
+    return lines, count
+
+
+def _stream_sample(fd, rate, n, rng):
+    lines = []
+    count = 0
+    for line in fd:
+        if not line.strip():
+            continue
+        count += 1
+        if rate is not None:
+            if rng.random() < rate:
+                lines.append(line)
+        elif len(lines) < n:
+            lines.append(line)
+        else:
+            i = rng.randrange(count)
+            if i < n:
+                lines[i] = line
+    return [(line, 1.0) for line in lines], count
+
+
+def sample(paths, rate=None, size=None, seed=None, seek=True):
+    """
+    Samples the lines of the given files (paths, or "-" for stdin), either
+    each with probability rate or size lines in total. Returns a list of
+    (path, lines, count), where lines holds (line, weight) pairs and count
+    is the (estimated) number of lines in the file. Within a file, the
+    estimate of a proportion is the weighted mean over its lines.
+    """
+    if (rate is None) == (size is None):
+        raise Exception("Exactly one of rate and size is required")
+    if rate is not None and not 0 < rate <= 1:
+        raise Exception("Invalid sampling rate: %s" % rate)
+    rng = random.Random(seed)
+    sizes = {p: os.path.getsize(p) if p != "-" else 0 for p in paths}
+    total = sum(sizes.values()) or 1
+    strata = []
+    for path in paths:
+        n = None
+        if size is not None:
+            share = sizes[path] / total if len(paths) > 1 else 1
+            n = max(1, int(round(size * share)))
+        if n is not None and seek and path != "-" and sizes[path] >= SEEK_MIN_BYTES:
+            lines, count = _seek_sample(path, n, rng)
+        elif path == "-":
+            lines, count = _stream_sample(sys.stdin.buffer, rate, n, rng)
+        else:
+            with open(path, "rb") as fd:
+                lines, count = _stream_sample(fd, rate, n, rng)
+        strata.append((path, lines, count))
+    return strata
+
+
+class _Estimate(object):
+
+    def __init__(self):
+        self.weight = 0.0
+        self.weight_squared = 0.0
+        self.errors = {}
+
+    def add(self, weight, error_path):
+        self.weight += weight
+        self.weight_squared += weight * weight
+        if error_path is not None:
+            self.errors[error_path] = self.errors.get(error_path, 0.0) + weight
+
+    @property
+    def effective_size(self):
+        if not self.weight_squared:
+            return 0.0
+        return self.weight * self.weight / self.weight_squared
+
+    def rate(self, error_path=None, confidence=0.95):
+        if error_path is None:
+            failed = sum(self.errors.values())
+        else:
+            failed = self.errors.get(error_path, 0.0)
+        if not self.weight:
+            return (0.0, 0.0, 1.0)
+        p = failed / self.weight
+        n = self.effective_size
+        low, high = wilson_interval(p * n, n, confidence)
+        return (p, low, high)
+
+
+class SampleReport(object):
+    """
+    The estimates made from a sample: the overall error rate and its
+    interval, the same for every path at which records failed (paths) and
+    for every file (strata), and the number of records sampled. For every
+    path, rejected_values holds the most frequent values that failed in the
+    sample, as (value, count, error) tuples (see stats.SpaceSaving).
+    """
+
+    def __init__(self, confidence):
+        self.confidence = confidence
+        self.records = 0
+        self.invalid = 0
+        self.error_rate = 0.0
+        self.interval = (0.0, 1.0)
+        self.paths = {}
+        self.strata = {}
+        self.rejected_values = {}
+
+    def to_dict(self):
+        return {
+            "confidence": self.confidence,
+            "records": self.records,
+            "invalid": self.invalid,
+            "error_rate": self.error_rate,
+            "interval": list(self.interval),
+            "paths": {k: list(v) for k, v in sorted(self.paths.items())},
+            "strata": self.strata,
+            "rejected_values": {
+                k: [{"value": v, "count": n, "error": e} for v, n, e in top]
+                for k, top in sorted(self.rejected_values.items())
+            },
+        }
+
+
+def _error(record, line, policy):
+    # the path at which line failed, and the offending value
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return "<invalid JSON>", _NO_ARG
+    try:
+        record.validate(value, policy)
+    except DataValidationException as e:
+        return get_field_path(e.path), e.value
+    return None, _NO_ARG
+
+
+def estimate(
+    record,
+    paths,
+    rate=None,
+    size=None,
+    policy=_NO_ARG,
+    confidence=0.95,
+    seed=None,
+    seek=True,
+):
+    """
+    Validates a sample of the records in the given files (see sample())
+    against record and returns a SampleReport.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    report = SampleReport(confidence)
+    overall = _Estimate()
+    rejected = {}
+    for path, lines, count in sample(paths, rate, size, seed, seek):
+        stratum = _Estimate()
+        total = sum(w for _, w in lines)
+        for line, w in lines:
+            error_path, value = _error(record, line, policy)
+            report.records += 1
+            if error_path is not None:
+                report.invalid += 1
+                if value is not _NO_ARG:
+                    if error_path not in rejected:
+                        rejected[error_path] = SpaceSaving()
+                    rejected[error_path].add(value_key(value))
+            stratum.add(w, error_path)
+            # weight the lines of every file by its share of all records
+            overall.add(count * w / total, error_path)
+        p, low, high = stratum.rate(confidence=confidence)
+        report.strata[path] = {
+            "records": len(lines),
+            "estimated_total": int(round(count)),
+            "error_rate": p,
+            "interval": [low, high],
+        }
+    p, low, high = overall.rate(confidence=confidence)
+    report.error_rate = p
+    report.interval = (low, high)
+    report.paths = {k: overall.rate(k, confidence) for k in overall.errors}
+    report.rejected_values = {
+        k: v.top(ValidationStats.TOP_VALUES) for k, v in rejected.items()
+    }
+    return report
@@ -0,0 +1,339 @@
+"""
+A long-running validation server, so that schemas are built once rather
+than by every process that validates data.
+
+    zschema serve schema.py:host --listen 127.0.0.1:8089 --workers 4
+    zschema serve schema.py:host --listen unix:/run/zschema.sock
+
+Requests are HTTP, over TCP or a Unix socket:
+
+    POST /validate/<schema>[?policy=warn]  NDJSON body, one record per line
+    POST /validate                         the same, for the default schema
+    GET /health                            {"status": "ok", "schemas": [...]}
+    GET /metrics                           counters, in Prometheus text format
+
+Request bodies are read by Content-Length or chunked transfer encoding;
+requests with neither are answered with 411 Length Required.
+
+The response to a validation request is NDJSON as well, with one result
+per non-empty line of the request, in order, numbered like the lines:
+
+    {"line": 1, "valid": true}
+    {"line": 2, "valid": false, "error": "ip: ...", "path": ["ip"]}
+
+The lines of a request are validated in batches of batch_size by a pool
+of workers, threads by default or processes with processes=True (every
+process then receives a copy of the schemas once, when it starts).
+"""
+
+import functools
+import json
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlsplit
+
+from zschema.keys import DataValidationException
+
+POLICIES = ("ignore", "warn", "error")
+
+
+def _validate_lines(schemas, name, lines, policy):
+    record = schemas[name]
+    results = []
+    for line in lines:
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            results.append((False, "invalid JSON: %s" % e, []))
+            continue
+        try:
+            record.validate(value, policy)
+        except DataValidationException as e:
+            results.append((False, e.message, list(e.path)))
+        except Exception as e:
+            # a bug in a validator should not fail the other lines
+            results.append((False, "%s: %s" % (type(e).__name__, e), []))
+        else:
+            results.append((True, None, None))
+    return results
+
+
+_worker_schemas = None
+
+
+def _init_worker(schemas):
+    global _worker_schemas
+    _worker_schemas = schemas
+
+
+def _validate_in_worker(name, lines, policy):
+    return _validate_lines(_worker_schemas, name, lines, policy)
+
+
+class _Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.records = {}
+        self.seconds = {}
+
+    def request(self, endpoint, status):
+        with self.lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def validated(self, schema, valid, invalid, seconds):
+        with self.lock:
+            for result, count in (("valid", valid), ("invalid", invalid)):
+                key = (schema, result)
+                self.records[key] = self.records.get(key, 0) + count
+            self.seconds[schema] = self.seconds.get(schema, 0.0) + seconds
+
+    def to_text(self):
+        with self.lock:
+            lines = [
+                "# TYPE zschema_uptime_seconds gauge",
+                "zschema_uptime_seconds %f" % (time.time() - self.started),
+                "# TYPE zschema_requests_total counter",
+            ]
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(
+                    'zschema_requests_total{endpoint="%s",status="%d"} %d'
+                    % (endpoint, status, count)
+                )
+            lines.append("# TYPE zschema_records_total counter")
+            for (schema, result), count in sorted(self.records.items()):
+                lines.append(
+                    'zschema_records_total{schema="%s",result="%s"} %d'
+                    % (schema, result, count)
+                )
+            lines.append("# TYPE zschema_validation_seconds_total counter")
+            for schema, seconds in sorted(self.seconds.items()):
+                lines.append(
+                    'zschema_validation_seconds_total{schema="%s"} %f'
+                    % (schema, seconds)
+                )
+        return "\n".join(lines) + "\n"
+
+
+class ValidationServer(object):
+    """
+    Validates NDJSON lines against a set of schemas (a dict from name to
+    Record) with a pool of workers. serve() answers HTTP requests on an
+    address; validate() can also be called directly.
+    """
+
+    BATCH_SIZE = 256
+
+    def __init__(
+        self,
+        schemas,
+        default=None,
+        policy=None,
+        workers=None,
+        processes=False,
+        batch_size=None,
+    ):
+        if default is not None and default not in schemas:
+            raise Exception("Unknown default schema: %s" % default)
+        self.schemas = dict(schemas)
+        self.default = default
+        self.policy = policy
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.metrics = _Metrics()
+        if processes:
+            self._pool = ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(self.schemas,)
+            )
+            self._task = _validate_in_worker
+        else:
+            self._pool = ThreadPoolExecutor(workers)
+            self._task = functools.partial(_validate_lines, self.schemas)
+
+    def validate(self, name, lines, policy=None):
+        """
+        Validates lines (str or bytes, without empty lines) against the
+        schema called name. Returns a list of (valid, error, path) tuples,
+        in order.
+        """
+        if name not in self.schemas:
+            raise KeyError(name)
+        policy = policy or self.policy
+        start = time.perf_counter()
+        futures = [
+            self._pool.submit(self._task, name, lines[i : i + self.batch_size], policy)
+            for i in range(0, len(lines), self.batch_size)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        valid = sum(1 for result in results if result[0])
+        elapsed = time.perf_counter() - start
+        self.metrics.validated(name, valid, len(results) - valid, elapsed)
+        return results
+
+    def health(self):
+        return {"status": "ok", "schemas": sorted(self.schemas)}
+
+    def make_server(self, address):
+        """
+        Returns an HTTP server bound to address ("host:port", or
+        "unix:path" for a Unix socket) that answers with this server.
+        """
+        handler = type("Handler", (_Handler,), {"validator": self})
+        if address.startswith("unix:"):
+            path = address[len("unix:") :]
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            return _ThreadingUnixHTTPServer(path, handler)
+        host, _, port = address.rpartition(":")
+        return _ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+    def serve(self, address):
+        """
+        Answers requests on address until interrupted.
+        """
+        server = self.make_server(address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if isinstance(server, UnixStreamServer):
+                os.unlink(server.server_address)
+            self.close()
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # the client address of a Unix socket is an empty string, which
+        # BaseHTTPRequestHandler does not expect
+        request, _ = self.socket.accept()
+        return request, ("unix", 0)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    validator = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, endpoint, status, body, content_type="application/json"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.validator.metrics.request(endpoint, status)
+
+    def _error(self, endpoint, status, message):
+        self._send(endpoint, status, json.dumps({"error": message}) + "\n")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send("health", 200, json.dumps(self.validator.health()) + "\n")
+        elif path == "/metrics":
+            self._send(
+                "metrics",
+                200,
+                self.validator.metrics.to_text(),
+                "text/plain; version=0.0.4",
+            )
+        else:
+            self._error("other", 404, "Not found: %s" % path)
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline(65537).split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline(65537)
+        # trailers, up to the empty line
+        while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
+
+    def _read_body(self, url):
+        # Returns the body of the request, or None after answering with an
+        # error. The connection is then closed, since the rest of the body
+        # cannot be skipped to read the next request.
+        endpoint = "validate" if url.path.startswith("/validate") else "other"
+        encoding = self.headers.get("Transfer-Encoding", "").lower()
+        length = self.headers.get("Content-Length")
+        if encoding == "chunked":
+            try:
+                return self._read_chunked()
+            except ValueError:
+                self.close_connection = True
+                self._error(endpoint, 400, "Invalid chunked body")
+                return None
+        if encoding or length is None:
+            self.close_connection = True
+            self._error(endpoint, 411, "Content-Length required")
+            return None
+        if not length.isdigit():
+            self.close_connection = True
+            self._error(endpoint, 400, "Invalid Content-Length")
+            return None
+        return self.rfile.read(int(length))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self._read_body(url)
+        if body is None:
+            return
+        if url.path == "/validate":
+            name = self.validator.default
+        elif url.path.startswith("/validate/"):
+            name = url.path[len("/validate/") :]
+        else:
+            return self._error("other", 404, "Not found: %s" % url.path)
+        if name is None:
+            return self._error("validate", 400, "No schema given")
+        if name not in self.validator.schemas:
+            return self._error("validate", 404, "Unknown schema: %s" % name)
+        policy = parse_qs(url.query).get("policy", [None])[0]
+        if policy is not None and policy not in POLICIES:
+            return self._error("validate", 400, "Invalid policy: %s" % policy)
+        numbered = [(i, l) for i, l in enumerate(body.splitlines(), 1) if l.strip()]
+        results = self.validator.validate(name, [l for _, l in numbered], policy)
+        out = []
+        for (i, _), (valid, error, path) in zip(numbered, results):
+            if valid:
+                out.append(json.dumps({"line": i, "valid": True}))
+            else:
+                out.append(
+                    json.dumps(
+                        {"line": i, "valid": False, "error": error, "path": path}
+                    )
+                )
+        self._send(
+            "validate",
+            200,
+            "".join(line + "\n" for line in out),
+            "application/x-ndjson",
+        )
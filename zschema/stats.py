@@ -0,0 +1,185 @@
+"""
+Counters describing the validation of many records.
+"""
+
+import collections
+import hashlib
+import json
+
+from zschema.keys import _NO_ARG, get_field_path
+
+# rejected values longer than this (as JSON) are truncated and hashed
+MAX_VALUE_LENGTH = 64
+
+
+def value_key(value, max_length=MAX_VALUE_LENGTH):
+    """
+    The JSON text of value, for counting. Longer texts are truncated to
+    max_length characters and suffixed with their length and a hash, so
+    that long values stay distinct but take bounded memory.
+    """
+    text = json.dumps(value, sort_keys=True, default=str)
+    if len(text) <= max_length:
+        return text
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    return "%s... (%d chars, sha1 %s)" % (text[:max_length], len(text), digest)
+
+
+class SpaceSaving(object):
+    """
+    The most frequent items of a stream, in at most capacity counters (the
+    Space-Saving algorithm of Metwally et al.). When all counters are taken,
+    a new item replaces the least frequent one and inherits its count,
+    which is remembered as the error of the new count: every item that
+    occurred more than total / capacity times is kept, with a count that
+    is too high by at most its error.
+
+    Summaries of parts of a stream can be merged (Agarwal et al.,
+    "Mergeable Summaries"), with the same guarantees for the whole stream.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item, count=1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            del self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+
+    def _floor(self):
+        # the most that an item without a counter can have occurred
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other):
+        floor, other_floor = self._floor(), other._floor()
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, floor) + other.counts.get(
+                item, other_floor
+            )
+            errors[item] = self.errors.get(item, floor) + other.errors.get(
+                item, other_floor
+            )
+        keep = sorted(counts, key=counts.get, reverse=True)[: self.capacity]
+        self.counts = {item: counts[item] for item in keep}
+        self.errors = {item: errors[item] for item in keep}
+        self.total += other.total
+
+    def top(self, k=None):
+        """
+        Returns the k most frequent items as (item, count, error) tuples,
+        where count - error is a lower bound of the true count.
+        """
+        items = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(item, n, self.errors[item]) for item, n in items[:k]]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class ValidationStats(object):
+    """
+    Counts the records validated, how many were invalid and how long they
+    took, and the paths of the fields at which the invalid ones failed.
+    Warnings (failures under the warn policy, see add_warning) are counted
+    per path in warning_paths. For every such path, rejected_values tracks
+    the most frequent values that failed validation in a SpaceSaving
+    summary of capacity counters.
+    """
+
+    # the number of rejected values per path in to_dict()
+    TOP_VALUES = 10
+
+    def __init__(self, capacity=100, max_value_length=MAX_VALUE_LENGTH):
+        self.records = 0
+        self.invalid = 0
+        self.seconds = 0.0
+        self.error_paths = collections.Counter()
+        self.warning_paths = collections.Counter()
+        self.rejected_values = {}
+        self.capacity = capacity
+        self.max_value_length = max_value_length
+
+    @property
+    def valid(self):
+        return self.records - self.invalid
+
+    def add(self, seconds, error=None):
+        self.records += 1
+        self.seconds += seconds
+        if error is not None:
+            self.invalid += 1
+            path = get_field_path(getattr(error, "path", None))
+            self.error_paths[path] += 1
+            value = getattr(error, "value", _NO_ARG)
+            if value is not _NO_ARG:
+                self.add_rejected(path, value)
+
+    def add_warning(self, error):
+        """
+        Counts a validation error that was only logged, e.g. from a warning
+        handler (see keys.set_warning_handler).
+        """
+        path = get_field_path(error.path)
+        self.warning_paths[path] += 1
+        if error.value is not _NO_ARG:
+            self.add_rejected(path, error.value)
+
+    def add_rejected(self, path, value):
+        summary = self.rejected_values.get(path)
+        if summary is None:
+            summary = self.rejected_values[path] = SpaceSaving(self.capacity)
+        summary.add(value_key(value, self.max_value_length))
+
+    def merge(self, other):
+        self.records += other.records
+        self.invalid += other.invalid
+        self.seconds += other.seconds
+        self.error_paths.update(other.error_paths)
+        self.warning_paths.update(other.warning_paths)
+        for path, summary in other.rejected_values.items():
+            if path in self.rejected_values:
+                self.rejected_values[path].merge(summary)
+            else:
+                merged = self.rejected_values[path] = SpaceSaving(self.capacity)
+                merged.merge(summary)
+
+    def to_dict(self):
+        return {
+            "records": self.records,
+            "valid": self.valid,
+            "invalid": self.invalid,
+            "seconds": self.seconds,
+            "error_paths": dict(self.error_paths.most_common()),
+            "warning_paths": dict(self.warning_paths.most_common()),
+            "rejected_values": {
+                path: [
+                    {"value": v, "count": n, "error": e}
+                    for v, n, e in summary.top(self.TOP_VALUES)
+                ]
+                for path, summary in sorted(self.rejected_values.items())
+            },
+        }
+
+    def __repr__(self):
+        return "ValidationStats(records=%d, invalid=%d, seconds=%.3f)" % (
+            self.records,
+            self.invalid,
+            self.seconds,
+        )
@@ -2,11 +2,12 @@ from collections.abc import Sized
 import datetime
 import json
 import os
+import pickle
 import unittest
 
 from zschema import registry
 from zschema.compounds import ListOf, NestedListOf, Record, SubRecord, SubRecordType
-from zschema.keys import Keyable, Port, MergeConflictException
+from zschema.keys import Keyable, Port, MergeConflictException, FrozenSchemaException
 from zschema.leaves import (
     Boolean,
     DateTime,
@@ -1125,6 +1126,12 @@ class TestSubRecordType(unittest.TestCase):
         second = T()
         self.assertFalse(second.exclude)
         self.assertFalse(second["id"].exclude)
+        # the type keeps its own copy of the definition
+        definition["id"].set("required", True)
+        definition["other"] = String()
+        self.assertFalse(second["id"].required)
+        self.assertFalse(T()["id"].required)
+        self.assertNotIn("other", T().definition)
 
         CertType = SubRecordType(
             {
@@ -1142,6 +1149,24 @@ class TestSubRecordType(unittest.TestCase):
             "exclude", ssh_certkey_public_key_type["id"].exclude | {"elasticsearch"}
         )
 
+    def test_list_of_type(self):
+        from zschema.compounds import ListOfType
+
+        Names = ListOfType(String(doc="A name."), max_items=2, doc="Names.")
+        first = Names()
+        second = Names(doc="Other names.")
+        self.assertIsInstance(first, ListOf)
+        self.assertEqual("Names.", first.doc)
+        self.assertEqual("Other names.", second.doc)
+        self.assertEqual("A name.", first.object_.doc)
+        first.object_.set("doc", "changed")
+        self.assertEqual("A name.", second.object_.doc)
+        first.validate("names", ["a", "b"], "error")
+        self.assertRaises(
+            DataValidationException, first.validate, "names", ["a", "b", "c"], "error"
+        )
+        self.assertRaises(Exception, ListOf)
+
     def test_multiple_subrecord_types(self):
         A = SubRecordType(
             {
@@ -1162,3 +1187,2263 @@ class TestSubRecordType(unittest.TestCase):
         self.assertIn("second", b.definition)
         a = A()
         self.assertIn("first", a.definition)
+
+
+class BinaryFormatTests(unittest.TestCase):
+
+    def setUp(self):
+        heartbleed = SubRecord(
+            {
+                "heartbeat_support": Boolean(),
+                "heartbleed_vulnerable": Boolean(),
+                "timestamp": DateTime(),
+            }
+        )
+        self.host = Record(
+            {
+                "ipstr": IPv4Address(required=True),
+                "ip": Unsigned32BitInteger(),
+                Port(443): SubRecord({"tls": String(), "heartbleed": heartbleed}),
+                "tags": ListOf(String()),
+                "flags": ListOf(Boolean()),
+                "state": Enum(values=["open", "closed"]),
+                "offsets": ListOf(Unsigned8BitInteger()),
+            }
+        )
+        self.good = {
+            "ipstr": "141.212.120.1",
+            "ip": 2379511809,
+            "443": {
+                "tls": "test",
+                "heartbleed": {
+                    "heartbeat_support": True,
+                    "heartbleed_vulnerable": False,
+                    "timestamp": "2017-06-16T16:33:23-04:00",
+                },
+            },
+            "tags": ["a", "b"],
+            "flags": [True, None, False, True],
+            "state": "closed",
+            "offsets": [-3, 0, 200],
+        }
+
+    def test_round_trip(self):
+        from zschema.binary import RecordCodec
+
+        self.host.validate(self.good)
+        codec = RecordCodec(self.host)
+        data = codec.encode(self.good)
+        self.assertEqual(self.good, codec.decode(data))
+        self.assertLess(len(data), len(json.dumps(self.good)) / 2)
+
+    def test_round_trip_mistyped_values(self):
+        from zschema.binary import RecordCodec
+
+        codec = RecordCodec(self.host)
+        odd = {
+            "ipstr": "010.1.1.1",
+            "ip": "not an int",
+            "443": None,
+            "tags": [1, "a"],
+            "flags": ["yes"],
+            "state": "unknown",
+            "keydne": {"x": [1, 2]},
+        }
+        self.assertEqual(odd, codec.decode(codec.encode(odd)))
+
+    def test_stream(self):
+        import io
+        from zschema.binary import BinaryReader, BinaryWriter
+
+        fd = io.BytesIO()
+        writer = BinaryWriter(fd, self.host)
+        records = [self.good, {"ipstr": "1.2.3.4"}, {}]
+        for r in records:
+            writer.write(r)
+        fd.seek(0)
+        self.assertEqual(records, list(BinaryReader(fd, self.host)))
+
+        fd.seek(0)
+        other = Record({"ipstr": String()})
+        self.assertRaises(ValueError, lambda: BinaryReader(fd, other))
+
+    def test_to_avro(self):
+        avro = self.host.to_avro("host")
+        self.assertEqual("record", avro["type"])
+        self.assertEqual("host", avro["name"])
+        fields = {f["name"]: f for f in avro["fields"]}
+        self.assertEqual("string", fields["ipstr"]["type"])
+        self.assertEqual(["null", "long"], fields["ip"]["type"])
+        self.assertEqual("host.p443", fields["p443"]["type"][1]["name"])
+        self.assertEqual(
+            {"type": "enum", "name": "host.state", "symbols": ["open", "closed"]},
+            fields["state"]["type"][1],
+        )
+        self.assertEqual(
+            {"type": "array", "items": ["null", "string"]}, fields["tags"]["type"][1]
+        )
+        self.assertEqual(
+            {"type": "array", "items": "string"},
+            ListOf(String(required=True)).to_avro("names")["type"][1],
+        )
+        # a_b.c and a.b_c do not collide
+        names = Record(
+            {
+                "a_b": SubRecord({"c": SubRecord({})}),
+                "a": SubRecord({"b_c": SubRecord({})}),
+            }
+        ).to_avro("r")
+        nested = [f["type"][1]["fields"][0]["type"][1]["name"] for f in names["fields"]]
+        self.assertEqual(["r.a.b_c", "r.a_b.c"], nested)
+
+
+class ColumnarTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ipstr": IPv4Address(required=True),
+                "ip": Unsigned32BitInteger(),
+                Port(443): SubRecord({"tls": String(), "ok": Boolean()}),
+                "tags": ListOf(String()),
+                "state": Enum(values=["open", "closed"]),
+            }
+        )
+        self.records = [
+            {
+                "ipstr": "1.2.3.4",
+                "ip": 16909060,
+                "443": {"tls": "x", "ok": True},
+                "tags": ["a", "b"],
+                "state": "open",
+            },
+            {"ipstr": "1.2.3.5", "tags": [], "state": "closed"},
+            {"ipstr": "1.2.3.6", "443": {"ok": False}, "tags": ["c"]},
+        ]
+
+    def test_to_arrow_schema(self):
+        schema = {f["name"]: f for f in self.host.to_arrow_schema()}
+        self.assertEqual(
+            {"name": "ipstr", "type": "utf8", "nullable": False}, schema["ipstr"]
+        )
+        self.assertEqual("int64", schema["ip"]["type"])
+        self.assertEqual("struct", schema["p443"]["type"])
+        self.assertEqual("list", schema["tags"]["type"])
+        self.assertTrue(schema["state"]["dictionary"])
+
+    def test_batch_builder(self):
+        from zschema.columnar import BatchBuilder
+
+        builder = BatchBuilder(self.host)
+        builder.extend(self.records)
+        batch = builder.finish()
+        self.assertEqual(3, batch.length)
+        self.assertEqual(0, builder.length)
+
+        ip = batch.column("ip")
+        self.assertEqual(2, ip.null_count)
+        self.assertEqual([16909060, None, None], ip.to_pylist())
+        self.assertIsNone(batch.column("ipstr").validity)
+
+        tags = batch.column("tags")
+        self.assertEqual([0, 2, 2, 3], list(tags.offsets))
+        self.assertEqual([["a", "b"], [], ["c"]], tags.to_pylist())
+
+        state = batch.column("state")
+        self.assertEqual(["open", "closed"], state.dictionary)
+        self.assertEqual(["open", "closed", None], state.to_pylist())
+
+        p443 = batch.column("p443")
+        self.assertEqual(
+            [{"tls": "x", "ok": True}, None, {"tls": None, "ok": False}],
+            p443.to_pylist(),
+        )
+
+    def test_iter_batches(self):
+        from zschema.columnar import iter_batches
+
+        batches = list(iter_batches(self.host, self.records * 3, batch_size=4))
+        self.assertEqual([4, 4, 1], [b.length for b in batches])
+
+    def test_to_pyarrow(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        from zschema.columnar import BatchBuilder
+
+        builder = BatchBuilder(self.host)
+        builder.extend(self.records)
+        rows = builder.finish().to_pyarrow().to_pylist()
+        self.assertEqual([["a", "b"], [], ["c"]], [r["tags"] for r in rows])
+        self.assertEqual({"tls": None, "ok": False}, rows[2]["p443"])
+        self.assertEqual([16909060, None, None], [r["ip"] for r in rows])
+        self.assertEqual(["open", "closed", None], [r["state"] for r in rows])
+
+
+class ElasticsearchBulkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": Unsigned32BitInteger(),
+                "raw": String(exclude=["elasticsearch"]),
+                Port(443): SubRecord(
+                    {
+                        "tls": String(),
+                        "chain": ListOf(
+                            SubRecord(
+                                {
+                                    "subject": String(),
+                                    "der": String(exclude=["elasticsearch"]),
+                                }
+                            )
+                        ),
+                    }
+                ),
+                "tags": ListOf(String()),
+            }
+        )
+        self.doc = {
+            "ip": 1,
+            "raw": "xyz",
+            "443": {"tls": "t", "chain": [{"subject": "a", "der": "b"}]},
+            "tags": ["x"],
+        }
+
+    def test_project(self):
+        from zschema.export import ElasticsearchBulkEncoder
+
+        encoder = ElasticsearchBulkEncoder(self.host)
+        projected = encoder.project(self.doc)
+        self.assertEqual(
+            {"ip": 1, "443": {"tls": "t", "chain": [{"subject": "a"}]}, "tags": ["x"]},
+            projected,
+        )
+        # untouched subtrees are shared, not copied
+        self.assertIs(self.doc["tags"], projected["tags"])
+        self.assertIn("raw", self.doc)
+
+    def test_batches(self):
+        from zschema.export import ElasticsearchBulkEncoder
+
+        encoder = ElasticsearchBulkEncoder(
+            self.host, index="hosts", id_field="ip", max_docs=2
+        )
+        docs = [dict(self.doc, ip=i) for i in range(5)]
+        bodies = list(encoder.iter_batches(docs))
+        self.assertEqual(3, len(bodies))
+        lines = bodies[0].decode("utf-8").splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual({"index": {"_index": "hosts", "_id": 0}}, json.loads(lines[0]))
+        self.assertNotIn("raw", json.loads(lines[1]))
+
+        encoder = ElasticsearchBulkEncoder(self.host, max_bytes=200)
+        bodies = list(encoder.iter_batches([json.dumps(d) for d in docs]))
+        self.assertTrue(all(len(b) <= 200 for b in bodies))
+        self.assertEqual(10, sum(len(b.splitlines()) for b in bodies))
+
+    def test_raw_lines_pass_through(self):
+        from zschema.export import ElasticsearchBulkEncoder
+
+        schema = Record({"a": String()})
+        encoder = ElasticsearchBulkEncoder(schema)
+        line = '{"a":  "spacing is kept"}\n'
+        self.assertEqual(
+            b'{"index":{}}\n{"a":  "spacing is kept"}\n', encoder.encode(line)
+        )
+
+
+class BigQueryTransformerTests(unittest.TestCase):
+
+    def setUp(self):
+        from zschema.leaves import Timestamp
+
+        self.host = Record(
+            {
+                "ip": Unsigned32BitInteger(),
+                "raw": String(exclude=["bigquery"]),
+                Port(443): SubRecord(
+                    {"tls": String(), "seen": DateTime(), "updated": Timestamp()}
+                ),
+                "names": NestedListOf(String(), "name"),
+                "tags": ListOf(String()),
+            }
+        )
+        self.doc = {
+            "ip": 1,
+            "raw": "xyz",
+            "443": {
+                "tls": "t",
+                "seen": "2017-06-16T16:33:23-04:00",
+                "updated": 1497645203,
+            },
+            "names": ["a", "b"],
+            "tags": ["x"],
+        }
+
+    def test_transform_matches_schema(self):
+        from zschema.export import BigQueryTransformer
+
+        row = BigQueryTransformer(self.host, validate=True).transform(self.doc)
+        self.assertEqual(
+            {
+                "ip": 1,
+                "p443": {
+                    "tls": "t",
+                    "seen": "2017-06-16 20:33:23.000000",
+                    "updated": "2017-06-16 20:33:23+00:00",
+                },
+                "names": [{"name": ["a"]}, {"name": ["b"]}],
+                "tags": ["x"],
+            },
+            row,
+        )
+        columns = {f["name"] for f in self.host.to_bigquery()}
+        self.assertEqual(columns, set(row))
+
+    def test_validates(self):
+        from zschema.export import BigQueryTransformer
+
+        transformer = BigQueryTransformer(self.host, validate=True)
+        self.assertRaises(
+            DataValidationException, lambda: transformer.transform({"ip": "x"})
+        )
+
+    def test_unparseable_datetime(self):
+        from zschema.export import BigQueryTransformer
+
+        doc = {"443": {"seen": "not a date"}, "times": ["2020-02-30", None]}
+        record = Record(
+            {"443": SubRecord({"seen": DateTime()}), "times": ListOf(DateTime())}
+        )
+        for policy in ("warn", "ignore"):
+            transformer = BigQueryTransformer(record, validate=True, policy=policy)
+            row = transformer.transform(doc)
+            self.assertEqual({"443": {"seen": None}, "times": [None]}, row)
+        transformer = BigQueryTransformer(record)
+        self.assertRaises(DataValidationException, lambda: transformer.transform(doc))
+        nested = Record({"seen": NestedListOf(DateTime(), "time")})
+        row = BigQueryTransformer(nested, policy="ignore").transform(
+            {"seen": ["2020-02-30", "2020-02-03T00:00:00Z"]}
+        )
+        self.assertEqual({"seen": [{"time": ["2020-02-03 00:00:00.000000"]}]}, row)
+
+    def test_batches(self):
+        from zschema.export import BigQueryTransformer
+
+        transformer = BigQueryTransformer(self.host)
+        docs = [json.dumps(self.doc)] * 7
+        batches = list(transformer.iter_batches(docs, max_rows=3))
+        self.assertEqual([3, 3, 1], [len(b) for b in batches])
+        chunks = list(transformer.iter_load_chunks(docs, max_bytes=400))
+        self.assertEqual(7, sum(len(c.splitlines()) for c in chunks))
+        self.assertTrue(all(len(c) <= 400 for c in chunks))
+
+
+class PartitionedWriterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": Unsigned32BitInteger(),
+                Port(22): SubRecord({"ssh": SubRecord({"timestamp": DateTime()})}),
+                "name": String(),
+            }
+        )
+
+    def _doc(self, ip, timestamp):
+        return {"ip": ip, "22": {"ssh": {"timestamp": timestamp}}}
+
+    def test_partitions(self):
+        import tempfile
+        from zschema.export import BigQueryTransformer, PartitionedWriter
+
+        docs = [
+            self._doc(1, "2017-06-16T16:33:23-04:00"),
+            self._doc(2, "2017-06-16T23:33:23-04:00"),
+            self._doc(3, "2017-06-17T01:00:00+00:00"),
+            self._doc(4, None),
+            self._doc(5, "2017-06-16T01:00:00Z"),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            writer = PartitionedWriter(
+                directory,
+                self.host,
+                "22.ssh.timestamp",
+                max_open_files=1,
+                validate=True,
+                transform=BigQueryTransformer(self.host).transform,
+            )
+            with writer:
+                for doc in docs:
+                    writer.write(doc)
+            with open(os.path.join(directory, "manifest.json")) as fd:
+                manifest = json.load(fd)
+            rows = {p["partition"]: p["rows"] for p in manifest["partitions"]}
+            self.assertEqual({"20170616": 2, "20170617": 2, "__NULL__": 1}, rows)
+            with open(os.path.join(directory, "20170616.json")) as fd:
+                lines = [json.loads(l) for l in fd]
+            self.assertEqual([1, 5], [l["ip"] for l in lines])
+            self.assertIn("p22", lines[0])
+
+    def test_hour_granularity(self):
+        import tempfile
+        from zschema.export import PartitionedWriter
+
+        with tempfile.TemporaryDirectory() as directory:
+            writer = PartitionedWriter(
+                directory, self.host, "22.ssh.timestamp", granularity="hour"
+            )
+            doc = self._doc(1, "2017-06-16T16:33:23-04:00")
+            self.assertEqual("2017061620", writer.partition(doc))
+            writer.close()
+
+    def test_unparseable_datetime(self):
+        import tempfile
+        from zschema.export import PartitionedWriter
+
+        doc = self._doc(1, "garbage")
+        with tempfile.TemporaryDirectory() as directory:
+            with PartitionedWriter(
+                directory, self.host, "22.ssh.timestamp", validate=True, policy="warn"
+            ) as writer:
+                self.assertEqual("__INVALID__", writer.write(doc))
+            writer = PartitionedWriter(directory, self.host, "22.ssh.timestamp")
+            self.assertRaises(DataValidationException, writer.write, doc)
+            writer.close()
+            with PartitionedWriter(
+                directory, self.host, "22.ssh.timestamp", policy="ignore"
+            ) as writer:
+                self.assertEqual("__INVALID__", writer.write(doc))
+
+    def test_rejects_non_datetime_field(self):
+        from zschema.export import PartitionedWriter
+
+        self.assertRaises(
+            ValueError, lambda: PartitionedWriter("/tmp", self.host, "name")
+        )
+
+    def test_rejects_field_in_list(self):
+        from zschema.export import PartitionedWriter
+
+        record = Record(
+            {"evs": ListOf(SubRecord({"t": DateTime()})), "ts": ListOf(DateTime())}
+        )
+        for field in ("evs.t", "ts"):
+            self.assertRaises(
+                ValueError, lambda: PartitionedWriter("/tmp", record, field)
+            )
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        import subprocess
+        import sys
+
+        snippet = (
+            "import sys\n"
+            "import zschema.leaves, zschema.compounds, zschema.__main__\n"
+            "print(','.join(m for m in ('dateutil', 'pytz', 'six') "
+            "if m in sys.modules))\n"
+        )
+        out = subprocess.check_output([sys.executable, "-c", snippet])
+        self.assertEqual(b"", out.strip())
+
+    def test_datetime_fallback_parser(self):
+        leaf = DateTime()
+        self.assertEqual(
+            datetime.datetime(2015, 7, 8, 12, 52, 1, tzinfo=datetime.timezone.utc),
+            leaf.parse(leaf.VALID).astimezone(datetime.timezone.utc),
+        )
+        self.assertEqual(
+            datetime.timezone.utc, leaf.parse("2017-06-16 16:33:23").tzinfo
+        )
+
+
+class ArtifactTests(unittest.TestCase):
+
+    def setUp(self):
+        Certificate = SubRecordType(
+            {"subject": String(), "serial": Unsigned32BitInteger()},
+            doc="A certificate.",
+            type_name="Certificate",
+        )
+        self.host = Record(
+            {
+                "ip": Unsigned32BitInteger(doc="The IP"),
+                "leaf": Certificate(doc="The leaf."),
+                "chain": ListOf(Certificate()),
+                "state": Enum(values=["a", "b"]),
+                "seen": DateTime(),
+            }
+        )
+
+    def test_round_trip(self):
+        from zschema import artifact
+
+        loaded = artifact.loads(artifact.dumps(self.host))
+        self.assertEqual(self.host.to_bigquery(), loaded.to_bigquery())
+        self.assertEqual(self.host.to_es("host"), loaded.to_es("host"))
+        self.assertEqual("The leaf.", loaded["leaf"].doc)
+        self.assertEqual("A certificate.", loaded["chain"].object_.doc)
+        # both instances share one rebuilt SubRecordType class
+        self.assertIs(type(loaded["leaf"]), type(loaded["chain"].object_))
+        self.assertEqual("Certificate", type(loaded["leaf"]).__name__)
+        loaded.validate({"leaf": {"subject": "x"}, "seen": "2017-06-16T16:33:23Z"})
+        self.assertRaises(
+            DataValidationException, lambda: loaded.validate({"state": "c"})
+        )
+
+    def test_unset_options_are_not_stored(self):
+        import pickle
+
+        leaf = String()
+        state = leaf.__getstate__()
+        self.assertNotIn("_value_doc", state)
+        copy = pickle.loads(pickle.dumps(leaf))
+        self.assertIsNone(copy.doc)
+        self.assertFalse(copy.required)
+
+    def test_registry_round_trip(self):
+        import tempfile
+        from zschema import artifact
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "schemas.zsa")
+            artifact.dump_registry(path, {"host": self.host})
+            schemas = artifact.load_registry(path, register=False)
+        self.assertEqual(["host"], list(schemas))
+        self.assertRaises(ValueError, lambda: artifact.loads(b"nope"))
+
+
+class FromJSONTests(unittest.TestCase):
+
+    def setUp(self):
+        Certificate = SubRecordType(
+            {"subject": String(pr_index=1), "serial": Unsigned32BitInteger(pr_index=2)},
+            doc="A certificate.",
+            type_name="Certificate",
+        )
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True, pr_index=1),
+                "leaf": Certificate(doc="The leaf.", pr_index=2),
+                "chain": ListOf(Certificate(), max_items=4, pr_index=3),
+                "state": Enum(values=["a", "b"], pr_index=4),
+                "seen": DateTime(min_value="2000-01-01T00:00:00Z", pr_index=5),
+                "banner": String(exclude={"bigquery"}, es_include_raw=True, pr_index=6),
+                "ports": SubRecord(
+                    {Port(443): SubRecord({"open": Boolean(pr_index=1)}, pr_index=1)},
+                    pr_index=7,
+                ),
+                "names": NestedListOf(String(), "name", pr_index=8),
+            },
+            validation_policy="warn",
+        )
+
+    def test_round_trip(self):
+        loaded = Record.from_json(self.host.to_json())
+        self.assertEqual(self.host.to_dict(), loaded.to_dict())
+        self.assertEqual(self.host.to_bigquery(), loaded.to_bigquery())
+        self.assertEqual(self.host.to_es("host"), loaded.to_es("host"))
+        self.assertEqual(self.host.to_proto("host"), loaded.to_proto("host"))
+        self.assertEqual(self.host.docs_bq("host"), loaded.docs_bq("host"))
+        self.assertEqual(self.host.docs_es("host"), loaded.docs_es("host"))
+        self.assertEqual(list(self.host.to_flat()), list(loaded.to_flat()))
+        self.assertEqual("Certificate", type(loaded["leaf"]).__name__)
+        self.assertIs(type(loaded["leaf"]), type(loaded["chain"].object_))
+        self.assertEqual("warn", loaded.validation_policy)
+        self.assertEqual("Certificate", loaded["leaf"].type_name)
+        self.assertEqual("A certificate.", loaded["chain"].object_.doc)
+        self.assertEqual(4, loaded["chain"].max_items)
+        self.assertIsInstance(loaded["names"], NestedListOf)
+        self.assertTrue(loaded["banner"].exclude_bigquery)
+        self.assertIsInstance(list(loaded["ports"].definition)[0], Port)
+        self.assertRaises(
+            DataValidationException,
+            lambda: loaded.validate({"seen": "1999-01-01T00:00:00Z"}, policy="error"),
+        )
+
+    def test_unknown_type(self):
+        self.assertRaises(Exception, lambda: Record.from_dict({"type": "Nope"}))
+        self.assertRaises(Exception, lambda: Record.from_dict(String().to_dict()))
+
+    def test_types_by_name(self):
+        self.assertIs(String, Keyable._types_by_name["String"])
+        self.assertIs(Record, Keyable._types_by_name["Record"])
+        SubRecordType({}, type_name="ShouldNotRegister")
+        self.assertNotIn("ShouldNotRegister", Keyable._types_by_name)
+
+    def test_registry_json(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "schemas.json")
+            registry.dump_json(path, {"host": self.host})
+            schemas = registry.load_json(path, register=False)
+        self.assertEqual(self.host.to_dict(), schemas["host"].to_dict())
+
+
+class CopyOnWriteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Certificate = SubRecordType(
+            {
+                "subject": SubRecord({"cn": String()}),
+                "names": ListOf(String()),
+                "serial": Unsigned32BitInteger(),
+            },
+            type_name="Certificate",
+        )
+
+    def test_instances_share_fields(self):
+        first = self.Certificate()
+        second = self.Certificate()
+        self.assertIs(dict(first._fields())["serial"], dict(second._fields())["serial"])
+        # reading a schema does not copy anything
+        Record({"a": first, "b": second}).to_bigquery()
+        self.assertIs(dict(first._fields())["serial"], dict(second._fields())["serial"])
+
+    def test_access_copies(self):
+        first = self.Certificate()
+        second = self.Certificate()
+        first["subject"]["cn"].set("doc", "common name")
+        first["names"].object_.set("doc", "a name")
+        first.definition.get("serial").set("required", True)
+        self.assertIsNone(second["subject"]["cn"].doc)
+        self.assertIsNone(second["names"].object_.doc)
+        self.assertFalse(second["serial"].required)
+        self.assertIsNone(self.Certificate()["subject"]["cn"].doc)
+        for _, v in first.definition.items():
+            v.set("doc", "changed")
+        self.assertIsNone(second["serial"].doc)
+
+    def test_extends_shares_until_access(self):
+        base = SubRecord({"a": String(), "s": SubRecord({"x": String()})})
+        extended = SubRecord({"b": String()}, extends=base)
+        self.assertIs(dict(base._fields())["a"], dict(extended._fields())["a"])
+        extended["a"].set("doc", "extended")
+        base["s"]["x"].set("doc", "base")
+        self.assertIsNone(base["a"].doc)
+        self.assertIsNone(extended["s"]["x"].doc)
+        self.assertEqual(["a", "b", "s"], sorted(extended.definition))
+
+    def test_pickle_keeps_sharing(self):
+        import pickle
+
+        first = self.Certificate()
+        second = self.Certificate()
+        a, b = pickle.loads(pickle.dumps([first, second]))
+        self.assertIs(dict(a._fields())["serial"], dict(b._fields())["serial"])
+        a["serial"].set("doc", "a")
+        self.assertIsNone(b["serial"].doc)
+
+
+class InternLeavesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.record = Record(
+            {
+                "a": String(),
+                "b": String(),
+                "c": String(doc="c"),
+                "d": String(pr_index=4),
+                "e": Enum(values=["x"]),
+                "f": Enum(values=["x"]),
+                "g": Enum(values=["y"]),
+                "sub": SubRecord({"a": String(), "list": ListOf(String())}),
+            }
+        )
+
+    def test_intern(self):
+        bq = self.record.to_bigquery()
+        report = self.record.intern_leaves()
+        self.assertEqual(9, report["fields"])
+        self.assertEqual(9, report["leaves_before"])
+        self.assertEqual(5, report["leaves_after"])
+        self.assertLess(report["bytes_after"], report["bytes_before"])
+        fields = dict(self.record._fields())
+        sub = dict(fields["sub"]._fields())
+        self.assertIs(fields["a"], fields["b"])
+        self.assertIs(fields["a"], sub["a"])
+        self.assertIs(fields["a"], sub["list"].object_)
+        self.assertIs(fields["e"], fields["f"])
+        self.assertIsNot(fields["a"], fields["c"])
+        self.assertIsNot(fields["a"], fields["d"])
+        self.assertIsNot(fields["e"], fields["g"])
+        self.assertEqual(bq, self.record.to_bigquery())
+        self.assertEqual(4, self.record["d"].explicit_index)
+
+    def test_interned_leaves_copy_on_access(self):
+        self.record.intern_leaves()
+        self.record["a"].set("doc", "changed")
+        self.assertEqual("changed", self.record["a"].doc)
+        self.assertIsNone(self.record["b"].doc)
+        self.assertIsNone(self.record["sub"]["a"].doc)
+
+
+class FreezeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.Certificate = SubRecordType(
+            {"subject": String(pr_index=1), "serial": Unsigned32BitInteger(pr_index=2)},
+            type_name="Certificate",
+        )
+        self.record = Record(
+            {
+                "ip": IPv4Address(required=True, pr_index=1),
+                "leaf": self.Certificate(pr_index=2),
+                "chain": ListOf(self.Certificate(), pr_index=3),
+                "state": Enum(values=["a", "b"], pr_index=4),
+                "seen": DateTime(pr_index=5),
+                "ports": SubRecord(
+                    {Port(443): SubRecord({"open": Boolean(pr_index=1)}, pr_index=1)},
+                    pr_index=6,
+                ),
+            }
+        )
+        self.valid = {
+            "ip": "1.2.3.4",
+            "leaf": {"subject": "x", "serial": 1},
+            "chain": [{"serial": 2}],
+            "state": "a",
+            "seen": "2017-06-16T16:33:23Z",
+            "ports": {"443": {"open": True}},
+        }
+
+    def outputs(self, record):
+        return [
+            record.to_bigquery(),
+            record.to_es("host"),
+            record.to_proto("host"),
+            record.docs_bq("host"),
+            record.docs_es("host"),
+            record.to_dict(),
+            list(record.to_flat()),
+        ]
+
+    def test_outputs_unchanged(self):
+        expected = self.outputs(self.record)
+        frozen = self.record.freeze()
+        self.assertIs(self.record, frozen)
+        self.assertTrue(frozen.frozen)
+        self.assertEqual(expected, self.outputs(frozen))
+        frozen.validate(self.valid)
+        self.assertRaises(
+            DataValidationException, lambda: frozen.validate({"state": "c"})
+        )
+        self.assertRaises(
+            DataValidationException, lambda: frozen.validate({"chain": [{"x": 1}]})
+        )
+
+    def test_attributes_resolved(self):
+        self.record.freeze()
+        ip = self.record["ip"]
+        self.assertTrue(ip.frozen)
+        self.assertIs(True, ip.__dict__["required"])
+        self.assertEqual(IPv4Address.ES_TYPE, ip.__dict__["es_type"])
+        self.assertEqual("Certificate", self.record["leaf"].__dict__["type_name"])
+        self.assertEqual("error", self.record.__dict__["validation_policy"])
+
+    def test_immutable(self):
+        self.record.freeze()
+        ip = self.record["ip"]
+        self.assertRaises(FrozenSchemaException, lambda: ip.set("doc", "x"))
+        self.assertRaises(FrozenSchemaException, setattr, ip, "doc", "x")
+        self.assertRaises(FrozenSchemaException, setattr, ip, "_value_doc", "x")
+        self.assertRaises(
+            FrozenSchemaException, self.record.__setitem__, "new", String()
+        )
+        self.assertRaises(FrozenSchemaException, self.record.__delitem__, "ip")
+        self.assertRaises(FrozenSchemaException, self.record.definition.pop, "ip")
+        self.assertRaises(FrozenSchemaException, self.record.intern_leaves)
+        # private caches are allowed
+        ip._cache = 1
+
+    def test_shared_fields_are_copied(self):
+        self.record.freeze()
+        other = self.Certificate()
+        self.assertFalse(other.frozen)
+        self.assertFalse(other["subject"].frozen)
+        other["subject"].set("doc", "changed")
+        self.assertIsNone(self.record["leaf"]["subject"].doc)
+        self.assertFalse(self.Certificate()["serial"].frozen)
+
+    def test_pickle(self):
+        import copy
+        import pickle
+
+        self.record.freeze()
+        for loaded in (
+            pickle.loads(pickle.dumps(self.record)),
+            copy.deepcopy(self.record),
+        ):
+            self.assertTrue(loaded.frozen)
+            self.assertTrue(loaded["leaf"].frozen)
+            self.assertEqual(self.outputs(self.record), self.outputs(loaded))
+            self.assertRaises(FrozenSchemaException, lambda: loaded.set("doc", "x"))
+
+
+class FieldIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        Certificate = SubRecordType(
+            {"subject": String(doc="The subject."), "raw": String()},
+            type_name="Certificate",
+        )
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                Port(443): SubRecord(
+                    {
+                        "https": SubRecord(
+                            {
+                                "certificate": Certificate(),
+                                "chain": ListOf(Certificate()),
+                                "secret": String(exclude={"bigquery"}),
+                            }
+                        )
+                    }
+                ),
+                "private": SubRecord({"a": String()}, exclude={"elasticsearch"}),
+                "names": NestedListOf(String(), "name"),
+            }
+        )
+
+    def test_lookup(self):
+        index = self.host.field_index()
+        self.assertIs(index, self.host.field_index())
+        field = index["443.https.certificate.subject"]
+        self.assertEqual("The subject.", field.node.doc)
+        self.assertEqual("String", field.type)
+        self.assertEqual("nullable", field.mode)
+        self.assertEqual("required", index["ip"].mode)
+        self.assertEqual("SubRecord", index["443.https.certificate"].type)
+        self.assertEqual("repeated", index["443.https.chain"].mode)
+        self.assertEqual("nullable", index["443.https.chain.raw"].mode)
+        self.assertTrue(index["443.https.secret"].exclude_bigquery)
+        self.assertTrue(index["private.a"].exclude_elasticsearch)
+        self.assertFalse(index["private.a"].exclude_bigquery)
+        self.assertEqual(
+            [f["name"] for f in self.host.to_flat()], [f.path for f in index]
+        )
+
+    def test_bigquery_naming(self):
+        index = self.host.field_index("bq")
+        self.assertIn("p443.https.certificate.subject", index)
+        self.assertNotIn("443.https.certificate.subject", index)
+        self.assertEqual("repeated", index["names"].mode)
+        self.assertEqual("repeated", index["names.name"].mode)
+        self.assertRaises(Exception, lambda: self.host.field_index("xml"))
+
+    def test_raw_subfields(self):
+        record = Record(
+            {"banner": String(es_include_raw=True), "tags": ListOf(String())}
+        )
+        index = record.field_index()
+        self.assertEqual([f["name"] for f in record.to_flat()], [f.path for f in index])
+        raw = index["banner.raw"]
+        self.assertIs(index["banner"].node, raw.node)
+        self.assertTrue(raw.exclude_bigquery)
+        self.assertFalse(raw.exclude_elasticsearch)
+        self.assertNotIn("banner.raw", record.field_index("bq"))
+
+    def test_prefix(self):
+        index = self.host.field_index()
+        self.assertEqual(
+            [
+                "443.https.certificate",
+                "443.https.certificate.raw",
+                "443.https.certificate.subject",
+            ],
+            [f.path for f in index.prefix("443.https.certificate")],
+        )
+        self.assertEqual([], index.prefix("443.http"))
+
+    def test_sqlite(self):
+        import sqlite3
+        from zschema import catalog
+
+        db = sqlite3.connect(":memory:")
+        catalog.export_sqlite(db, {"host": self.host})
+        self.host.field_index().to_sqlite(db, "host")
+        rows = db.execute(
+            "SELECT path, type, mode FROM fields WHERE schema = 'host' "
+            "AND naming = 'bq' AND path LIKE 'p443.https.chain%' ORDER BY path"
+        ).fetchall()
+        self.assertEqual(
+            [
+                ("p443.https.chain", "SubRecord", "repeated"),
+                ("p443.https.chain.raw", "String", "nullable"),
+                ("p443.https.chain.subject", "String", "nullable"),
+            ],
+            rows,
+        )
+        count = db.execute("SELECT COUNT(*) FROM fields WHERE naming = 'es'")
+        self.assertEqual(len(self.host.field_index()), count.fetchone()[0])
+
+    def test_frozen_and_copies(self):
+        import pickle
+
+        self.host.freeze()
+        index = self.host.field_index()
+        self.assertIs(index, self.host.field_index())
+        self.assertNotIn(
+            "_field_indexes", pickle.loads(pickle.dumps(self.host)).__dict__
+        )
+
+
+class ProjectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                Port(443): SubRecord(
+                    {
+                        "https": SubRecord(
+                            {
+                                "tls": SubRecord(
+                                    {
+                                        "version": Enum(values=["TLSv1.2"]),
+                                        "names": ListOf(String(), max_items=1),
+                                    }
+                                ),
+                                "status": Enum(values=["ok"]),
+                            }
+                        )
+                    }
+                ),
+                "other": SubRecord(
+                    {"a": Unsigned8BitInteger(), "b": ListOf(SubRecord({}))}
+                ),
+            }
+        )
+
+    def test_projection(self):
+        fields = ["p443.https.tls"]
+        value = {
+            "ip": "not an ip",
+            "443": {"https": {"tls": {"version": "TLSv1.2"}, "status": "bad"}},
+            "other": {"a": 2**20, "b": [{"x": 1}]},
+        }
+        self.host.validate(value, fields=fields)
+        self.assertRaises(DataValidationException, self.host.validate, value)
+        bad = [
+            {"443": {"https": {"tls": {"version": "SSLv3"}}}},
+            {"443": {"https": {"tls": {"names": ["a", "b"]}}}},
+            {"443": {"https": {"unknown": 1}}},
+            {"443": {"https": "not a dict"}},
+            {"other": "not a dict"},
+            {"unknown": 1},
+        ]
+        for value in bad:
+            self.assertRaises(
+                DataValidationException,
+                self.host.validate,
+                value,
+                fields=fields,
+            )
+
+    def test_projection_paths(self):
+        value = {"ip": "1.2.3.4", "443": {"https": {"status": "bad"}}}
+        self.host.validate(value, fields=["443.https.tls", "ip"])
+        self.assertRaises(
+            DataValidationException,
+            self.host.validate,
+            value,
+            fields=["443.https"],
+        )
+        self.assertRaises(
+            DataValidationException,
+            self.host.validate,
+            {"ip": "x"},
+            fields=["ip"],
+        )
+        self.assertRaises(Exception, self.host.projection, ["p443.http"])
+
+    def test_projection_cached(self):
+        a = self.host.projection(["ip", "other"])
+        self.assertIs(a, self.host.projection(["other", "ip"]))
+        # the schema itself is unchanged
+        self.host.freeze()
+        self.assertIsNot(a, self.host.projection(["ip"]))
+        self.host.projection(["ip"]).validate({"ip": "1.2.3.4"})
+        self.assertRaises(
+            DataValidationException,
+            self.host.validate,
+            {"other": {"a": 2**20}},
+        )
+
+    def test_projection_policy(self):
+        self.host["other"].set("validation_policy", "ignore")
+        self.host.validate({"other": "not a dict"}, fields=["ip"])
+
+
+class ValidatePatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                Port(443): SubRecord(
+                    {
+                        "https": SubRecord(
+                            {
+                                "status": Enum(values=["ok", "error"]),
+                                "names": ListOf(String(), max_items=2),
+                                "tls": SubRecord(
+                                    {"version": String(required=True)},
+                                    required=True,
+                                ),
+                            }
+                        )
+                    }
+                ),
+                "free": SubRecord({"a": String()}, allow_unknown=True),
+            }
+        )
+
+    def test_valid_patches(self):
+        for patch in (
+            {},
+            {"ip": "1.2.3.4"},
+            {"443": {"https": {"status": "ok"}}},
+            {"443": {"https": {"status": None, "names": ["a"]}}},
+            {"443": {"https": {"tls": {"version": "TLSv1.2"}}}},
+            {"443": None},
+            {"free": {"anything": 1}},
+        ):
+            self.host.validate_patch(patch)
+
+    def test_invalid_patches(self):
+        for patch in (
+            {"ip": "not an ip"},
+            {"ip": None},
+            {"443": {"https": {"tls": None}}},
+            {"443": {"https": {"tls": {"version": None}}}},
+            {"443": {"https": {"status": "bad"}}},
+            {"443": {"https": {"names": ["a", "b", "c"]}}},
+            {"443": {"https": "not a dict"}},
+            {"443": {"http": {}}},
+            {"unknown": 1},
+            "not a dict",
+        ):
+            self.assertRaises(DataValidationException, self.host.validate_patch, patch)
+
+    def test_patch_policy(self):
+        patch = {"443": {"https": {"status": "bad"}}}
+        self.host.validate_patch(patch, policy="ignore")
+        self.host[Port(443)]["https"].set("validation_policy", "ignore")
+        self.host.validate_patch(patch)
+        try:
+            self.host.validate_patch({"443": {"https": {"tls": {"x": 1}}}}, "error")
+            self.fail("patch did not fail")
+        except DataValidationException as e:
+            self.assertEqual(["443", "https", "tls"], e.path)
+
+
+class ValidationCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "validated.db")
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "port": Unsigned32BitInteger(),
+            }
+        )
+        self.lines = [
+            '{"ip": "1.2.3.4", "port": 80}\n',
+            '{"ip": "1.2.3.5", "port": 443}\n',
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_cache(self, record=None, lines=None, **kwargs):
+        from zschema.cache import ValidationCache
+
+        with ValidationCache(self.path, record or self.host, **kwargs) as cache:
+            hits = [cache.validate(line) for line in lines or self.lines]
+        return cache, hits
+
+    def test_second_run_hits(self):
+        cache, hits = self.run_cache()
+        self.assertEqual([False, False], hits)
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+        cache, hits = self.run_cache()
+        self.assertEqual([True, True], hits)
+        # the same bytes, as bytes or with other surrounding whitespace
+        cache, hits = self.run_cache(
+            lines=[self.lines[0].strip().encode("utf-8"), "  " + self.lines[1]]
+        )
+        self.assertEqual([True, True], hits)
+
+    def test_invalid_not_cached(self):
+        from zschema.cache import ValidationCache
+
+        line = '{"ip": "not an ip"}'
+        with ValidationCache(self.path, self.host) as cache:
+            self.assertRaises(DataValidationException, cache.validate, line)
+            self.assertNotIn(line, cache)
+        with ValidationCache(self.path, self.host) as cache:
+            self.assertRaises(DataValidationException, cache.validate, line)
+
+    def test_contains_before_flush(self):
+        from zschema.cache import ValidationCache
+
+        with ValidationCache(self.path, self.host) as cache:
+            cache.add(self.lines[0])
+            self.assertIn(self.lines[0], cache)
+            self.assertNotIn(self.lines[1], cache)
+            cache.flush()
+            self.assertIn(self.lines[0], cache)
+
+    def test_schema_and_policy_changes(self):
+        self.run_cache()
+        changed = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "port": Unsigned8BitInteger(),
+            }
+        )
+        self.assertEqual([False, False], self.run_cache(changed)[1])
+        self.assertEqual([False, False], self.run_cache(policy="warn")[1])
+        self.assertEqual([True, True], self.run_cache()[1])
+
+    def test_fingerprint_classes_and_version(self):
+        from unittest import mock
+
+        import zschema
+        from zschema.cache import schema_fingerprint
+
+        class StrictIPv4Address(IPv4Address):
+            pass
+
+        fingerprint = schema_fingerprint(self.host)
+        strict = Record(
+            {
+                "ip": StrictIPv4Address(required=True),
+                "port": Unsigned32BitInteger(),
+            }
+        )
+        self.assertNotEqual(fingerprint, schema_fingerprint(strict))
+        self.assertEqual(fingerprint, schema_fingerprint(self.host.freeze()))
+        with mock.patch.object(zschema, "__version__", "0.0.0"):
+            self.assertNotEqual(fingerprint, schema_fingerprint(self.host))
+
+    def test_eviction(self):
+        import sqlite3
+
+        lines = ['{"port": %d, "ip": "1.2.3.4"}' % i for i in range(10)]
+        self.run_cache(lines=lines, max_entries=4)
+        db = sqlite3.connect(self.path)
+        count = "SELECT COUNT(*) FROM validated"
+        self.assertEqual(4, db.execute(count).fetchone()[0])
+        with db:
+            db.execute("UPDATE validated SET seen = seen - 7200")
+        self.run_cache(max_age=3600)
+        self.assertEqual(2, db.execute(count).fetchone()[0])
+        db.close()
+
+
+class AsyncValidationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "port": Unsigned32BitInteger(),
+            }
+        )
+        self.values = [{"ip": "1.2.3.%d" % i, "port": i} for i in range(200)]
+        self.values[7] = {"ip": "not an ip"}
+
+    def run_async(self, coroutine):
+        import asyncio
+
+        return asyncio.run(coroutine)
+
+    def test_avalidate(self):
+        self.run_async(self.host.avalidate(self.values[0]))
+        self.assertRaises(
+            DataValidationException,
+            self.run_async,
+            self.host.avalidate(self.values[7]),
+        )
+        self.run_async(self.host.avalidate(self.values[7], "ignore"))
+
+    def test_validate_stream(self):
+        from zschema import aio
+
+        async def collect():
+            return [
+                outcome
+                async for outcome in aio.validate_stream(
+                    self.host, self.values, batch_size=16, max_pending=32
+                )
+            ]
+
+        outcomes = self.run_async(collect())
+        self.assertEqual(self.values, [value for value, _ in outcomes])
+        errors = [i for i, (_, error) in enumerate(outcomes) if error is not None]
+        self.assertEqual([7], errors)
+        self.assertIsInstance(outcomes[7][1], DataValidationException)
+
+    def test_batches_and_backpressure(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from zschema import aio
+
+        sizes = []
+
+        class Executor(ThreadPoolExecutor):
+            def submit(self, fn, record, values, policy):
+                sizes.append(len(values))
+                return super(Executor, self).submit(fn, record, values, policy)
+
+        async def produce(validator):
+            futures = []
+            for value in self.values:
+                futures.append(await validator.submit(value))
+                self.assertLessEqual(validator._queue.qsize(), 8)
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        async def run(executor):
+            async with aio.AsyncValidator(
+                self.host, executor=executor, batch_size=4, max_pending=8
+            ) as validator:
+                results = await produce(validator)
+                await validator.validate(self.values[0])
+                with self.assertRaises(DataValidationException):
+                    await validator.validate(self.values[7])
+            return results
+
+        with Executor(1) as executor:
+            results = self.run_async(run(executor))
+        self.assertIsInstance(results[7], DataValidationException)
+        self.assertEqual(1, sum(1 for r in results if r is not None))
+        self.assertEqual(len(self.values) + 2, sum(sizes))
+        self.assertLessEqual(max(sizes), 4)
+        self.assertLess(len(sizes), len(self.values))
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        from zschema.server import ValidationServer
+
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "port": Unsigned32BitInteger(),
+            }
+        )
+        self.validator = ValidationServer(
+            {"host": self.host, "other": Record({"a": String()})},
+            default="host",
+            batch_size=2,
+        )
+        self.body = (
+            b'{"ip": "1.2.3.4", "port": 80}\n'
+            b'{"ip": "nope"}\n'
+            b"\n"
+            b"{not json\n"
+            b'{"ip": "1.2.3.5"}\n'
+        )
+
+    def tearDown(self):
+        self.validator.close()
+
+    def request(self, server, method, path, body=None, **kwargs):
+        import http.client
+        import threading
+
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        host, port = server.server_address
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        conn.request(method, path, body, **kwargs)
+        response = conn.getresponse()
+        data = response.read().decode("utf-8")
+        conn.close()
+        thread.join()
+        return response.status, data
+
+    def test_validate(self):
+        results = self.validator.validate("host", self.body.splitlines()[:2])
+        self.assertEqual([(True, None, None), (False, results[1][1], ["ip"])], results)
+        server = self.validator.make_server("127.0.0.1:0")
+        try:
+            for path in ("/validate", "/validate/host?policy=error"):
+                status, data = self.request(server, "POST", path, self.body)
+                self.assertEqual(200, status)
+                results = [json.loads(line) for line in data.splitlines()]
+                self.assertEqual([1, 2, 4, 5], [r["line"] for r in results])
+                self.assertEqual(
+                    [True, False, False, True], [r["valid"] for r in results]
+                )
+                self.assertEqual(["ip"], results[1]["path"])
+                self.assertIn("invalid JSON", results[2]["error"])
+            _, data = self.request(
+                server, "POST", "/validate/host?policy=ignore", self.body
+            )
+            self.assertEqual(3, data.count('"valid": true'))
+            self.assertEqual(404, self.request(server, "POST", "/validate/x", b"")[0])
+            status, _ = self.request(server, "POST", "/validate?policy=x", b"")
+            self.assertEqual(400, status)
+            chunks = iter([self.body[:20], self.body[20:]])
+            status, data = self.request(
+                server, "POST", "/validate", chunks, encode_chunked=True
+            )
+            self.assertEqual(200, status)
+            self.assertEqual(4, len(data.splitlines()))
+            status, _ = self.request(
+                server, "POST", "/validate", headers={"Transfer-Encoding": "gzip"}
+            )
+            self.assertEqual(411, status)
+        finally:
+            server.server_close()
+
+    def test_health_and_metrics(self):
+        server = self.validator.make_server("127.0.0.1:0")
+        try:
+            status, data = self.request(server, "GET", "/health")
+            self.assertEqual(200, status)
+            self.assertEqual(["host", "other"], json.loads(data)["schemas"])
+            self.request(server, "POST", "/validate/other", b'{"a": "b"}\n')
+            status, data = self.request(server, "GET", "/metrics")
+            self.assertEqual(200, status)
+            self.assertIn(
+                'zschema_records_total{schema="other",result="valid"} 1', data
+            )
+            self.assertIn(
+                'zschema_requests_total{endpoint="validate",status="200"} 1', data
+            )
+        finally:
+            server.server_close()
+
+    def test_unix_socket(self):
+        import socket
+        import tempfile
+        import threading
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "zschema.sock")
+            server = self.validator.make_server("unix:" + path)
+            thread = threading.Thread(target=server.handle_request)
+            thread.start()
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(path)
+            client.sendall(
+                b"POST /validate HTTP/1.1\r\nHost: x\r\nConnection: close\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(self.body), self.body)
+            )
+            data = b""
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            client.close()
+            thread.join()
+            server.server_close()
+        self.assertTrue(data.startswith(b"HTTP/1.1 200"))
+        self.assertEqual(4, data.count(b'"line"'))
+
+
+class RouterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.schemas = {
+            "host": Record({"ip": IPv4Address(required=True)}),
+            "certificate": Record({"type": String(), "serial": Unsigned32BitInteger()}),
+        }
+        self.values = [
+            {"type": "host", "ip": "1.2.3.4"},
+            {"type": "certificate", "serial": 7},
+            {"type": "host", "ip": "nope"},
+            {"type": "website"},
+            {"ip": "1.2.3.5"},
+            {"type": ["host"]},
+        ]
+
+    def test_field(self):
+        from zschema.routing import Router
+
+        router = Router(self.schemas, field="type")
+        outcomes = list(router.validate_stream(self.values))
+        self.assertEqual(
+            ["host", "certificate", "host", None, None, None],
+            [name for name, _ in outcomes],
+        )
+        self.assertEqual(
+            [False, False, True, True, True, True],
+            [error is not None for _, error in outcomes],
+        )
+        self.assertEqual(["ip"], outcomes[2][1].path)
+        summary = router.summary()
+        self.assertEqual(3, summary["unrouted"])
+        self.assertEqual(["certificate", "host"], sorted(summary["schemas"]))
+        self.assertEqual(2, summary["schemas"]["host"]["records"])
+        self.assertEqual({"ip": 1}, summary["schemas"]["host"]["error_paths"])
+        self.assertEqual("certificate", router.validate(self.values[1]))
+        self.assertRaises(DataValidationException, router.validate, self.values[3])
+
+    def test_default_key_and_freeze(self):
+        from zschema.routing import Router
+
+        router = Router(self.schemas, field="type", default="host")
+        self.assertEqual("host", router.validate(self.values[4]))
+        self.assertTrue(router.schemas["host"].frozen)
+        self.assertFalse(self.schemas["host"].frozen)
+        router = Router(
+            self.schemas, key=lambda v: "host" if "ip" in v else None, freeze=False
+        )
+        self.assertIs(self.schemas["host"], router.schemas["host"])
+        self.assertEqual("host", router.validate(self.values[4]))
+        self.assertEqual(None, router.route(self.values[1]))
+        self.assertRaises(Exception, Router, self.schemas)
+        self.assertRaises(Exception, Router, self.schemas, field="t", default="x")
+
+    def test_schemas_left_unchanged(self):
+        from zschema.routing import Router
+
+        serial = self.schemas["certificate"].definition["serial"]
+        Router(self.schemas, field="type")
+        self.assertFalse(serial.frozen)
+        serial.set("required", True)
+        self.assertRaises(
+            DataValidationException,
+            self.schemas["certificate"].validate,
+            {"serial": None},
+        )
+
+
+class ThreadSafetyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True, pr_index=1),
+                "ports": ListOf(Unsigned32BitInteger(), pr_index=2),
+                "tls": SubRecord(
+                    {"version": String(pr_index=1), "cipher": String(pr_index=2)},
+                    pr_index=3,
+                ),
+            }
+        )
+        self.values = [
+            {"ip": "1.2.3.%d" % (i % 256), "ports": [i], "tls": {"version": "x"}}
+            for i in range(1000)
+        ]
+        self.values[10] = {"ip": "nope"}
+        self.values[999] = {"tls": {"other": 1}, "ip": "1.1.1.1"}
+
+    def test_validate_many(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        errors = self.host.validate_many(self.values, workers=4)
+        self.assertEqual(len(self.values), len(errors))
+        self.assertEqual([10, 999], [i for i, e in enumerate(errors) if e])
+        self.assertIsInstance(errors[10], DataValidationException)
+        self.assertEqual(["tls"], errors[999].path)
+        with ThreadPoolExecutor(2) as executor:
+            again = self.host.validate_many(self.values, "ignore", executor=executor)
+        self.assertEqual([None] * len(self.values), again)
+
+    def test_shared_schema(self):
+        import threading
+
+        self.host.freeze()
+        results = []
+
+        def work():
+            for fields in (["ip"], ["tls.version"], ["ip", "ports"]):
+                self.host.validate(self.values[0], fields=fields)
+            results.append(self.host.to_proto("host"))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, len(results))
+        self.assertEqual(1, len(set(results)))
+        self.assertEqual(3, len(self.host._projections))
+
+    def test_proto_messages_per_record(self):
+        Named = SubRecordType({"a": String(pr_index=1)}, type_name="Named")
+        first = Record({"named": Named(pr_index=1)})
+        second = Record({"b": String(pr_index=1)})
+        self.assertIn("message Named", first.to_proto("first"))
+        self.assertNotIn("message Named", second.to_proto("second"))
+        # a second call still emits the named message
+        self.assertIn("message Named", first.to_proto("first"))
+
+    def test_proto_messages_outside_record(self):
+        from zschema.compounds import _proto_messages
+
+        named = SubRecord({"a": String(pr_index=1)}, type_name="Named")
+        self.assertEqual("Named x", named.to_proto("x", 0)["field"])
+        # the messages collected for the call are not left behind
+        self.assertIsNone(_proto_messages.get())
+
+    def test_replace(self):
+        warn = self.host.replace(validation_policy="warn")
+        self.assertEqual("warn", warn.validation_policy)
+        self.assertEqual("error", self.host.validation_policy)
+        warn.validate({"ip": "nope"})
+        self.host.freeze()
+        warn = self.host.replace(validation_policy="warn")
+        self.assertTrue(warn.frozen)
+        self.assertEqual("warn", warn.validation_policy)
+        self.assertEqual("error", self.host.validation_policy)
+        warn.validate({"ip": "nope"})
+        self.assertRaises(DataValidationException, self.host.validate, {"ip": "nope"})
+
+    def test_counter(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(8) as executor:
+            leaves = list(executor.map(lambda _: String(), range(2000)))
+        indexes = set(leaf.implicit_index for leaf in leaves)
+        self.assertEqual(2000, len(indexes))
+
+
+class SamplingTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+
+        self.host = Record(
+            {"ip": IPv4Address(), "pad": String(), "port": Unsigned32BitInteger()}
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for n in (300, 100):
+            path = os.path.join(self.directory.name, "part-%d.json" % n)
+            with open(path, "w") as fd:
+                for i in range(n):
+                    value = {"ip": "1.2.3.4", "pad": "x" * (i % 50), "port": 80}
+                    if i % 10 == 0:
+                        value["ip"] = "bad"
+                    elif i % 10 == 1:
+                        value["port"] = "bad"
+                    fd.write(json.dumps(value) + "\n")
+                fd.write("\n")
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_wilson_interval(self):
+        from zschema.sampling import wilson_interval
+
+        low, high = wilson_interval(5, 10)
+        self.assertAlmostEqual(0.2366, low, places=4)
+        self.assertAlmostEqual(0.7634, high, places=4)
+        low, high = wilson_interval(0, 10)
+        self.assertAlmostEqual(0.0, low)
+        self.assertAlmostEqual(0.2775, high, places=4)
+        self.assertEqual((0.0, 1.0), wilson_interval(0, 0))
+
+    def test_full_rate(self):
+        from zschema import sampling
+
+        report = sampling.estimate(self.host, self.paths, rate=1)
+        self.assertEqual(400, report.records)
+        self.assertEqual(80, report.invalid)
+        self.assertAlmostEqual(0.2, report.error_rate)
+        self.assertLess(report.interval[0], 0.2)
+        self.assertGreater(report.interval[1], 0.2)
+        self.assertEqual(["ip", "port"], sorted(report.paths))
+        self.assertAlmostEqual(0.1, report.paths["port"][0])
+        self.assertEqual(300, report.strata[self.paths[0]]["estimated_total"])
+        json.dumps(report.to_dict())
+
+    def test_paths_in_lists(self):
+        from zschema import sampling
+
+        record = Record({"chain": ListOf(SubRecord({"serial": Unsigned8BitInteger()}))})
+        path = os.path.join(self.directory.name, "chains.json")
+        with open(path, "w") as fd:
+            for chain in (
+                [{"serial": "a"}],
+                [{"serial": 1}, {"serial": "b"}],
+                [{"serial": 1}],
+                [{"serial": "a"}],
+            ):
+                fd.write(json.dumps({"chain": chain}) + "\n")
+        report = sampling.estimate(record, path, rate=1)
+        self.assertEqual(["chain[].serial"], list(report.paths))
+        self.assertAlmostEqual(0.75, report.paths["chain[].serial"][0])
+        self.assertEqual(
+            [('"a"', 2, 0), ('"b"', 1, 0)], report.rejected_values["chain[].serial"]
+        )
+
+    def test_reservoir(self):
+        from zschema import sampling
+
+        report = sampling.estimate(self.host, self.paths, size=40, seed=1)
+        self.assertEqual(40, report.records)
+        # stratified in proportion to the size of the files
+        self.assertGreater(report.strata[self.paths[0]]["records"], 25)
+        self.assertEqual(100, report.strata[self.paths[1]]["estimated_total"])
+        again = sampling.estimate(self.host, self.paths, size=40, seed=1)
+        self.assertEqual(report.to_dict(), again.to_dict())
+        self.assertRaises(Exception, sampling.sample, self.paths)
+        self.assertRaises(Exception, sampling.sample, self.paths, rate=2)
+
+    def test_seek(self):
+        from zschema import sampling
+
+        seek_min_bytes = sampling.SEEK_MIN_BYTES
+        sampling.SEEK_MIN_BYTES = 0
+        try:
+            strata = sampling.sample(self.paths[:1], size=200, seed=3)
+        finally:
+            sampling.SEEK_MIN_BYTES = seek_min_bytes
+        _, lines, count = strata[0]
+        self.assertEqual(200, len(lines))
+        for line, weight in lines:
+            self.assertEqual(1.0 / len(line), weight)
+            json.loads(line)
+        self.assertLess(abs(count - 300), 60)
+
+
+class FailFastTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "seen": DateTime(),
+                "state": Enum(values=["up", "down"]),
+                "names": ListOf(String(), max_items=2, min_items=1),
+                Port(443): SubRecord(
+                    {
+                        "https": SubRecord(
+                            {
+                                "status": Enum(values=["ok"]),
+                                "banner": String(validation_policy="warn"),
+                            }
+                        ),
+                        "free": SubRecord({}, allow_unknown=True),
+                    }
+                ),
+                "lax": SubRecord(
+                    {
+                        "a": Unsigned8BitInteger(),
+                        "strict": String(validation_policy="error"),
+                    },
+                    validation_policy="warn",
+                ),
+            }
+        )
+        self.valid = {
+            "ip": "1.2.3.4",
+            "seen": "2020-01-01T00:00:00Z",
+            "state": "up",
+            "names": ["a"],
+            "443": {"https": {"status": "ok", "banner": "x"}, "free": {"z": 1}},
+            "lax": {"a": 1, "strict": "s"},
+        }
+
+    def variants(self):
+        changes = [
+            {"ip": None},
+            {"ip": "nope"},
+            {"seen": "never"},
+            {"seen": 5.5},
+            {"state": "sideways"},
+            {"names": []},
+            {"names": ["a", "b", "c"]},
+            {"names": "a"},
+            {"names": [1]},
+            {"unknown": 1},
+            {"443": []},
+            {"443": {"https": {"status": "bad"}}},
+            {"443": {"https": {"banner": 1}}},
+            {"443": {"https": {"other": 1}}},
+            {"443": {"free": {"anything": [1, 2]}}},
+            {"lax": {"a": 2**20}},
+            {"lax": {"b": 1}},
+            {"lax": "not a dict"},
+            {"lax": {"strict": 1}},
+        ]
+        for change in changes:
+            value = dict(self.valid)
+            value.update(change)
+            yield value
+
+    def test_agrees_with_validate(self):
+        for policy in (None, "error", "warn", "ignore"):
+            for value in [self.valid, "not a dict"] + list(self.variants()):
+                try:
+                    self.host.validate(value, policy)
+                    expected = True
+                except DataValidationException:
+                    expected = False
+                self.assertEqual(
+                    expected, self.host.is_valid(value, policy), (policy, value)
+                )
+
+    def test_fail_fast_errors(self):
+        value = dict(self.valid, names=["a", "b", "c"])
+        try:
+            self.host.validate(value, fail_fast=True, path=["hosts", 3])
+            self.fail("did not raise")
+        except DataValidationException as e:
+            self.assertEqual(["hosts", 3, "names"], e.path)
+        value = dict(self.valid, **{"443": {"https": {"status": "bad"}}})
+        try:
+            self.host.validate(value, fail_fast=True)
+            self.fail("did not raise")
+        except DataValidationException as e:
+            self.assertEqual(["443", "https", "status"], e.path)
+        self.assertIs(self.host.checker(), self.host.checker())
+
+    def test_cost_order(self):
+        from zschema.failfast import compile_checker
+
+        value = dict(self.valid, seen="never", ip="nope", state="sideways")
+        paths = []
+        for costs in (None, {Enum: 5}, {Enum: 5, IPv4Address: 6}):
+            try:
+                compile_checker(self.host, costs=costs)(value)
+            except DataValidationException as e:
+                paths.append(e.path)
+        self.assertEqual([["state"], ["ip"], ["seen"]], paths)
+
+    def test_projection(self):
+        value = dict(self.valid, seen="never")
+        self.assertFalse(self.host.is_valid(value))
+        self.host.validate(value, fields=["ip", "443"], fail_fast=True)
+        self.assertRaises(
+            DataValidationException,
+            self.host.validate,
+            dict(value, lax=1),
+            "error",
+            fields=["ip"],
+            fail_fast=True,
+        )
+
+
+class WarningAggregatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(),
+                "names": ListOf(Enum(values=["a", "b"])),
+                "port": Unsigned8BitInteger(),
+            },
+            validation_policy="warn",
+        )
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def test_lazy_message(self):
+        class Loud(object):
+            formatted = 0
+
+            def __str__(self):
+                Loud.formatted += 1
+                return "loud"
+
+        e = DataValidationException(
+            "%s: the value %s is bad", path=["a", 1], format_args=("x", Loud())
+        )
+        self.assertEqual(0, Loud.formatted)
+        self.assertEqual("a.[1]: x: the value loud is bad", e.message)
+        self.assertEqual(e.message, str(e))
+        self.assertEqual(1, Loud.formatted)
+        e = pickle.loads(
+            pickle.dumps(
+                DataValidationException("%s is bad", path=["a"], format_args=(1,))
+            )
+        )
+        self.assertEqual("a: 1 is bad", e.message)
+
+    def test_aggregation(self):
+        from zschema.logs import WarningAggregator
+
+        aggregator = WarningAggregator(exemplars=2, interval=10, clock=self.clock)
+        with self.assertLogs(level="WARNING") as logs:
+            with aggregator:
+                for i in range(5):
+                    self.host.validate({"ip": "nope", "names": ["a", "c"]})
+                self.now = 11.0
+                self.host.validate({"port": 100000})
+                self.assertEqual(
+                    {
+                        ("ip", "%s: the value %s is not a valid IPv4 address"): 5,
+                        ("names[]", "%s: the value %s is not a valid enum option"): 5,
+                        ("port", "%s: %s is larger than max (%s)"): 1,
+                    },
+                    aggregator.counts(),
+                )
+        messages = [r.getMessage() for r in logs.records]
+        self.assertEqual(7, len(messages))
+        self.assertEqual(
+            "ip: ip: the value nope is not a valid IPv4 address", messages[0]
+        )
+        self.assertIn("port: port: 100000 is larger than max (65535)", messages)
+        self.assertIn(
+            "ip: 3 more warnings like '%s: the value %s is not a valid IPv4 address' "
+            "(5 in total)",
+            messages,
+        )
+        self.assertIn("names[]: 3 more warnings like", messages[-1])
+
+    def test_same_format_as_unaggregated(self):
+        import subprocess
+        import sys
+
+        snippet = (
+            "import sys\n"
+            "from zschema.compounds import Record\n"
+            "from zschema.leaves import IPv4Address\n"
+            "from zschema.logs import WarningAggregator\n"
+            "host = Record({'ip': IPv4Address()}, validation_policy='warn')\n"
+            "if sys.argv[1:]:\n"
+            "    with WarningAggregator(exemplars=5):\n"
+            "        host.validate({'ip': 'nope'})\n"
+            "else:\n"
+            "    host.validate({'ip': 'nope'})\n"
+        )
+        outputs = [
+            subprocess.run(
+                [sys.executable, "-c", snippet] + argv,
+                stderr=subprocess.PIPE,
+                check=True,
+            ).stderr
+            for argv in ([], ["aggregate"])
+        ]
+        self.assertTrue(outputs[0].startswith(b"WARNING:root:ip: "))
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_suppressed_not_formatted(self):
+        from zschema.logs import WarningAggregator
+
+        class Value(str):
+            formatted = 0
+
+            def __str__(self):
+                Value.formatted += 1
+                return str.__str__(self)
+
+        with self.assertLogs(level="WARNING"):
+            with WarningAggregator(exemplars=1, clock=self.clock):
+                for i in range(10):
+                    self.host.validate({"ip": Value("nope")})
+        self.assertEqual(1, Value.formatted)
+
+    def test_handler_restored(self):
+        from zschema import keys
+        from zschema.logs import WarningAggregator
+
+        default = keys._warning_handler
+        with self.assertLogs(level="WARNING"):
+            with WarningAggregator(exemplars=0) as aggregator:
+                self.assertIs(aggregator, keys._warning_handler)
+                self.host.validate({"ip": "nope"})
+        self.assertIs(default, keys._warning_handler)
+        with self.assertLogs(level="ERROR") as logs:
+            with WarningAggregator(exemplars=0):
+                self.assertRaises(
+                    DataValidationException, self.host.validate, {"ip": "nope"}, "error"
+                )
+        self.assertEqual(1, len(logs.records))
+
+
+class RejectedValuesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "seen": DateTime(),
+                "names": ListOf(Enum(values=["a", "b"])),
+                "blob": String(),
+            }
+        )
+
+    def test_space_saving(self):
+        from zschema.stats import SpaceSaving
+
+        summary = SpaceSaving(capacity=10)
+        stream = ["a"] * 50 + ["b"] * 30 + ["x%d" % i for i in range(40)] + ["a"] * 10
+        for item in stream:
+            summary.add(item)
+        # items seen more than 130 / 10 times are kept
+        self.assertEqual(10, len(summary))
+        self.assertEqual(len(stream), summary.total)
+        top = summary.top(2)
+        self.assertEqual(["a", "b"], [item for item, _, _ in top])
+        for item, count, error in top:
+            # the true count is between count - error and count
+            self.assertLessEqual(count - error, stream.count(item))
+            self.assertGreaterEqual(count, stream.count(item))
+
+    def test_merge(self):
+        from zschema.stats import SpaceSaving
+
+        whole = SpaceSaving(capacity=4)
+        parts = [SpaceSaving(capacity=4), SpaceSaving(capacity=4)]
+        stream = ["a"] * 40 + ["b"] * 25 + ["c%d" % (i % 13) for i in range(60)]
+        for i, item in enumerate(stream):
+            whole.add(item)
+            parts[i % 2].add(item)
+        parts[0].merge(parts[1])
+        self.assertEqual(len(stream), parts[0].total)
+        self.assertEqual(
+            [item for item, _, _ in whole.top(2)],
+            [item for item, _, _ in parts[0].top(2)],
+        )
+        for item, count, error in parts[0].top():
+            self.assertLessEqual(count - error, stream.count(item))
+            self.assertGreaterEqual(count, stream.count(item))
+
+    def test_value_key(self):
+        from zschema.stats import value_key
+
+        self.assertEqual('"TLSv9"', value_key("TLSv9"))
+        self.assertEqual('{"a": [1, 2]}', value_key({"a": [1, 2]}))
+        long_a, long_b = value_key("x" * 1000), value_key("x" * 999 + "y")
+        self.assertNotEqual(long_a, long_b)
+        self.assertTrue(long_a.startswith('"' + "x" * 63 + "..."))
+        self.assertIn("1002 chars", long_a)
+        self.assertLess(len(long_a), 120)
+
+    def test_stats(self):
+        from zschema.stats import ValidationStats
+
+        values = (
+            [{"seen": "2020-02-30T00:00:00Z"}] * 6
+            + [{"seen": "yesterday"}] * 2
+            + [{"names": ["a", "c"]}, {"names": ["d"]}, {"blob": "x" * 500}]
+        )
+        workers = [ValidationStats(), ValidationStats()]
+        for i, value in enumerate(values):
+            try:
+                self.host.validate(value, fail_fast=i % 2 == 0)
+                workers[i % 2].add(0.0)
+            except DataValidationException as e:
+                workers[i % 2].add(0.0, e)
+        stats = workers[0]
+        stats.merge(workers[1])
+        summary = stats.to_dict()
+        self.assertEqual({"seen": 8, "names[]": 2}, summary["error_paths"])
+        self.assertEqual(
+            [
+                {"value": '"2020-02-30T00:00:00Z"', "count": 6, "error": 0},
+                {"value": '"yesterday"', "count": 2, "error": 0},
+            ],
+            summary["rejected_values"]["seen"],
+        )
+        self.assertEqual(
+            ['"c"', '"d"'],
+            [v["value"] for v in summary["rejected_values"]["names[]"]],
+        )
+
+    def test_warnings(self):
+        from zschema import keys
+        from zschema.stats import ValidationStats
+
+        stats = ValidationStats()
+        previous = keys.set_warning_handler(lambda e, level: stats.add_warning(e))
+        try:
+            for value in ({"seen": "yesterday"}, {"names": ["a", "c"]}):
+                self.host.validate(value, "warn")
+                stats.add(0.0)
+        finally:
+            keys.set_warning_handler(previous)
+        summary = stats.to_dict()
+        self.assertEqual(0, summary["invalid"])
+        self.assertEqual({"seen": 1, "names[]": 1}, summary["warning_paths"])
+        self.assertEqual(
+            ['"yesterday"'], [v["value"] for v in summary["rejected_values"]["seen"]]
+        )
+
+    def test_value_of_errors(self):
+        for value, path, rejected in (
+            ({"seen": 12.5j}, ["seen"], 12.5j),
+            ({"names": "a"}, ["names"], "a"),
+            ({"other": 1}, [], "other"),
+            ([], [], []),
+        ):
+            for fail_fast in (False, True):
+                try:
+                    self.host.validate(value, fail_fast=fail_fast)
+                    self.fail("did not raise")
+                except DataValidationException as e:
+                    self.assertEqual(path, e.path)
+                    self.assertEqual(rejected, e.value)
+
+    def test_sampling(self):
+        import tempfile
+
+        from zschema import sampling
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as fd:
+            for i in range(100):
+                seen = "2020-01-01T00:00:00Z" if i % 4 else "never"
+                fd.write(json.dumps({"seen": seen}) + "\n")
+            fd.flush()
+            report = sampling.estimate(self.host, fd.name, rate=1.0)
+        self.assertEqual([('"never"', 25, 0)], report.rejected_values["seen"])
+        self.assertEqual(25, report.to_dict()["rejected_values"]["seen"][0]["count"])
+
+
+class ProfilingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(),
+                "seen": DateTime(),
+                "ports": ListOf(Unsigned32BitInteger()),
+                "http": SubRecord(
+                    {
+                        "status": Enum(values=["ok", "fail"]),
+                        "headers": ListOf(SubRecord({"name": String()})),
+                    }
+                ),
+            }
+        )
+        self.values = []
+        for i in range(200):
+            value = {
+                "ip": "10.0.0.%d" % (i % 50),
+                "seen": "2020-01-%02dT00:00:00Z" % (i % 28 + 1),
+                "ports": [80, 443, 8080][: i % 4],
+            }
+            if i % 2:
+                value["http"] = {
+                    "status": "ok",
+                    "headers": [{"name": "x" * j} for j in range(i % 3)],
+                }
+            elif i % 4 == 0:
+                value["http"] = None
+            if i == 7:
+                value["ports"] = "80"
+            self.values.append(value)
+
+    def test_hyperloglog(self):
+        from zschema.profiling import HyperLogLog
+
+        whole, left, right = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            whole.add("v%d" % i)
+            (left if i % 2 else right).add("v%d" % (i % 15000))
+        self.assertAlmostEqual(1.0, whole.estimate() / 20000, delta=0.05)
+        left.merge(right)
+        self.assertAlmostEqual(1.0, left.estimate() / 15000, delta=0.05)
+        small = HyperLogLog()
+        for i in range(30):
+            small.add(i % 10)
+        self.assertIsNone(small.registers)
+        self.assertEqual(10, round(small.estimate()))
+        self.assertRaises(Exception, small.merge, HyperLogLog(precision=10))
+
+    def test_profile(self):
+        from zschema.profiling import Profile
+
+        profile = Profile(self.host)
+        for value in self.values + [[]]:
+            profile.add(value)
+        result = profile.to_dict()
+        self.assertEqual(201, result["records"])
+        self.assertEqual(1, result["mismatched"])
+        fields = result["fields"]
+        self.assertEqual(
+            {"ip", "seen", "ports", "http", "http.status", "http.headers"}
+            | {"http.headers.name"},
+            set(fields),
+        )
+        self.assertEqual(50, fields["ip"]["distinct"])
+        self.assertEqual({"8-15": 200}, fields["ip"]["lengths"])
+        self.assertEqual("2020-01-01T00:00:00+00:00", fields["seen"]["min"])
+        self.assertEqual("2020-01-28T00:00:00+00:00", fields["seen"]["max"])
+        ports = fields["ports"]
+        self.assertEqual(("repeated", 1), (ports["mode"], ports["mismatched"]))
+        self.assertEqual({"0": 50, "1": 50, "2-3": 99}, ports["list_lengths"])
+        self.assertEqual((80, 8080), (ports["min"], ports["max"]))
+        http = fields["http"]
+        self.assertEqual(
+            (200, 100, 50), (http["count"], http["present"], http["nulls"])
+        )
+        self.assertEqual(0.5, http["presence"])
+        self.assertEqual(100, fields["http.status"]["count"])
+        self.assertEqual(1, fields["http.status"]["distinct"])
+        name = fields["http.headers.name"]
+        self.assertEqual(fields["http.headers"]["values"], name["count"])
+        self.assertEqual({"0": 67, "1": 33}, name["lengths"])
+
+    def test_merge(self):
+        import pickle
+
+        from zschema.profiling import Profile, profile_lines
+
+        whole = profile_lines(self.host, [json.dumps(v) for v in self.values])
+        parts = [Profile(self.host), Profile(self.host)]
+        for i, value in enumerate(self.values):
+            parts[i % 2].add(value)
+        merged = pickle.loads(pickle.dumps(parts[0]))
+        merged.merge(pickle.loads(pickle.dumps(parts[1])))
+        self.assertEqual(whole.to_dict(), merged.to_dict())
+        merged.add(self.values[0])
+        self.assertEqual(201, merged.records)
+
+    def test_files(self):
+        import tempfile
+
+        from zschema.profiling import profile_files, split
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hosts.json")
+            with open(path, "w") as fd:
+                for value in self.values:
+                    fd.write(json.dumps(value) + "\n")
+                fd.write("not json\n\n")
+            ranges = split(path, 4)
+            self.assertEqual(4, len(ranges))
+            self.assertEqual(0, ranges[0][0])
+            self.assertEqual(os.path.getsize(path), ranges[-1][1])
+            serial = profile_files(self.host, path)
+            parallel = profile_files(self.host, [path], workers=2)
+        self.assertEqual(201, serial.records)
+        self.assertEqual(1, serial.mismatched)
+        self.assertEqual(serial.to_dict(), parallel.to_dict())
+
+
+class PruningTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Record(
+            {
+                "ip": IPv4Address(required=True),
+                "name": String(),
+                "ports": ListOf(Unsigned32BitInteger()),
+                "http": SubRecord(
+                    {
+                        "status": String(),
+                        "title": String(),
+                        "headers": ListOf(SubRecord({"a": String(), "b": String()})),
+                    }
+                ),
+                "ssh": SubRecord({"banner": String(required=True)}),
+                "empty": SubRecord({"x": String()}),
+            }
+        )
+        self.values = [
+            {
+                "ip": "1.2.3.4",
+                "ports": [80],
+                "name": None,
+                "http": {"status": "ok", "headers": [{"a": "x"}, {"a": None}]},
+                "empty": {},
+            },
+            {"ip": "1.2.3.5", "http": {"headers": [{"a": "y"}]}},
+        ]
+
+    def test_observe(self):
+        from zschema.pruning import observe
+
+        counts = observe(self.host, self.values)
+        self.assertEqual(
+            {
+                "ip": 2,
+                "ports": 1,
+                "http": 2,
+                "http.status": 1,
+                "http.headers": 2,
+                "http.headers.a": 2,
+                "empty": 1,
+            },
+            dict(counts),
+        )
+        observe(self.host, self.values[:1], counts)
+        self.assertEqual(3, counts["ip"])
+
+    def test_prune(self):
+        from zschema.pruning import observe, prune
+
+        before = json.dumps(self.host.to_es("host"), sort_keys=True)
+        pruned, report = prune(self.host, observe(self.host, self.values))
+        self.assertEqual(
+            ["empty", "http.headers.b", "http.title", "name", "ssh"], report.dropped
+        )
+        self.assertEqual(
+            (13, 6, 7), (report.fields, report.kept_fields, report.dropped_fields)
+        )
+        self.assertEqual(
+            {
+                "ip": {"type": "ip"},
+                "ports": {"type": "long"},
+                "http": {
+                    "properties": {
+                        "status": {"type": "keyword"},
+                        "headers": {"properties": {"a": {"type": "keyword"}}},
+                    }
+                },
+            },
+            pruned.to_es("host")["host"]["properties"],
+        )
+        self.assertEqual(
+            ["http", "ip", "ports"], [f["name"] for f in pruned.to_bigquery()]
+        )
+        # the original is unchanged, and the copy validates the same
+        self.assertEqual(before, json.dumps(self.host.to_es("host"), sort_keys=True))
+        for value in self.values + [dict(self.values[1], ssh={"banner": "b"})]:
+            pruned.validate(value)
+        self.assertRaises(
+            DataValidationException,
+            pruned.validate,
+            {"ip": "1.2.3.4", "ssh": {"banner": None}},
+        )
+
+    def test_required_subrecord(self):
+        from zschema.pruning import prune
+
+        record = Record(
+            {
+                "ip": IPv4Address(),
+                "tls": SubRecord(
+                    {"version": String(), "cipher": String()}, required=True
+                ),
+            }
+        )
+        pruned, report = prune(record, {"ip"})
+        self.assertEqual([], report.dropped)
+        self.assertEqual(record.to_es("host"), pruned.to_es("host"))
+        self.assertEqual(record.to_bigquery(), pruned.to_bigquery())
+
+    def test_targets_and_frozen(self):
+        from zschema.pruning import prune
+
+        self.host.freeze()
+        pruned, report = prune(self.host, {"ip", "name"}, targets=["bigquery"])
+        self.assertEqual(["ip", "name"], [f["name"] for f in pruned.to_bigquery()])
+        self.assertEqual(self.host.to_es("host"), pruned.to_es("host"))
+        self.assertRaises(Exception, prune, self.host, set(), targets=["avro"])
+
+    def test_profile(self):
+        from zschema.profiling import Profile
+        from zschema.pruning import observe, observed_in_profile
+
+        profile = Profile(self.host)
+        for value in self.values:
+            profile.add(value)
+        expected = set(observe(self.host, self.values))
+        self.assertEqual(expected, observed_in_profile(profile))
+        self.assertEqual(expected, observed_in_profile(profile.to_dict()))